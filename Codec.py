@@ -0,0 +1,157 @@
+import json
+from abc import ABC, abstractmethod
+from enum import Enum, unique
+from typing import Any, Dict, Union
+
+# optional codecs, which are only available if the respective package is installed
+try:
+	import orjson
+except ImportError:
+	orjson = None
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+# Encoded payloads start with a header: HEADER_MAGIC, the header version and the id of the codec.
+# Payloads are decoded with the codec of their header, independent of the codec selected for encoding, such that
+# processes with different codecs can be run side by side while a deployment migrates. Payloads without header
+# are JSON written by versions without codec.
+HEADER_MAGIC = b'\x00YS'
+HEADER_VERSION = 1
+HEADER_LENGTH = len(HEADER_MAGIC) + 2
+
+
+@unique
+class CodecName(Enum):
+	# stdlib json
+	JSON = 'json'
+	# JSON encoded and decoded by orjson (requires package orjson)
+	ORJSON = 'orjson'
+	# compact binary encoding (requires package msgpack)
+	MSGPACK = 'msgpack'
+
+
+class PayloadCodec(ABC):
+
+	def __init__(self, name: CodecName, codec_id: int, produces_json: bool):
+		self.name = name
+		self.codec_id = codec_id
+		# whether the encoded body is JSON text, which can be sent to socket.io clients as is
+		self.produces_json = produces_json
+
+	def encode(self, value: Any) -> bytes:
+		return HEADER_MAGIC + bytes([HEADER_VERSION, self.codec_id]) + self.encode_body(value)
+
+	@abstractmethod
+	def encode_body(self, value: Any) -> bytes: raise NotImplementedError
+
+	@abstractmethod
+	def decode_body(self, data: bytes) -> Any: raise NotImplementedError
+
+
+class JsonCodec(PayloadCodec):
+
+	def __init__(self):
+		super().__init__(CodecName.JSON, 1, True)
+
+	def encode_body(self, value: Any) -> bytes:
+		return json.dumps(value).encode('utf-8')
+
+	def decode_body(self, data: bytes) -> Any:
+		return json.loads(data)
+
+
+class OrjsonCodec(PayloadCodec):
+
+	def __init__(self):
+		super().__init__(CodecName.ORJSON, 2, True)
+
+	def encode_body(self, value: Any) -> bytes:
+		return orjson.dumps(value)
+
+	def decode_body(self, data: bytes) -> Any:
+		return orjson.loads(data)
+
+
+class MsgpackCodec(PayloadCodec):
+
+	def __init__(self):
+		super().__init__(CodecName.MSGPACK, 3, False)
+
+	def encode_body(self, value: Any) -> bytes:
+		return msgpack.packb(value, use_bin_type=True)
+
+	def decode_body(self, data: bytes) -> Any:
+		return msgpack.unpackb(data, raw=False)
+
+
+_codecs_by_id: Dict[int, PayloadCodec] = {}
+_legacy_codec = JsonCodec()
+_codec: PayloadCodec = _legacy_codec
+
+
+def create_codec(name: CodecName) -> PayloadCodec:
+	if name is CodecName.ORJSON:
+		if orjson is None:
+			raise ValueError('Codec \'{}\' requires the package orjson.'.format(name.value))
+		return OrjsonCodec()
+	if name is CodecName.MSGPACK:
+		if msgpack is None:
+			raise ValueError('Codec \'{}\' requires the package msgpack.'.format(name.value))
+		return MsgpackCodec()
+	return JsonCodec()
+
+
+def _register_available_codecs() -> None:
+	for name in CodecName:
+		try:
+			codec = create_codec(name)
+		except ValueError:
+			continue
+		_codecs_by_id[codec.codec_id] = codec
+
+
+# selects the codec used by encode(...) in this process
+def set_codec(name: CodecName) -> None:
+	global _codec
+	_codec = create_codec(name)
+
+
+def get_codec() -> PayloadCodec:
+	return _codec
+
+
+def encode(value: Any) -> bytes:
+	return _codec.encode(value)
+
+
+def decode(data: Union[bytes, str]) -> Any:
+	codec, body = _split_header(data)
+	return codec.decode_body(body)
+
+
+# decodes the payload to JSON text, JSON bodies are returned without decoding and encoding them again
+def decode_to_json_text(data: Union[bytes, str]) -> str:
+	codec, body = _split_header(data)
+	if codec.produces_json:
+		return body.decode('utf-8')
+	return json.dumps(codec.decode_body(body))
+
+
+def _split_header(data: Union[bytes, str]):
+	if isinstance(data, str):
+		data = data.encode('utf-8')
+	if not data.startswith(HEADER_MAGIC):
+		return _legacy_codec, data
+	version = data[len(HEADER_MAGIC)]
+	if version != HEADER_VERSION:
+		raise ValueError('Unsupported codec header version: {}'.format(version))
+	codec_id = data[len(HEADER_MAGIC) + 1]
+	codec = _codecs_by_id.get(codec_id)
+	if codec is None:
+		raise ValueError('Payload encoded with codec {}, which is not available in this process.'.format(codec_id))
+	return codec, data[HEADER_LENGTH:]
+
+
+_register_available_codecs()
@@ -0,0 +1,50 @@
+import os
+import socket
+from enum import Enum, unique
+
+import redis
+
+from Codec import encode
+from Constants import General
+from Tracing import get_current_span_context
+
+CONSUMER_GROUP_NAME = General.APP_NAME + '_consumers'
+STREAM_NAME_POSTFIX = '_stream'
+# same field name as in pub/sub messages, such that consumers handle messages of both transports alike
+STREAM_MESSAGE_FIELD = 'data'
+# field names of stream entries read by clients which do not decode responses
+STREAM_MESSAGE_FIELD_BYTES = STREAM_MESSAGE_FIELD.encode('utf-8')
+# streams are trimmed to approximately this number of entries
+STREAM_MAX_LENGTH = 10000
+
+
+@unique
+class CommandTransport(Enum):
+	# commands published while no consumer is subscribed are lost
+	PUBSUB = 'pubsub'
+	# commands are persisted and acknowledged by a consumer group, unacknowledged commands are redelivered
+	STREAMS = 'streams'
+
+
+def get_stream_name(channel_name: str) -> str:
+	return channel_name + STREAM_NAME_POSTFIX
+
+
+def get_unique_consumer_name() -> str:
+	return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def publish_command(db: redis.Redis, transport: CommandTransport, channel_name: str, event_name: str, payload, sid,
+					received_at: float = None) -> None:
+	# the span context of the publisher is propagated, such that the handling of the command continues its trace
+	span_context = get_current_span_context()
+	message = encode({General.EVENT_NAME: event_name,
+					  General.EVENT_PAYLOAD: payload,
+					  General.SID: sid,
+					  General.RECEIVED_AT: received_at,
+					  General.TRACE_ID: span_context.trace_id if span_context else None,
+					  General.PARENT_SPAN_ID: span_context.span_id if span_context else None})
+	if transport is CommandTransport.STREAMS:
+		db.xadd(get_stream_name(channel_name), {STREAM_MESSAGE_FIELD: message}, maxlen=STREAM_MAX_LENGTH, approximate=True)
+	else:
+		db.publish(channel_name, message)
@@ -12,11 +12,23 @@ class General:
 	REDIS_URL = 'redis://localhost:6379/'
 	QUEUE_CHANNEL_NAME_PLAYER_COMMANDS = APP_NAME + '_player_commands'
 	QUEUE_CHANNEL_NAME_SEARCH = APP_NAME + '_search'
+	QUEUE_CHANNEL_NAME_STATE_INVALIDATION = APP_NAME + '_state_invalidation'
 
 	EVENT_NAME = 'event_name'
 	EVENT_PAYLOAD = 'payload'
 	SID = 'sid'
+	# time (seconds since the epoch) at which the server received the command from the client
+	RECEIVED_AT = 'received_at'
+	# span context of the publisher of the command, see Tracing
+	TRACE_ID = 'trace_id'
+	PARENT_SPAN_ID = 'parent_span_id'
 	RECEIVED_EVENT = 'received_event'
+	PLAYBACK_CLOCK_POSITION = 'position'
+	PLAYBACK_CLOCK_RATE = 'rate'
+	PLAYBACK_CLOCK_TIMESTAMP = 'timestamp'
+	PLAYLIST_VERSION = 'version'
+	PLAYLIST_ENTRIES = 'entries'
+	PLAYLIST_ENTRY_ID = 'playlist_entry_id'
 
 	SERVER_LOGGER_NAME_PREFIX = create_logger_name(APP_NAME, 'server')
 	PLAYER_LOGGER_NAME_PREFIX = create_logger_name(APP_NAME, 'player')
@@ -31,6 +43,11 @@ class General:
 	VLC_STREAM_NAME_AAC = 'yousonos.mp4'
 	VLC_TRANSCODE_CMD_AAC = ':sout=#transcode{aenc=ffmpeg{strict=-2},acodec=mp4a,ab=' + VLC_STREAM_QUALITY + '}:standard{mux=raw,dst=/' + VLC_STREAM_NAME_AAC + ',access=http,sap}'
 	VLC_TRANSCODE_CMD = ':sout=#transcode{acodec=mp3,ab=' + VLC_STREAM_QUALITY + '}:standard{mux=raw,dst=/' + OUT_STREAM_NAME + ',access=http,sap}'
+	# continuous output stream mode: VLC serves the stream of the current track locally, the output stream is served
+	# by the player. The sample rate and channels are fixed, such that all tracks can be spliced into one stream.
+	CONTINUOUS_STREAM_SOURCE_PORT = 8081
+	CONTINUOUS_STREAM_SOURCE_URL = 'http://127.0.0.1:' + str(CONTINUOUS_STREAM_SOURCE_PORT) + '/' + OUT_STREAM_NAME
+	VLC_CONTINUOUS_TRANSCODE_CMD = ':sout=#transcode{acodec=mp3,ab=' + VLC_STREAM_QUALITY + ',samplerate=44100,channels=2}:standard{mux=raw,dst=127.0.0.1:' + str(CONTINUOUS_STREAM_SOURCE_PORT) + '/' + OUT_STREAM_NAME + ',access=http}'
 
 
 @unique
@@ -43,11 +60,12 @@ class SendEvent(Enum):
 	SONOS_SETUP = 'sonos_setup'
 	VOLUME_CHANGED = 'volume_changed'
 	PLAYLIST_CHANGED = 'playlist_changed'
+	PLAYLIST_DELTA = 'playlist_delta'
 	SEARCH_RESULTS = 'search_results'
 	CURRENT_TRACK = 'current_track'
 	NEW_TRACK_PLAYING = 'new_track_playing'
 	PLAYER_STATE = 'player_state'
-	PLAYER_TIME = 'player_time'
+	PLAYBACK_CLOCK = 'playback_clock'
 	PLAYER_TIME_UPDATE_ACTIVATION = 'player_time_update_activation'
 
 
@@ -67,6 +85,7 @@ class ReceiveEvent(Enum):
 	PREVIOUS_TRACK = 'previous_track'
 	NEXT_TRACK = 'next_track'
 	SEEK_TO = 'seek_to'
+	REQUEST_PLAYLIST = 'request_playlist'
 
 
 @unique
@@ -74,7 +93,12 @@ class DbKey(Enum):
 	SONOS_SETUP = 'sonos_setup'
 	CURRENT_TRACK = 'current_track'
 	PLAYER_STATE = 'player_state'
+	# key of the playlist in the state invalidation channel (and of the playlist of versions before per entry storage)
 	PLAYLIST = 'playlist'
+	PLAYLIST_ENTRY_IDS = 'playlist_entry_ids'
+	PLAYLIST_VERSION = 'playlist_version'
+	WORKER_POOL_STATISTICS = 'worker_pool_statistics'
+	PLAYBACK_CLOCK = 'playback_clock'
 
 
 @unique
@@ -84,6 +108,7 @@ class ServerLoggerName(Enum):
 	ENGINEIO = create_logger_name(General.SERVER_LOGGER_NAME_PREFIX, General.ENGINEIO_LOGGER_NAME_POSTFIX)
 	EVENTLET = create_logger_name(General.SERVER_LOGGER_NAME_PREFIX, General.EVENTLET_LOGGER_NAME_POSTFIX)
 	EVENTS = create_logger_name(General.SERVER_LOGGER_NAME_PREFIX, 'events')
+	STATE_SNAPSHOT = create_logger_name(General.SERVER_LOGGER_NAME_PREFIX, 'state_snapshot')
 
 
 @unique
@@ -97,5 +122,13 @@ class PlayerLoggerName(Enum):
 	EVENT_CONSUMER = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'event_consumer')
 	PLAYLIST_ENTRY = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'playlist_entry')
 	SONOS_ENVIRONMENT = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'sonos_environment')
+	SONOS_DISCOVERY = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'sonos_discovery')
+	CONTINUOUS_STREAM = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'continuous_stream')
 	TRACK = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'track')
 	SEARCH_SERVICE = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'search_service')
+	VIDEO_METADATA_CACHE = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'video_metadata_cache')
+	TRANSCODED_AUDIO_CACHE = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'transcoded_audio_cache')
+	TRACK_REFRESH_SCHEDULER = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'track_refresh_scheduler')
+	SEARCH_RESULT_CACHE = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'search_result_cache')
+	WORKER_POOL = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'worker_pool')
+	PLAYBACK_CLOCK = create_logger_name(General.PLAYER_LOGGER_NAME_PREFIX, 'playback_clock')
@@ -0,0 +1,247 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from enum import Enum, unique
+from threading import Event, Lock
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import redis
+
+from Constants import General, create_logger_name
+from Util import StoppableThread
+
+METRIC_KEY_PREFIX = General.APP_NAME + '_metrics:'
+# gauges of a process expire if the process does not report them anymore
+GAUGE_EXPIRATION_FACTOR = 3
+LATENCY_BUCKETS_IN_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FIELD_SEPARATOR = '\t'
+SUM_FIELD = 'sum'
+COUNT_FIELD = 'count'
+INFINITY_BUCKET = '+Inf'
+
+# used by the player and the server
+logger = logging.getLogger(create_logger_name(General.APP_NAME, 'metrics'))
+
+
+@unique
+class MetricType(Enum):
+	COUNTER = 'counter'
+	GAUGE = 'gauge'
+	HISTOGRAM = 'histogram'
+
+
+@unique
+class Metric(Enum):
+	# from the reception of the command by the server until the command was handled by the player
+	COMMAND_LATENCY = ('command_latency_seconds', MetricType.HISTOGRAM,
+					   'Latency from the reception of a command by the server until it was handled.')
+	COMMAND_HANDLING = ('command_handling_seconds', MetricType.HISTOGRAM, 'Time spent handling a command.')
+	TRACK_START_PHASE = ('track_start_phase_seconds', MetricType.HISTOGRAM,
+						 'Duration of the phases of starting a track (resolve, create_vlc_media, set_media, play_uri).')
+	TRACK_HANDOFF = ('track_handoff_seconds', MetricType.HISTOGRAM,
+					 'Time from the end of a track until the next track started playing.')
+	SEARCH_TIME_TO_FIRST_RESULT = ('search_time_to_first_result_seconds', MetricType.HISTOGRAM,
+								   'Time from the start of a search until its first results were emitted.')
+	YOUTUBE_RESOLUTIONS = ('youtube_resolutions_total', MetricType.COUNTER,
+						   'Resolutions of YouTube videos and playlists by result.')
+	EXECUTOR_QUEUED_TASKS = ('executor_queued_tasks', MetricType.GAUGE, 'Tasks waiting for a worker of a lane.')
+	EXECUTOR_RUNNING_TASKS = ('executor_running_tasks', MetricType.GAUGE, 'Tasks running on the workers of a lane.')
+	SONOS_CALLS = ('sonos_call_statistics', MetricType.GAUGE,
+				   'Calls of each Sonos device since the start of the process (calls, failures, timeouts, latencies).')
+	CONTINUOUS_STREAM = ('continuous_stream_statistics', MetricType.GAUGE,
+						 'Listeners and frames of the continuous stream since the start of the process.')
+	AUDIO_CACHE = ('audio_cache_statistics', MetricType.GAUGE,
+				   'Hits, misses, transcodings and size of the transcoded audio cache since the start of the process.')
+	SEARCH_RESULT_CACHE = ('search_result_cache_statistics', MetricType.GAUGE,
+						   'Hits, misses and size of the search result cache since the start of the process.')
+
+	def __init__(self, metric_name: str, metric_type: MetricType, description: str):
+		self.metric_name = General.APP_NAME + '_' + metric_name
+		self.metric_type = metric_type
+		self.description = description
+
+	def get_key(self, process_name: str = None) -> str:
+		key = METRIC_KEY_PREFIX + self.metric_name
+		return key + ':' + process_name if process_name else key
+
+
+# Metrics are recorded in memory and are added to the metrics in redis by a MetricsReporter of the process, such that
+# recording a metric never costs a redis round trip. Counters and histograms (one counter per bucket) of all
+# processes are accumulated in one hash per metric, gauges are stored per process.
+class MetricsRegistry:
+
+	def __init__(self):
+		self._lock = Lock()
+		self._increments: Dict[Tuple[Metric, str], float] = {}
+		self._gauges: Dict[Tuple[Metric, str], float] = {}
+
+	def increment(self, metric: Metric, labels: Dict[str, str], amount: float = 1) -> None:
+		self._add(metric, _format_labels(labels), amount)
+
+	def observe(self, metric: Metric, labels: Dict[str, str], value: float) -> None:
+		label_text = _format_labels(labels)
+		index = bisect.bisect_left(LATENCY_BUCKETS_IN_SECONDS, value)
+		bucket = str(LATENCY_BUCKETS_IN_SECONDS[index]) if index < len(LATENCY_BUCKETS_IN_SECONDS) else INFINITY_BUCKET
+		with self._lock:
+			self._add_unlocked(metric, label_text + FIELD_SEPARATOR + bucket, 1)
+			self._add_unlocked(metric, label_text + FIELD_SEPARATOR + SUM_FIELD, value)
+			self._add_unlocked(metric, label_text + FIELD_SEPARATOR + COUNT_FIELD, 1)
+
+	def set_gauge(self, metric: Metric, labels: Dict[str, str], value: float) -> None:
+		with self._lock:
+			self._gauges[(metric, _format_labels(labels))] = value
+
+	def flush(self, db: redis.Redis, process_name: str, gauge_ttl_in_seconds: int) -> None:
+		with self._lock:
+			increments = self._increments
+			gauges = self._gauges
+			self._increments = {}
+			self._gauges = {}
+		if not increments and not gauges:
+			return
+		pipeline = db.pipeline(transaction=False)
+		for (metric, field), amount in increments.items():
+			if isinstance(amount, float):
+				pipeline.hincrbyfloat(metric.get_key(), field, amount)
+			else:
+				pipeline.hincrby(metric.get_key(), field, amount)
+		gauge_keys = set()
+		for (metric, field), value in gauges.items():
+			pipeline.hset(metric.get_key(process_name), field, value)
+			gauge_keys.add(metric.get_key(process_name))
+		for gauge_key in gauge_keys:
+			pipeline.expire(gauge_key, gauge_ttl_in_seconds)
+		try:
+			pipeline.execute()
+		except redis.RedisError:
+			logger.warning('Flushing %d metric values failed, the values are dropped.', len(increments) + len(gauges),
+						   exc_info=True)
+
+	def _add(self, metric: Metric, field: str, amount: float) -> None:
+		with self._lock:
+			self._add_unlocked(metric, field, amount)
+
+	def _add_unlocked(self, metric: Metric, field: str, amount: float) -> None:
+		key = (metric, field)
+		self._increments[key] = self._increments.get(key, 0) + amount
+
+
+# Flushes the metrics recorded in the process to redis every interval_in_seconds. Collectors are called before each
+# flush, e.g. to sample gauges.
+class MetricsReporter(StoppableThread):
+
+	def __init__(self, db: redis.Redis, process_name: str, interval_in_seconds: int):
+		super().__init__(name='MetricsReporterThread')
+		self._db = db
+		self._process_name = process_name
+		self._interval_in_seconds = interval_in_seconds
+		self._collectors: List[Callable[[], None]] = []
+		self._exit_event = Event()
+
+	def add_collector(self, collector: Callable[[], None]) -> None:
+		self._collectors.append(collector)
+
+	def stop(self) -> None:
+		self._exit_event.set()
+
+	def run(self) -> None:
+		while not self._exit_event.wait(self._interval_in_seconds):
+			self._report()
+		self._report()
+
+	def _report(self) -> None:
+		for collector in self._collectors:
+			try:
+				collector()
+			except Exception:
+				logger.warning('Collecting metrics failed.', exc_info=True)
+		_registry.flush(self._db, self._process_name, self._interval_in_seconds * GAUGE_EXPIRATION_FACTOR)
+
+
+_registry = MetricsRegistry()
+
+
+def increment(metric: Metric, amount: float = 1, **labels: str) -> None:
+	_registry.increment(metric, labels, amount)
+
+
+def observe(metric: Metric, value: float, **labels: str) -> None:
+	_registry.observe(metric, labels, value)
+
+
+def set_gauge(metric: Metric, value: float, **labels: str) -> None:
+	_registry.set_gauge(metric, labels, value)
+
+
+# observes the duration of the block in seconds, also if the block raises
+@contextmanager
+def timed(metric: Metric, **labels: str) -> Iterator[None]:
+	start = time.monotonic()
+	try:
+		yield
+	finally:
+		_registry.observe(metric, labels, time.monotonic() - start)
+
+
+# Renders the metrics of all processes in the Prometheus text exposition format.
+def render_prometheus_metrics(db: redis.Redis) -> str:
+	gauge_keys = {metric: sorted(db.scan_iter(match=metric.get_key('*'))) for metric in Metric
+				  if metric.metric_type is MetricType.GAUGE}
+	pipeline = db.pipeline(transaction=False)
+	for metric in Metric:
+		for key in gauge_keys.get(metric, [metric.get_key()]):
+			pipeline.hgetall(key)
+	values = iter(pipeline.execute())
+	lines = []
+	for metric in Metric:
+		lines.append('# HELP {} {}'.format(metric.metric_name, metric.description))
+		lines.append('# TYPE {} {}'.format(metric.metric_name, metric.metric_type.value))
+		if metric.metric_type is MetricType.GAUGE:
+			for key in gauge_keys[metric]:
+				process_name = _decode(key)[len(metric.get_key()) + 1:]
+				lines.extend(_render_samples(metric.metric_name, next(values), {'process': process_name}))
+		elif metric.metric_type is MetricType.HISTOGRAM:
+			lines.extend(_render_histogram(metric.metric_name, next(values)))
+		else:
+			lines.extend(_render_samples(metric.metric_name, next(values), {}))
+	return '\n'.join(lines) + '\n'
+
+
+def _render_samples(metric_name: str, fields: Dict[bytes, bytes], extra_labels: Dict[str, str]) -> List[str]:
+	extra_label_text = _format_labels(extra_labels)
+	lines = []
+	for field, value in sorted(fields.items()):
+		label_text = ','.join(text for text in [_decode(field), extra_label_text] if text)
+		lines.append('{}{} {}'.format(metric_name, '{' + label_text + '}' if label_text else '', _decode(value)))
+	return lines
+
+
+def _render_histogram(metric_name: str, fields: Dict[bytes, bytes]) -> List[str]:
+	values_by_labels: Dict[str, Dict[str, str]] = {}
+	for field, value in fields.items():
+		label_text, name = _decode(field).rsplit(FIELD_SEPARATOR, 1)
+		values_by_labels.setdefault(label_text, {})[name] = _decode(value)
+	lines = []
+	for label_text, values in sorted(values_by_labels.items()):
+		label_prefix = label_text + ',' if label_text else ''
+		cumulative_count = 0
+		for bucket in [str(bucket) for bucket in LATENCY_BUCKETS_IN_SECONDS] + [INFINITY_BUCKET]:
+			cumulative_count = cumulative_count + int(values.get(bucket, 0))
+			lines.append('{}_bucket{{{}le="{}"}} {}'.format(metric_name, label_prefix, bucket, cumulative_count))
+		label_suffix = '{' + label_text + '}' if label_text else ''
+		lines.append('{}_sum{} {}'.format(metric_name, label_suffix, values.get(SUM_FIELD, 0)))
+		lines.append('{}_count{} {}'.format(metric_name, label_suffix, values.get(COUNT_FIELD, 0)))
+	return lines
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+	return ','.join('{}="{}"'.format(name, _escape(str(value))) for name, value in sorted(labels.items()))
+
+
+def _escape(label_value: str) -> str:
+	return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _decode(value) -> str:
+	return value.decode('utf-8') if isinstance(value, bytes) else str(value)
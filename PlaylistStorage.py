@@ -0,0 +1,131 @@
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import redis
+from redis.client import Pipeline
+from redis.exceptions import WatchError
+
+from Codec import decode, encode
+from Constants import General, DbKey, create_logger_name
+
+ENTRY_KEY_PREFIX = 'playlist_entry:'
+# number of entries read with one round trip when the playlist is streamed from redis
+READ_CHUNK_SIZE = 500
+LEGACY_PLAYLIST_BACKUP_KEY = DbKey.PLAYLIST.value + '_backup'
+
+# used by the player and the server
+logger = logging.getLogger(create_logger_name(General.APP_NAME, 'playlist_storage'))
+
+
+def get_entry_key(entry_id: str) -> str:
+	return ENTRY_KEY_PREFIX + entry_id
+
+
+# Stores the playlist incrementally: the IDs of the entries in playlist order in a redis list, the property dict of
+# each entry in a hash (one field per top level property, values encoded with the codec) and the version of the
+# playlist. A change of the playlist only writes the affected entries. All changes of a version are written with
+# the same pipeline (transaction), which also sets the version, such that readers can detect concurrent changes.
+class PlaylistStorage:
+
+	def __init__(self, db: redis.Redis):
+		self._db = db
+
+	def read_version(self) -> Optional[int]:
+		version = self._db.get(DbKey.PLAYLIST_VERSION.value)
+		return int(version) if version is not None else None
+
+	# Streams the property dicts of the entries in playlist order, READ_CHUNK_SIZE entries per round trip.
+	# The entries are not read atomically, the playlist must not be changed while streaming it.
+	def read_entries(self) -> Iterator[Dict]:
+		start = 0
+		while True:
+			entry_ids = self._db.lrange(DbKey.PLAYLIST_ENTRY_IDS.value, start, start + READ_CHUNK_SIZE - 1)
+			yield from self._read_entries(self._db.pipeline(transaction=False), entry_ids)
+			if len(entry_ids) < READ_CHUNK_SIZE:
+				return
+			start = start + READ_CHUNK_SIZE
+
+	# Reads the version and all entries atomically, the read is repeated if the playlist changed in between.
+	def read_snapshot(self) -> Optional[Dict]:
+		with self._db.pipeline() as pipeline:
+			while True:
+				try:
+					pipeline.watch(DbKey.PLAYLIST_VERSION.value)
+					version = pipeline.get(DbKey.PLAYLIST_VERSION.value)
+					if version is None:
+						return None
+					entry_ids = pipeline.lrange(DbKey.PLAYLIST_ENTRY_IDS.value, 0, -1)
+					pipeline.multi()
+					entries = list(self._read_entries(pipeline, entry_ids))
+					return {General.PLAYLIST_VERSION: int(version), General.PLAYLIST_ENTRIES: entries}
+				except WatchError:
+					logger.debug('Playlist changed while reading it. Reading it again ...')
+
+	def insert_entry(self, pipeline: Pipeline, entry_id: str, property_dict: Dict, previous_entry_id: Optional[str]) -> None:
+		self.update_entry(pipeline, entry_id, property_dict)
+		self._insert_entry_id(pipeline, entry_id, previous_entry_id)
+
+	def update_entry(self, pipeline: Pipeline, entry_id: str, property_dict: Dict) -> None:
+		pipeline.hset(get_entry_key(entry_id), mapping={field: encode(value) for field, value in property_dict.items()})
+
+	def move_entry(self, pipeline: Pipeline, entry_id: str, previous_entry_id: Optional[str]) -> None:
+		pipeline.lrem(DbKey.PLAYLIST_ENTRY_IDS.value, 1, entry_id)
+		self._insert_entry_id(pipeline, entry_id, previous_entry_id)
+
+	def remove_entry(self, pipeline: Pipeline, entry_id: str) -> None:
+		pipeline.lrem(DbKey.PLAYLIST_ENTRY_IDS.value, 1, entry_id)
+		pipeline.delete(get_entry_key(entry_id))
+
+	def set_version(self, pipeline: Pipeline, version: int) -> None:
+		pipeline.set(DbKey.PLAYLIST_VERSION.value, version)
+
+	# Writes the whole playlist, the entries are given as (ID, property dict) in playlist order.
+	def replace(self, pipeline: Pipeline, version: int, entries: List[Tuple[str, Dict]]) -> None:
+		entry_ids = [entry_id for entry_id, _ in entries]
+		stored_entry_ids = {entry_id.decode('utf-8')
+							for entry_id in self._db.lrange(DbKey.PLAYLIST_ENTRY_IDS.value, 0, -1)}
+		for removed_entry_id in stored_entry_ids.difference(entry_ids):
+			pipeline.delete(get_entry_key(removed_entry_id))
+		pipeline.delete(DbKey.PLAYLIST_ENTRY_IDS.value)
+		for start in range(0, len(entry_ids), READ_CHUNK_SIZE):
+			pipeline.rpush(DbKey.PLAYLIST_ENTRY_IDS.value, *entry_ids[start:start + READ_CHUNK_SIZE])
+		for entry_id, property_dict in entries:
+			pipeline.delete(get_entry_key(entry_id))
+			self.update_entry(pipeline, entry_id, property_dict)
+		self.set_version(pipeline, version)
+
+	def has_legacy_playlist(self) -> bool:
+		return bool(self._db.exists(DbKey.PLAYLIST.value))
+
+	# Converts the playlist stored as one value by previous versions and keeps the value as backup.
+	# Returns the number of converted entries or None if there is no such playlist.
+	def migrate_legacy_playlist(self) -> Optional[int]:
+		value = self._db.get(DbKey.PLAYLIST.value)
+		if value is None:
+			return None
+		stored_playlist = decode(value)
+		version = 0
+		# the oldest versions stored the list of entries without version
+		if isinstance(stored_playlist, dict):
+			version = stored_playlist[General.PLAYLIST_VERSION]
+			stored_playlist = stored_playlist[General.PLAYLIST_ENTRIES]
+		pipeline = self._db.pipeline(transaction=True)
+		self.replace(pipeline, version, [(entry[General.PLAYLIST_ENTRY_ID], entry) for entry in stored_playlist])
+		pipeline.rename(DbKey.PLAYLIST.value, LEGACY_PLAYLIST_BACKUP_KEY)
+		pipeline.execute()
+		return len(stored_playlist)
+
+	def _insert_entry_id(self, pipeline: Pipeline, entry_id: str, previous_entry_id: Optional[str]) -> None:
+		if previous_entry_id is None:
+			pipeline.lpush(DbKey.PLAYLIST_ENTRY_IDS.value, entry_id)
+		else:
+			pipeline.linsert(DbKey.PLAYLIST_ENTRY_IDS.value, 'AFTER', previous_entry_id, entry_id)
+
+	def _read_entries(self, pipeline: Pipeline, entry_ids: List[bytes]) -> Iterator[Dict]:
+		for entry_id in entry_ids:
+			pipeline.hgetall(get_entry_key(entry_id.decode('utf-8')))
+		for entry_id, fields in zip(entry_ids, pipeline.execute()):
+			if not fields:
+				logger.warning('Playlist entry %s not found in redis.', entry_id)
+				continue
+			yield {field.decode('utf-8'): decode(value) for field, value in fields.items()}
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import queue
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum, unique
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+from urllib import request
+
+from Constants import General, create_logger_name
+from Util import StoppableThread
+
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL_IN_SECONDS = 1
+EXPORT_QUEUE_SIZE = 10000
+OTLP_EXPORT_TIMEOUT_IN_SECONDS = 5
+# placeholder of the trace ID in log records outside of traces
+NO_TRACE_ID = '-'
+
+# used by the player and the server
+logger = logging.getLogger(create_logger_name(General.APP_NAME, 'tracing'))
+
+
+@unique
+class SpanKind(Enum):
+	# values of the OTLP span kinds
+	INTERNAL = 1
+	SERVER = 2
+	PRODUCER = 4
+	CONSUMER = 5
+
+
+class SpanContext(NamedTuple):
+	trace_id: str
+	span_id: str
+
+
+class Span(NamedTuple):
+	context: SpanContext
+	parent_span_id: Optional[str]
+	name: str
+	kind: SpanKind
+	start_time_in_nanos: int
+	end_time_in_nanos: int
+	attributes: Dict[str, Any]
+	error: Optional[str]
+
+	def to_otlp_dict(self) -> Dict[str, Any]:
+		span_dict = {'traceId': self.context.trace_id,
+					 'spanId': self.context.span_id,
+					 'name': self.name,
+					 'kind': self.kind.value,
+					 'startTimeUnixNano': str(self.start_time_in_nanos),
+					 'endTimeUnixNano': str(self.end_time_in_nanos),
+					 'attributes': [{'key': key, 'value': _to_otlp_value(value)} for key, value in self.attributes.items()],
+					 # 1: ok, 2: error
+					 'status': {'code': 2, 'message': self.error} if self.error else {'code': 1}}
+		if self.parent_span_id:
+			span_dict['parentSpanId'] = self.parent_span_id
+		return span_dict
+
+
+# Collects the finished spans of the process and exports them in batches on its own thread, such that recording a
+# span never blocks on I/O. Spans are written in the OTLP/JSON format: appended to trace_file (one export request
+# per line, as the file exporter of the OpenTelemetry collector writes them) and / or posted to the OTLP/HTTP
+# endpoint otlp_endpoint (e.g. http://localhost:4318/v1/traces). Spans are dropped if the queue is full.
+class SpanExporter(StoppableThread):
+
+	def __init__(self, service_name: str, trace_file: Optional[str], otlp_endpoint: Optional[str]):
+		super().__init__(name='SpanExporterThread')
+		self._service_name = service_name
+		self._trace_file = trace_file
+		self._otlp_endpoint = otlp_endpoint
+		self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+		self._dropped_spans = 0
+		self._stopped = False
+
+	def export(self, span: Span) -> None:
+		try:
+			self._queue.put_nowait(span)
+		except queue.Full:
+			self._dropped_spans = self._dropped_spans + 1
+
+	def stop(self) -> None:
+		self._stopped = True
+
+	def run(self) -> None:
+		while not self._stopped:
+			self._export_batch(self._next_batch())
+		while not self._queue.empty():
+			self._export_batch(self._next_batch())
+
+	def _next_batch(self) -> List[Span]:
+		try:
+			batch = [self._queue.get(timeout=EXPORT_INTERVAL_IN_SECONDS)]
+		except queue.Empty:
+			return []
+		while len(batch) < EXPORT_BATCH_SIZE:
+			try:
+				batch.append(self._queue.get_nowait())
+			except queue.Empty:
+				break
+		return batch
+
+	def _export_batch(self, batch: List[Span]) -> None:
+		if self._dropped_spans:
+			logger.warning('%d spans were dropped, the export queue was full.', self._dropped_spans)
+			self._dropped_spans = 0
+		if not batch:
+			return
+		export_request = json.dumps(self._to_otlp_export_request(batch), separators=(',', ':'))
+		try:
+			if self._trace_file:
+				with open(self._trace_file, 'a') as trace_file:
+					trace_file.write(export_request + '\n')
+			if self._otlp_endpoint:
+				otlp_request = request.Request(self._otlp_endpoint, data=export_request.encode('utf-8'),
+											   headers={'Content-Type': 'application/json'}, method='POST')
+				request.urlopen(otlp_request, timeout=OTLP_EXPORT_TIMEOUT_IN_SECONDS).close()
+		except Exception:
+			logger.warning('Exporting %d spans failed, the spans are dropped.', len(batch), exc_info=True)
+
+	def _to_otlp_export_request(self, batch: List[Span]) -> Dict[str, Any]:
+		return {'resourceSpans': [{
+			'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self._service_name}}]},
+			'scopeSpans': [{'scope': {'name': General.APP_NAME}, 'spans': [span.to_otlp_dict() for span in batch]}]}]}
+
+
+# adds the ID of the current trace to log records (attribute trace_id), such that the logs of a command can be
+# stitched together across the server and the player
+class TraceIdLogFilter(logging.Filter):
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		span_context = _current_span_context.get()
+		record.trace_id = span_context.trace_id if span_context else NO_TRACE_ID
+		return True
+
+
+# the context is propagated to the tasks of the worker pool of the player
+_current_span_context: ContextVar[Optional[SpanContext]] = ContextVar('current_span_context', default=None)
+_exporter: Optional[SpanExporter] = None
+
+
+def set_span_exporter(exporter: Optional[SpanExporter]) -> None:
+	global _exporter
+	_exporter = exporter
+
+
+def create_span_exporter(service_name: str, trace_file: Optional[str], otlp_endpoint: Optional[str]) -> Optional[SpanExporter]:
+	if not trace_file and not otlp_endpoint:
+		return None
+	exporter = SpanExporter(service_name, trace_file, otlp_endpoint)
+	set_span_exporter(exporter)
+	return exporter
+
+
+def get_current_span_context() -> Optional[SpanContext]:
+	return _current_span_context.get()
+
+
+def new_trace_id() -> str:
+	return os.urandom(16).hex()
+
+
+# Starts a trace with a root span, or continues the trace of parent (e.g. the span context of a received command).
+@contextmanager
+def start_trace(name: str, parent: Optional[SpanContext] = None, kind: SpanKind = SpanKind.INTERNAL,
+				**attributes) -> Iterator[SpanContext]:
+	with _span(name, parent or SpanContext(new_trace_id(), None), kind, attributes) as span_context:
+		yield span_context
+
+
+# Records a child span of the current span. Outside of traces, no span is recorded.
+@contextmanager
+def span(name: str, kind: SpanKind = SpanKind.INTERNAL, **attributes) -> Iterator[Optional[SpanContext]]:
+	parent = _current_span_context.get()
+	if parent is None:
+		yield None
+		return
+	with _span(name, parent, kind, attributes) as span_context:
+		yield span_context
+
+
+# Records a span which already ended, e.g. the time a command waited in a queue.
+def record_span(name: str, parent: SpanContext, start_time_in_nanos: int, end_time_in_nanos: int,
+				kind: SpanKind = SpanKind.INTERNAL, **attributes) -> None:
+	if _exporter:
+		_exporter.export(Span(SpanContext(parent.trace_id, _new_span_id()), parent.span_id, name, kind,
+							  start_time_in_nanos, end_time_in_nanos, attributes, None))
+
+
+@contextmanager
+def _span(name: str, parent: SpanContext, kind: SpanKind, attributes: Dict[str, Any]) -> Iterator[SpanContext]:
+	span_context = SpanContext(parent.trace_id, _new_span_id())
+	token = _current_span_context.set(span_context)
+	start_time_in_nanos = time.time_ns()
+	error = None
+	try:
+		yield span_context
+	except Exception as e:
+		error = '{}: {}'.format(type(e).__name__, e)
+		raise
+	finally:
+		_current_span_context.reset(token)
+		if _exporter:
+			_exporter.export(Span(span_context, parent.span_id, name, kind, start_time_in_nanos, time.time_ns(),
+								  attributes, error))
+
+
+def _new_span_id() -> str:
+	return os.urandom(8).hex()
+
+
+def _to_otlp_value(value: Any) -> Dict[str, Any]:
+	if isinstance(value, bool):
+		return {'boolValue': value}
+	if isinstance(value, int):
+		# 64 bit integers are strings in OTLP/JSON
+		return {'intValue': str(value)}
+	if isinstance(value, float):
+		return {'doubleValue': value}
+	return {'stringValue': str(value)}
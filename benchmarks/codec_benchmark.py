@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Measures encoding and decoding of playlist snapshots of different sizes, of a playlist delta and of a command
+# with each available codec (codecs whose package is not installed are skipped).
+# Sizes are the number of bytes of the encoded payloads including the codec header.
+#
+# Usage: python benchmarks/codec_benchmark.py [--sizes 10 100 1000 10000] [--operations 1000]
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Codec import CodecName, create_codec, decode, decode_to_json_text
+
+
+def create_track_dict(index: int) -> dict:
+	return {'title': 'Title {} - Some Artist (Official Video)'.format(index), 'artist': 'Artist', 'author': 'Author',
+			'url': 'https://www.youtube.com/watch?v={:011d}'.format(index),
+			'cover_url': 'https://i.ytimg.com/vi/{:011d}/hqdefault.jpg'.format(index),
+			'track_type': 'youtube', 'track_status': 'stopped', 'duration': 180000 + index, 'available': True}
+
+
+# same structure as the snapshot stored by the playlist
+def create_playlist_snapshot(size: int) -> dict:
+	return {'version': size,
+			'entries': [{'playlist_entry_id': str(uuid.uuid4()), 'track': create_track_dict(i), 'status': 'waiting'}
+						for i in range(size)]}
+
+
+def create_playlist_delta() -> dict:
+	return {'version': 42, 'operations': [{'op': 'move', 'playlist_entry_id': str(uuid.uuid4()), 'to': 17},
+										  {'op': 'status', 'playlist_entry_id': str(uuid.uuid4()),
+										   'status': 'playing', 'track_status': 'playing'}]}
+
+
+def create_command() -> dict:
+	return {'event_name': 'add_track_to_playlist', 'event_payload': {'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'},
+			'sid': 'c0a8f4b1e2d34f5a9b6c7d8e9f0a1b2c'}
+
+
+def measure(operation, count: int) -> dict:
+	durations = []
+	for _ in range(count):
+		start = time.perf_counter()
+		operation()
+		durations.append((time.perf_counter() - start) * 1000)
+	durations.sort()
+	return {'mean_ms': statistics.mean(durations),
+			'p50_ms': durations[len(durations) // 2],
+			'p99_ms': durations[min(len(durations) - 1, int(len(durations) * 0.99))]}
+
+
+# large snapshots are measured less often, such that all payloads take a similar time
+def get_count(payload: dict, operations: int) -> int:
+	return max(10, operations // max(1, len(payload.get('entries', [])) // 100))
+
+
+def benchmark(codec, payload, count: int) -> dict:
+	encoded = codec.encode(payload)
+	assert decode(encoded) == payload
+	return {'bytes': len(encoded),
+			'encode': measure(lambda: codec.encode(payload), count),
+			'decode': measure(lambda: decode(encoded), count),
+			# done by the server when a changed state value is cached for connecting clients
+			'decode_to_json_text': measure(lambda: decode_to_json_text(encoded), count)}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='Benchmark of the payload codecs.')
+	parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000])
+	parser.add_argument('--operations', type=int, default=1000)
+	args = parser.parse_args()
+	payloads = {'playlist_{}'.format(size): create_playlist_snapshot(size) for size in args.sizes}
+	payloads['playlist_delta'] = create_playlist_delta()
+	payloads['command'] = create_command()
+	results = {}
+	for name in CodecName:
+		try:
+			codec = create_codec(name)
+		except ValueError as e:
+			print('Skipping codec {}: {}'.format(name.value, e), file=sys.stderr)
+			continue
+		results[name.value] = {payload_name: benchmark(codec, payload, get_count(payload, args.operations))
+							   for payload_name, payload in payloads.items()}
+	print(json.dumps({'benchmark': 'codec', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,361 @@
+# In-process stand-ins for the external dependencies of the player, such that the benchmarks run offline and
+# measure the code of YouSonos instead of the network:
+#
+# - redis: all clients (blocking and asyncio, including the socket.io message queue) are connected to one
+#   in-memory fakeredis server (requires package fakeredis).
+# - vlc: media players which accept every command immediately.
+# - soco: Sonos devices in one zone group, each call takes sonos_latency_in_seconds.
+# - pafy: canned video metadata and streams, each resolution takes youtube_latency_in_seconds.
+# - googleapiclient: canned search and videos responses of the YouTube API, each request takes
+#   youtube_api_latency_in_seconds.
+#
+# The fake modules replace the real ones in sys.modules, hence, install_fakes(...) must be called before the
+# dependencies are used for the first time (the player imports them on first use).
+
+import re
+import sys
+import time
+import types
+import zlib
+from enum import Enum
+
+import redis
+from redis import asyncio as async_redis
+
+# same pattern as pafy.backend_shared.extract_video_id
+VIDEO_ID_PATTERN = re.compile(r'(?:^|[^\w-]+)([\w-]{11})(?:[^\w-]+|$)')
+PLAYLIST_ID_PATTERN = re.compile(r'list=([\w-]+)')
+YOUTUBE_WATCH_URL = 'https://www.youtube.com/watch?v='
+FAKE_STREAM_URL = 'http://fake-youtube-stream/'
+NUMBER_OF_SEARCH_RESULT_PAGES = 20
+NUMBER_OF_PLAYLIST_ITEMS = 25
+
+
+def create_video_id(index: int) -> str:
+	return 'v{:010d}'.format(index)
+
+
+def extract_video_id(url: str) -> str:
+	match = VIDEO_ID_PATTERN.search(str(url))
+	if not match:
+		raise ValueError('Need 11 character video id or the URL of the video. Got {}'.format(url))
+	return match.group(1)
+
+
+# pafy
+
+class FakeStream:
+
+	def __init__(self, url: str):
+		self.url = url
+
+	def __repr__(self) -> str:
+		return 'audio:webm@160k'
+
+
+class FakeYtdlPafy:
+
+	latency_in_seconds = 0.0
+
+	def __init__(self, video_url: str, latency_in_seconds: float = None):
+		time.sleep(self.latency_in_seconds if latency_in_seconds is None else latency_in_seconds)
+		self.videoid = extract_video_id(video_url)
+		index = int(self.videoid[1:]) if self.videoid[1:].isdigit() else zlib.crc32(self.videoid.encode('utf-8'))
+		self.title = 'Artist {0} - Title {0} (Official Video)'.format(index)
+		self.author = 'Channel {}'.format(index % 100)
+		self.length = 180 + index % 120
+		self.watchv_url = YOUTUBE_WATCH_URL + self.videoid
+		self.bigthumbhd = 'https://i.ytimg.com/vi/{}/maxresdefault.jpg'.format(self.videoid)
+		self.bigthumb = 'https://i.ytimg.com/vi/{}/hqdefault.jpg'.format(self.videoid)
+		self.thumb = 'https://i.ytimg.com/vi/{}/default.jpg'.format(self.videoid)
+
+	def getbestaudio(self) -> FakeStream:
+		return FakeStream(FAKE_STREAM_URL + self.videoid)
+
+	def __repr__(self) -> str:
+		return 'FakeYtdlPafy({})'.format(self.videoid)
+
+
+def get_playlist(playlist_url: str) -> dict:
+	match = PLAYLIST_ID_PATTERN.search(playlist_url)
+	if not match:
+		raise ValueError('Unrecognized playlist URL: {}'.format(playlist_url))
+	first_index = zlib.crc32(match.group(1).encode('utf-8')) % 1000000
+	return {'playlist_id': match.group(1),
+			'items': [{'pafy': FakeYtdlPafy(create_video_id(first_index + i))} for i in range(NUMBER_OF_PLAYLIST_ITEMS)]}
+
+
+# googleapiclient
+
+class FakeHttpError(Exception):
+	pass
+
+
+class FakeRequest:
+
+	def __init__(self, latency_in_seconds: float, response: dict):
+		self._latency_in_seconds = latency_in_seconds
+		self._response = response
+
+	def execute(self) -> dict:
+		time.sleep(self._latency_in_seconds)
+		return self._response
+
+
+class FakeCollection:
+
+	def __init__(self, list_method):
+		self.list = list_method
+
+
+class FakeYouTubeResource:
+
+	latency_in_seconds = 0.0
+
+	def search(self) -> FakeCollection:
+		return FakeCollection(self._list_search_results)
+
+	def videos(self) -> FakeCollection:
+		return FakeCollection(self._list_videos)
+
+	def _list_search_results(self, q: str, part: str, maxResults: int, type: str, pageToken: str = None) -> FakeRequest:
+		page = int(pageToken or 0)
+		first_index = zlib.crc32(q.encode('utf-8')) % 1000000 + page * maxResults
+		response = {'items': [{'id': {'kind': 'youtube#video', 'videoId': create_video_id(first_index + i)}}
+							  for i in range(maxResults)]}
+		if page + 1 < NUMBER_OF_SEARCH_RESULT_PAGES:
+			response['nextPageToken'] = str(page + 1)
+		return FakeRequest(self.latency_in_seconds, response)
+
+	def _list_videos(self, id: str, part: str, maxResults: int) -> FakeRequest:
+		items = []
+		for video_id in id.split(','):
+			# the API responds with the same metadata as pafy, without resolving the stream
+			pafy = FakeYtdlPafy(video_id, latency_in_seconds=0)
+			items.append({'id': video_id,
+						  'snippet': {'title': pafy.title, 'channelTitle': pafy.author,
+									  'thumbnails': {'maxres': {'url': pafy.bigthumbhd}, 'high': {'url': pafy.bigthumb},
+													 'default': {'url': pafy.thumb}}},
+						  'contentDetails': {'duration': 'PT{}M{}S'.format(pafy.length // 60, pafy.length % 60)}})
+		return FakeRequest(self.latency_in_seconds, {'items': items})
+
+
+def build(service_name: str, version: str, developerKey: str = None, **kwargs) -> FakeYouTubeResource:
+	return FakeYouTubeResource()
+
+
+# vlc
+
+class EventType:
+	MediaPlayerEndReached = 'MediaPlayerEndReached'
+	MediaPlayerTimeChanged = 'MediaPlayerTimeChanged'
+
+
+class State(Enum):
+	NothingSpecial = 0
+	Opening = 1
+	Buffering = 2
+	Playing = 3
+	Paused = 4
+	Stopped = 5
+	Ended = 6
+	Error = 7
+
+
+class FakeEventManager:
+
+	def __init__(self):
+		self.callbacks = {}
+
+	def event_attach(self, event_type: str, callback) -> int:
+		self.callbacks.setdefault(event_type, []).append(callback)
+		return 0
+
+
+class FakeMedia:
+
+	def __init__(self, mrl: str, options):
+		self._mrl = mrl
+		self.options = options
+
+	def get_mrl(self) -> str:
+		return self._mrl
+
+	def release(self) -> None:
+		pass
+
+
+class FakeMediaPlayer:
+
+	def __init__(self):
+		self._media = None
+		self._state = State.NothingSpecial
+		self._time = 0
+		self._event_manager = FakeEventManager()
+
+	def event_manager(self) -> FakeEventManager:
+		return self._event_manager
+
+	def set_media(self, media: FakeMedia) -> None:
+		self._media = media
+		self._time = 0
+
+	def play(self) -> int:
+		self._state = State.Playing
+		return 0
+
+	def pause(self) -> None:
+		self._state = State.Paused
+
+	def stop(self) -> None:
+		self._state = State.Stopped
+
+	def set_time(self, time_in_millis: int) -> None:
+		self._time = time_in_millis
+
+	def get_time(self) -> int:
+		return self._time
+
+	def get_state(self) -> State:
+		return self._state
+
+	def release(self) -> None:
+		pass
+
+
+class FakeInstance:
+
+	def __init__(self, args=None):
+		self.args = args
+
+	def media_player_new(self) -> FakeMediaPlayer:
+		return FakeMediaPlayer()
+
+	def media_new(self, mrl: str, *options) -> FakeMedia:
+		return FakeMedia(mrl, options)
+
+	def release(self) -> None:
+		pass
+
+
+# soco
+
+class FakeZoneGroup:
+
+	def __init__(self, coordinator):
+		self.uid = 'RINCON_FAKE_GROUP:1'
+		self.label = 'Fake group'
+		self.coordinator = coordinator
+
+
+class FakeSoCo:
+
+	latency_in_seconds = 0.0
+
+	def __init__(self, ip_address: str):
+		self.ip_address = ip_address
+		self.player_name = 'Fake Sonos {}'.format(ip_address.rsplit('.', 1)[-1])
+		self._volume = 0
+		self.played_uri = None
+
+	@property
+	def volume(self) -> int:
+		time.sleep(self.latency_in_seconds)
+		return self._volume
+
+	@volume.setter
+	def volume(self, volume: int) -> None:
+		time.sleep(self.latency_in_seconds)
+		self._volume = volume
+
+	@property
+	def is_coordinator(self) -> bool:
+		time.sleep(self.latency_in_seconds)
+		return self.group.coordinator is self
+
+	@property
+	def group(self) -> FakeZoneGroup:
+		return FakeZoneGroup(discover_devices()[0])
+
+	@property
+	def visible_zones(self):
+		return discover()
+
+	def play_uri(self, uri: str, title: str = '', force_radio: bool = False) -> None:
+		time.sleep(self.latency_in_seconds)
+		self.played_uri = uri
+
+	def stop(self) -> None:
+		time.sleep(self.latency_in_seconds)
+
+	def partymode(self) -> None:
+		time.sleep(self.latency_in_seconds)
+
+	def __repr__(self) -> str:
+		return 'FakeSoCo("{}")'.format(self.ip_address)
+
+
+_number_of_sonos_devices = 0
+_devices_by_ip_address = {}
+
+
+# like soco, there is one instance per IP address
+def get_device(ip_address: str) -> FakeSoCo:
+	device = _devices_by_ip_address.get(ip_address)
+	if not device:
+		device = FakeSoCo(ip_address)
+		_devices_by_ip_address[ip_address] = device
+	return device
+
+
+def discover_devices():
+	return [get_device('192.168.0.{}'.format(10 + i)) for i in range(_number_of_sonos_devices)]
+
+
+def discover(timeout: int = 5):
+	return set(discover_devices()) or None
+
+
+# installation
+
+def _create_module(name: str, **attributes) -> types.ModuleType:
+	module = types.ModuleType(name)
+	module.__dict__.update(attributes)
+	sys.modules[name] = module
+	return module
+
+
+def install_fake_redis() -> None:
+	try:
+		import fakeredis
+	except ImportError:
+		raise SystemExit('The offline benchmarks require package fakeredis (pipenv install --dev).')
+	server = fakeredis.FakeServer()
+
+	# instances of the requested class (e.g. the round trip counting client of the player) on the fake server
+	def from_url(cls, url: str, **kwargs):
+		return cls(connection_pool=fakeredis.FakeRedis(server=server, **kwargs).connection_pool)
+
+	redis.Redis.from_url = classmethod(from_url)
+	redis.from_url = lambda url, **kwargs: redis.Redis.from_url(url, **kwargs)
+	async_redis.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+
+def install_fakes(youtube_latency_in_seconds: float, youtube_api_latency_in_seconds: float,
+				  sonos_latency_in_seconds: float, number_of_sonos_devices: int) -> None:
+	global _number_of_sonos_devices
+	_number_of_sonos_devices = number_of_sonos_devices
+	FakeYtdlPafy.latency_in_seconds = youtube_latency_in_seconds
+	FakeYouTubeResource.latency_in_seconds = youtube_api_latency_in_seconds
+	FakeSoCo.latency_in_seconds = sonos_latency_in_seconds
+	install_fake_redis()
+	_create_module('vlc', Instance=FakeInstance, MediaPlayer=FakeMediaPlayer, EventType=EventType, State=State)
+	soco_core = _create_module('soco.core', SoCo=get_device)
+	_create_module('soco', discover=discover, core=soco_core)
+	backend_shared = _create_module('pafy.backend_shared', extract_video_id=extract_video_id)
+	backend_youtube_dl = _create_module('pafy.backend_youtube_dl', YtdlPafy=FakeYtdlPafy)
+	_create_module('pafy', get_playlist=get_playlist, backend_shared=backend_shared,
+				   backend_youtube_dl=backend_youtube_dl)
+	discovery = _create_module('googleapiclient.discovery', build=build, Resource=FakeYouTubeResource)
+	errors = _create_module('googleapiclient.errors', Error=FakeHttpError)
+	_create_module('googleapiclient', discovery=discovery, errors=errors)
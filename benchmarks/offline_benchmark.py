@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# Measures the hot paths of the player against in-process stand-ins of redis, VLC, Sonos and YouTube (see fakes.py):
+#
+# - playlist: move, delete and add, and play next (including the player, VLC and the Sonos fan-out) on playlists
+#   of different sizes, and the initial save and emit of the playlist snapshot.
+# - save_and_emit_playlist: Playlist._save_and_emit_playlist(...) with deltas updating different numbers of entries.
+# - search: latency of the first result batch of a SearchTask for keyword searches (cold and cached, with both
+#   metadata sources) and for the URL of a video.
+# - event_consumer: throughput of the PlayerEventsConsumer for playlist commands (one ordering key) and for bursts
+#   of volume changes (coalesced per device). Messages are fed to the consumer directly, the transport is not measured.
+#
+# Latencies of the fake backends are configurable, redis round trips are counted per operation.
+# Requires package fakeredis.
+#
+# Usage: python benchmarks/offline_benchmark.py [--benchmarks playlist save_and_emit_playlist search event_consumer]
+#        [--sizes 100 1000 10000 50000] [--operations 1000] [--youtube-latency 200] [--youtube-api-latency 100]
+#        [--sonos-latency 10] [--sonos-devices 4]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+
+FAKE_OUT_STREAM_URL = 'http://192.168.0.2:8090/yousonos'
+SAVE_AND_EMIT_DELTA_SIZES = [1, 10, 100, 1000]
+SAVE_AND_EMIT_PLAYLIST_SIZE = 10000
+SEARCH_BATCH_SIZE = 10
+EVENT_CONSUMER_PLAYLIST_SIZE = 1000
+
+
+def create_args(overrides: dict):
+	import youSonos
+	argv = sys.argv
+	# defaults of all options of the player
+	sys.argv = [argv[0], '--out-stream-url', FAKE_OUT_STREAM_URL]
+	try:
+		args = youSonos.parse_args()
+	finally:
+		sys.argv = argv
+	vars(args).update(overrides)
+	return args
+
+
+# same composition as player.initialize(...), without consumers and background threads
+class PlayerStack:
+
+	def __init__(self, args):
+		import player
+		self.args = args
+		player._initialize_connections(args)
+		self.worker_pool = player._create_worker_pool(args)
+		self.resolution_executor = self.worker_pool.lane(player.WorkerLane.RESOLUTION)
+		self.sonos_environment = player.SonosEnvironment(player.SonosDiscoveryMode(args.sonos_discovery),
+														 args.sonos_discovery_interval,
+														 self.worker_pool.lane(player.WorkerLane.SONOS_IO),
+														 args.sonos_call_timeout)
+		self.player = player.Player(args, self.sonos_environment, self.resolution_executor)
+		self.video_metadata_cache = player.VideoMetadataCache(player._db, args.video_metadata_cache_size,
+															  args.video_metadata_cache_max_age,
+															  self.worker_pool.lane(player.WorkerLane.PERSISTENCE))
+		self.track_factory = player.TrackFactory(args, self.player, self.video_metadata_cache)
+		self.playlist_entry_factory = player.PlaylistEntryFactory(self.track_factory, self.resolution_executor)
+		# the scheduler is not started, scheduled tracks are only queued
+		self.track_refresh_scheduler = player.TrackRefreshScheduler(args.track_refresh_workers, self.resolution_executor)
+		self.playlist = player.Playlist(self.playlist_entry_factory, self.track_refresh_scheduler,
+										self.resolution_executor, player.PlaylistStorage(player._db))
+		self.player.add_terminal_observer(self.playlist)
+		self.player.set_next_track_provider(self.playlist)
+		self.search_result_cache = player.SearchResultCache(player._db, args.search_result_cache_size,
+															args.search_result_cache_ttl,
+															self.worker_pool.lane(player.WorkerLane.PERSISTENCE))
+
+	def fill_playlist(self, size: int) -> None:
+		import player
+		entries = [player.PlaylistEntry(self.track_factory.create_youtube_track_from_metadata(create_metadata(i)),
+										player.PlaylistEntryStatus.WAITING, uuid.uuid4()) for i in range(size)]
+		self.playlist._set_entries(entries)
+
+	def stop(self) -> None:
+		self.worker_pool.stop()
+
+
+def create_metadata(index: int):
+	from player import VideoMetadata
+	video = fakes.FakeYtdlPafy(fakes.create_video_id(index), latency_in_seconds=0)
+	return VideoMetadata.from_pafy(video, datetime.now() + timedelta(hours=3))
+
+
+def measure(operation, count: int) -> dict:
+	from player import get_redis_round_trips
+	durations = []
+	round_trips_before = get_redis_round_trips()
+	for _ in range(count):
+		start = time.perf_counter()
+		operation()
+		durations.append((time.perf_counter() - start) * 1000)
+	round_trips = get_redis_round_trips() - round_trips_before
+	durations.sort()
+	return {'mean_ms': statistics.mean(durations),
+			'p50_ms': durations[len(durations) // 2],
+			'p99_ms': durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+			'max_ms': durations[-1],
+			'mean_round_trips': round_trips / count}
+
+
+def benchmark_playlist(stack: PlayerStack, size: int, count: int) -> dict:
+	stack.fill_playlist(size)
+	playlist = stack.playlist
+	results = {'save_and_emit_snapshot': measure(playlist._save_and_emit_snapshot, 1)}
+	playlist.play_next()
+	entry_ids = [str(entry.playlist_entry_id) for entry in playlist]
+	urls = [fakes.YOUTUBE_WATCH_URL + fakes.create_video_id(i) for i in range(size)]
+
+	def move():
+		playlist.change_track_position(random.choice(entry_ids), random.randrange(size))
+
+	def delete_and_add():
+		playlist.delete_track(entry_ids.pop(random.randrange(len(entry_ids))))
+		# tracks added again are created from the video metadata cache
+		playlist.add_track_at_end(random.choice(urls))
+		entry_ids.append(str(playlist._entries.node_at(len(playlist) - 1).value.playlist_entry_id))
+
+	def play_next():
+		if playlist.get_next_track() is None:
+			playlist.play_track_of_playlist(entry_ids[0])
+		else:
+			playlist.play_next()
+
+	results['move'] = measure(move, count)
+	results['delete_and_add'] = measure(delete_and_add, count)
+	# tuning the Sonos coordinators dominates, play next is measured less often
+	results['play_next'] = measure(play_next, max(1, count // 10))
+	return results
+
+
+def benchmark_save_and_emit_playlist(stack: PlayerStack, count: int) -> dict:
+	from player.Playlist import ENTRY, OPERATION, PlaylistOperation
+	stack.fill_playlist(SAVE_AND_EMIT_PLAYLIST_SIZE)
+	playlist = stack.playlist
+	playlist._save_and_emit_snapshot()
+	property_dicts = list(playlist._property_dicts.values())
+	results = {}
+	for delta_size in SAVE_AND_EMIT_DELTA_SIZES:
+		def save_and_emit():
+			playlist._save_and_emit_playlist([{OPERATION: PlaylistOperation.UPDATE.value, ENTRY: property_dict}
+											  for property_dict in random.sample(property_dicts, delta_size)])
+		results['updated_entries_{}'.format(delta_size)] = measure(save_and_emit, max(10, count // delta_size))
+	return results
+
+
+def benchmark_search(stack: PlayerStack, count: int) -> dict:
+	from player import KeywordSearchMetadataSource, WorkerLane
+	from player.SearchService import SearchTask
+	from googleapiclient.discovery import build
+	youtube_api = build('youtube', 'v3', developerKey='fake')
+	search_lane = stack.worker_pool.lane(WorkerLane.SEARCH)
+	search_terms = iter(range(sys.maxsize))
+
+	def run_search_task(search_term: str, metadata_source: KeywordSearchMetadataSource) -> None:
+		search_task = SearchTask(search_term, 'benchmark-sid', stack.track_factory, search_lane,
+								 stack.resolution_executor, youtube_api, stack.args.max_keyword_search_results,
+								 stack.search_result_cache, metadata_source)
+		# the first batch of results is emitted when _start(...) returns
+		search_task._start(0, list(range(SEARCH_BATCH_SIZE)))
+
+	results = {}
+	for metadata_source in KeywordSearchMetadataSource:
+		results['keyword_{}_cold'.format(metadata_source.value)] = measure(
+			lambda: run_search_task('cold search {}'.format(next(search_terms)), metadata_source), count)
+		cached_search_term = 'cached search {}'.format(metadata_source.value)
+		run_search_task(cached_search_term, metadata_source)
+		results['keyword_{}_cached'.format(metadata_source.value)] = measure(
+			lambda: run_search_task(cached_search_term, metadata_source), count)
+	results['video_url'] = measure(
+		lambda: run_search_task(fakes.YOUTUBE_WATCH_URL + fakes.create_video_id(next(search_terms)),
+								KeywordSearchMetadataSource.YOUTUBE_API), count)
+	return results
+
+
+def benchmark_event_consumer(stack: PlayerStack, count: int) -> dict:
+	from Codec import encode
+	from Constants import General, ReceiveEvent
+	from player import ID, PlayerEventsConsumer, WorkerLane
+	stack.fill_playlist(EVENT_CONSUMER_PLAYLIST_SIZE)
+	stack.playlist._save_and_emit_snapshot()
+	entry_ids = [str(entry.playlist_entry_id) for entry in stack.playlist]
+	device_names = list(stack.sonos_environment._get_sonos_devices())
+
+	def message(event: ReceiveEvent, payload: dict) -> dict:
+		return {'data': encode({General.EVENT_NAME: event.value, General.EVENT_PAYLOAD: payload,
+								General.SID: 'benchmark-sid'})}
+
+	def consume(messages: list) -> dict:
+		consumer = PlayerEventsConsumer(stack.args, stack.sonos_environment, stack.player, stack.track_factory,
+										stack.playlist, stack.worker_pool.lane(WorkerLane.COMMAND))
+
+		async def replay():
+			for m in messages:
+				yield m
+			# the consumer cancels pending events on stop
+			while consumer._queues_by_ordering_key:
+				await asyncio.sleep(0.001)
+			yield message(ReceiveEvent.STOP, {})
+
+		consumer._listen = replay
+		start = time.perf_counter()
+		consumer.run()
+		duration = time.perf_counter() - start
+		coalesced = sum(consumer.get_coalescing_statistics().values())
+		return {'events': len(messages),
+				'handled_events': len(messages) - coalesced,
+				'events_per_second': len(messages) / duration,
+				'round_trips': consumer.get_round_trip_statistics()}
+
+	playlist_commands = [message(ReceiveEvent.CHANGE_PLAYLIST_TRACK_POSITION,
+								 {ID: random.choice(entry_ids),
+								  'playlist_target_position': random.randrange(len(entry_ids))})
+						 for _ in range(count)]
+	volume_bursts = [message(ReceiveEvent.SET_VOLUME, {'device_name': device_names[i % len(device_names)],
+													   'volume': i % 100})
+					 for i in range(count)] if device_names else []
+	return {'playlist_commands': consume(playlist_commands),
+			'volume_bursts': consume(volume_bursts)}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='Offline benchmark of the player with fake backends.')
+	parser.add_argument('--benchmarks', nargs='+', default=['playlist', 'save_and_emit_playlist', 'search', 'event_consumer'],
+						choices=['playlist', 'save_and_emit_playlist', 'search', 'event_consumer'])
+	parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000, 50000])
+	parser.add_argument('--operations', type=int, default=1000)
+	parser.add_argument('--youtube-latency', type=int, default=200, help='Milliseconds to resolve a video with pafy.')
+	parser.add_argument('--youtube-api-latency', type=int, default=100, help='Milliseconds of a YouTube API request.')
+	parser.add_argument('--sonos-latency', type=int, default=10, help='Milliseconds of a call to a Sonos device.')
+	parser.add_argument('--sonos-devices', type=int, default=4)
+	args = parser.parse_args()
+	fakes.install_fakes(args.youtube_latency / 1000, args.youtube_api_latency / 1000, args.sonos_latency / 1000,
+						args.sonos_devices)
+	stack = PlayerStack(create_args({'youtube_api_key': 'fake'}))
+	results = {}
+	try:
+		if 'playlist' in args.benchmarks:
+			results['playlist'] = {str(size): benchmark_playlist(stack, size, args.operations) for size in args.sizes}
+		if 'save_and_emit_playlist' in args.benchmarks:
+			results['save_and_emit_playlist'] = benchmark_save_and_emit_playlist(stack, args.operations)
+		if 'search' in args.benchmarks:
+			# searches wait for the fake YouTube backends, they are measured less often
+			results['search'] = benchmark_search(stack, max(1, args.operations // 100))
+		if 'event_consumer' in args.benchmarks:
+			results['event_consumer'] = benchmark_event_consumer(stack, args.operations)
+	finally:
+		stack.stop()
+	print(json.dumps({'benchmark': 'offline',
+					  'configuration': {'youtube_latency_ms': args.youtube_latency,
+										'youtube_api_latency_ms': args.youtube_api_latency,
+										'sonos_latency_ms': args.sonos_latency,
+										'sonos_devices': args.sonos_devices},
+					  'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Measures delete, move and play next on playlists of different sizes.
+# Persistence and emits are replaced by no-ops and tracks by in-memory stand-ins,
+# such that only the playlist data structure and the computation of the playlist deltas are measured.
+# The cost of creating the persisted playlist snapshot is reported separately.
+#
+# Usage: python benchmarks/playlist_benchmark.py [--sizes 100 1000 10000 50000] [--operations 1000]
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from contextlib import nullcontext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from player import Playlist, PlaylistEntry, PlaylistEntryStatus, TrackStatus, TrackRefreshScheduler, \
+	WorkerLane, WorkerLaneExecutor
+
+playlist_module = sys.modules['player.Playlist']
+
+
+class BenchmarkTrack:
+
+	def __init__(self, index: int):
+		self._index = index
+		self.track_status = TrackStatus.STOPPED
+
+	def play(self) -> None:
+		pass
+
+	def stop(self) -> None:
+		pass
+
+	def toggle_play_pause(self) -> None:
+		pass
+
+	def has_metadata(self) -> bool:
+		return True
+
+	def get_stream_expiration(self):
+		return None
+
+	def get_property_dict(self):
+		return {'title': 'Title {}'.format(self._index), 'artist': 'Artist', 'author': 'Author',
+				'url': 'https://www.youtube.com/watch?v={:011d}'.format(self._index), 'cover_url': '',
+				'track_type': 'youtube', 'track_status': self.track_status.value, 'duration': 180000,
+				'available': True}
+
+
+class BenchmarkPlaylistEntryFactory:
+
+	def __init__(self):
+		self._count = 0
+
+	def create_playlist_entry_from_youtube_url(self, url: str) -> PlaylistEntry:
+		self._count = self._count + 1
+		return PlaylistEntry(BenchmarkTrack(self._count), PlaylistEntryStatus.WAITING, uuid.uuid4())
+
+
+def disable_persistence_and_emits() -> None:
+	no_op = lambda *args, **kwargs: None
+	playlist_module.save_in_db = no_op
+	playlist_module.emit = no_op
+	playlist_module.save_and_emit = no_op
+	playlist_module.write_batch = nullcontext
+	playlist_module.isolated_write_batch = nullcontext
+	Playlist._save_playlist = no_op
+	Playlist._save_snapshot = no_op
+
+
+def create_playlist(size: int) -> Playlist:
+	factory = BenchmarkPlaylistEntryFactory()
+	resolution_executor = WorkerLaneExecutor(WorkerLane.RESOLUTION, 16, 1000)
+	# the scheduler is not started, scheduled tracks are only queued
+	playlist = Playlist(factory, TrackRefreshScheduler(1, resolution_executor), resolution_executor, None)
+	playlist._set_entries([factory.create_playlist_entry_from_youtube_url('') for _ in range(size)])
+	playlist._save_and_emit_snapshot()
+	playlist.play_next()
+	return playlist
+
+
+def measure(operation, count: int) -> dict:
+	durations = []
+	for _ in range(count):
+		start = time.perf_counter()
+		operation()
+		durations.append((time.perf_counter() - start) * 1000)
+	durations.sort()
+	return {'mean_ms': statistics.mean(durations),
+			'p50_ms': durations[len(durations) // 2],
+			'p99_ms': durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+			'max_ms': durations[-1]}
+
+
+def benchmark(size: int, count: int) -> dict:
+	playlist = create_playlist(size)
+	entry_ids = [str(entry.playlist_entry_id) for entry in playlist]
+
+	def move():
+		playlist.change_track_position(random.choice(entry_ids), random.randrange(size))
+
+	def delete_and_add():
+		playlist.delete_track(entry_ids.pop(random.randrange(len(entry_ids))))
+		playlist.add_track_at_end('')
+		entry_ids.append(str(playlist._entries.node_at(len(playlist) - 1).value.playlist_entry_id))
+
+	def play_next():
+		playlist.play_next()
+		# the player notifies the playlist about the started track
+		playlist.player_status_changed(None, None, None)
+
+	def play_previous():
+		playlist.play_previous()
+		playlist.player_status_changed(None, None, None)
+
+	return {'move': measure(move, count),
+			'play_next': measure(play_next, count),
+			'play_previous': measure(play_previous, count),
+			'delete_and_add': measure(delete_and_add, count),
+			'snapshot': measure(playlist._create_snapshot, max(1, count // 100))}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='Benchmark of playlist operations.')
+	parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000, 50000])
+	parser.add_argument('--operations', type=int, default=1000)
+	args = parser.parse_args()
+	disable_persistence_and_emits()
+	results = {str(size): benchmark(size, args.operations) for size in args.sizes}
+	print(json.dumps({'benchmark': 'playlist', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+	main()
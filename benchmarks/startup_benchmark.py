@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Measures the cold-start import time of the player and the server process. Each run starts a fresh interpreter
+# (as the processes are spawned), imports the modules the process imports at startup and reports the wall-clock
+# time of the imports, the slowest imported modules (from python -X importtime) and which of the heavy
+# dependencies are already loaded at startup instead of on first use.
+#
+# Usage: python benchmarks/startup_benchmark.py [--runs 5] [--top 10]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# statements run by the processes before they are initialized, see player_main() and server_main() of youSonos.py
+PROCESS_IMPORTS = {'player': 'from player import initialize',
+				   'search_worker': 'from player import initialize_search_worker',
+				   'server': 'import eventlet; eventlet.monkey_patch(); from server import create_app, socketio'}
+HEAVY_MODULES = ['vlc', 'soco', 'pafy', 'youtube_dl', 'googleapiclient', 'flask', 'eventlet']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+{imports}
+duration = time.perf_counter() - start
+print(json.dumps({{'import_ms': duration * 1000,
+				  'loaded': [module for module in {heavy_modules!r} if module in sys.modules]}}))
+'''
+
+
+def measure_run(imports: str) -> dict:
+	completed = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+								PROBE.format(imports=imports, heavy_modules=HEAVY_MODULES)],
+							   cwd=REPOSITORY_DIRECTORY, capture_output=True, text=True)
+	if completed.returncode != 0:
+		raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+	result = json.loads(completed.stdout.strip().splitlines()[-1])
+	result['modules'] = parse_import_times(completed.stderr)
+	return result
+
+
+# lines of -X importtime: 'import time: <self us> | <cumulative us> | <indented module name>'
+def parse_import_times(import_time_output: str) -> dict:
+	cumulative_times = {}
+	for line in import_time_output.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		cumulative_times[name.strip()] = int(cumulative) / 1000
+	return cumulative_times
+
+
+def benchmark(imports: str, runs: int, top: int) -> dict:
+	results = [measure_run(imports) for _ in range(runs)]
+	durations = sorted(result['import_ms'] for result in results)
+	modules = results[-1]['modules']
+	slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+	return {'import_ms': {'mean': statistics.mean(durations), 'p50': durations[len(durations) // 2],
+						  'max': durations[-1]},
+			'loaded_heavy_modules': results[-1]['loaded'],
+			'slowest_modules_cumulative_ms': dict(slowest)}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='Benchmark of the cold-start import time of the processes.')
+	parser.add_argument('--runs', type=int, default=5)
+	parser.add_argument('--top', type=int, default=10)
+	args = parser.parse_args()
+	results = {}
+	for process, imports in PROCESS_IMPORTS.items():
+		try:
+			results[process] = benchmark(imports, args.runs, args.top)
+		except RuntimeError as e:
+			print('Skipping process {}: {}'.format(process, e), file=sys.stderr)
+	print(json.dumps({'benchmark': 'startup', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,5 +1,14 @@
 import React from "react";
-import {changePlaylistTrackPosition, deleteTrackFromPlaylist, playlistChanged, PlaylistItem} from "./api";
+import {
+    changePlaylistTrackPosition,
+    deleteTrackFromPlaylist,
+    playlistChanged,
+    playlistDelta,
+    PlaylistDelta,
+    PlaylistItem,
+    PlaylistSnapshot,
+    requestPlaylist
+} from "./api";
 import {createStyles, Theme, WithStyles, withStyles} from "@material-ui/core/styles";
 import List from '@material-ui/core/List';
 import {arrayMove, SortableContainer, SortableElement, SortEnd, SortEvent} from 'react-sortable-hoc';
@@ -26,15 +35,73 @@ const PlaylistContext = React.createContext<PlaylistContextState>(INITIAL_CONTEX
 
 class PlaylistContextProvider extends React.Component<PlaylistContextProps, PlaylistContextState> {
 
+    // version of the playlist as last received from the server, deltas are only applicable to this version
+    playlistVersion = -1;
+
     constructor(props: PlaylistContextProps) {
         super(props);
         this.state = INITIAL_CONTEXT_STATE;
     }
 
     componentDidMount() {
-        playlistChanged(this.setPlaylist);
+        playlistChanged(this.setPlaylistSnapshot);
+        playlistDelta(this.applyPlaylistDelta);
     }
 
+    setPlaylistSnapshot = (snapshot: PlaylistSnapshot) => {
+        this.playlistVersion = snapshot.version;
+        this.setPlaylist(snapshot.entries);
+    };
+
+    applyPlaylistDelta = (delta: PlaylistDelta) => {
+        if (delta.version <= this.playlistVersion) {
+            return;
+        }
+        if (delta.version !== this.playlistVersion + 1) {
+            // we missed at least one delta
+            requestPlaylist();
+            return;
+        }
+        let playlistItems = this.state.playlistItems.slice();
+        const indexOf = (playlistEntryId: string) => playlistItems.findIndex(item => item.playlist_entry_id === playlistEntryId);
+        for (const operation of delta.operations) {
+            switch (operation.op) {
+                case 'insert':
+                    playlistItems.splice(operation.position, 0, operation.entry);
+                    break;
+                case 'remove':
+                    playlistItems = playlistItems.filter(item => item.playlist_entry_id !== operation.playlist_entry_id);
+                    break;
+                case 'move': {
+                    const index = indexOf(operation.playlist_entry_id);
+                    if (index >= 0) {
+                        const [movedItem] = playlistItems.splice(index, 1);
+                        playlistItems.splice(operation.position, 0, movedItem);
+                    }
+                    break;
+                }
+                case 'status': {
+                    const index = indexOf(operation.playlist_entry_id);
+                    if (index >= 0) {
+                        const item = playlistItems[index];
+                        playlistItems[index] = {...item, status: operation.status,
+                            track: {...item.track, track_status: operation.track_status}};
+                    }
+                    break;
+                }
+                case 'update': {
+                    const index = indexOf(operation.entry.playlist_entry_id);
+                    if (index >= 0) {
+                        playlistItems[index] = operation.entry;
+                    }
+                    break;
+                }
+            }
+        }
+        this.playlistVersion = delta.version;
+        this.setPlaylist(playlistItems);
+    };
+
     onSortEnd = (sort: SortEnd, event: SortEvent) => {
         const movedEntry = this.state.playlistItems[sort.oldIndex];
         const playlistItems = arrayMove(this.state.playlistItems, sort.oldIndex, sort.newIndex);
@@ -16,6 +16,9 @@ const styles = (theme: Theme) => createStyles({
     currentEntry: {
         backgroundColor: theme.palette.primary.light
     },
+    unavailableEntry: {
+        opacity: 0.5
+    },
     duration: {
         minWidth: '40px',
         textAlign: 'right',
@@ -43,6 +46,9 @@ class TrackListEntry extends React.Component<Props, {}> {
         if (this.props.showAsCurrent) {
             listItemClasses = classNames(classes.listItem, classes.currentEntry)
         }
+        if (this.props.track.available === false) {
+            listItemClasses = classNames(listItemClasses, classes.unavailableEntry)
+        }
         return (
             <ListItem key={this.props.track.url} role={undefined} divider={true} className={listItemClasses} dense>
                 <ListItemAvatar>
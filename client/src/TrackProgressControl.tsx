@@ -9,7 +9,7 @@ import IconButton from "@material-ui/core/IconButton";
 import Slider from "@material-ui/core/Slider";
 import Replay10Icon from "@material-ui/icons/Replay10Rounded";
 import Forward10Icon from "@material-ui/icons/Forward10Rounded";
-import {formatDuration, playerTime, playerTimeUpdateActivation, seekTo, Track} from "./api";
+import {formatDuration, PlaybackClock, playbackClock, playerTimeUpdateActivation, seekTo, Track} from "./api";
 import {Subject, timer} from "rxjs";
 import {debounce} from "rxjs/operators";
 
@@ -19,6 +19,8 @@ interface State {
     playerTimeUpdateActive: boolean;
 }
 
+const PLAYER_TIME_INTERPOLATION_INTERVAL_IN_MILLISECONDS = 250;
+
 const styles = (theme: Theme) => createStyles({
     root: {
     },
@@ -65,6 +67,11 @@ class TrackProgressControl extends React.Component<Props, State> {
 
     subject = new Subject<number>();
 
+    // last received playback clock and local time of its reception
+    clock: PlaybackClock = {position: 0, rate: 0, timestamp: 0};
+    clockReceptionTime = Date.now();
+    interpolationTimer?: number;
+
     constructor(props: Props) {
         super(props);
         this.state = {
@@ -78,10 +85,33 @@ class TrackProgressControl extends React.Component<Props, State> {
     }
 
     componentDidMount() {
-        playerTime(this.setPlayerTimeIfActive);
+        playbackClock(this.setPlaybackClock);
         playerTimeUpdateActivation(this.activatePlayerTimeUpdate);
+        this.interpolationTimer = window.setInterval(this.interpolatePlayerTime,
+            PLAYER_TIME_INTERPOLATION_INTERVAL_IN_MILLISECONDS);
+    }
+
+    componentWillUnmount() {
+        window.clearInterval(this.interpolationTimer);
     }
 
+    private setPlaybackClock = (clock: PlaybackClock): void => {
+        this.clock = clock;
+        this.clockReceptionTime = Date.now();
+        this.setPlayerTimeIfActive(this.getInterpolatedPlayerTime());
+    };
+
+    private interpolatePlayerTime = (): void => {
+        if (this.clock.rate > 0) {
+            this.setPlayerTimeIfActive(this.getInterpolatedPlayerTime());
+        }
+    };
+
+    private getInterpolatedPlayerTime = (): number => {
+        const elapsed = Date.now() - this.clockReceptionTime;
+        return Math.min(this.clock.position + this.clock.rate * elapsed, this.props.track.duration);
+    };
+
     private setPlayerTimeIfActive = (time: number): void => {
         if (this.state.playerTimeUpdateActive) {
             this.setPlayerTime(time)
@@ -38,6 +38,7 @@ export interface Track {
     track_type: TrackType;
     track_status: TrackStatus;
     duration: number;
+    available?: boolean;
 }
 
 const NULL_TRACK: Track = {
@@ -62,6 +63,23 @@ export interface PlaylistItem {
     status: PlaylistItemStatus
 }
 
+export interface PlaylistSnapshot {
+    version: number;
+    entries: PlaylistItem[];
+}
+
+export type PlaylistOperation =
+    {op: 'insert', position: number, entry: PlaylistItem} |
+    {op: 'remove', playlist_entry_id: string} |
+    {op: 'move', playlist_entry_id: string, position: number} |
+    {op: 'status', playlist_entry_id: string, status: PlaylistItemStatus, track_status: TrackStatus} |
+    {op: 'update', entry: PlaylistItem}
+
+export interface PlaylistDelta {
+    version: number;
+    operations: PlaylistOperation[];
+}
+
 export interface Device {
     device_name: string;
     current_volume: number;
@@ -91,6 +109,14 @@ export interface CurrentPlayerState {
     player_state: PlayerState
 }
 
+// player time (position in milliseconds) at the time of reception and playback rate,
+// the player time in between is interpolated by the clients
+export interface PlaybackClock {
+    position: number;
+    rate: number;
+    timestamp: number;
+}
+
 type ReceiveEvent =
     'connect' |
     'sonos_setup' |
@@ -99,7 +125,8 @@ type ReceiveEvent =
     'player_state' |
     'search_results' |
     'playlist_changed' |
-    'player_time' |
+    'playlist_delta' |
+    'playback_clock' |
     'player_time_update_activation'
 
 function sonosSetup(callback: (devices: Device[]) => void) {
@@ -122,12 +149,16 @@ function searchResults(callback: (searchResult: SearchResult) => void) {
     receive('search_results', callback)
 }
 
-function playlistChanged(callback: (tracks: PlaylistItem[]) => void) {
+function playlistChanged(callback: (playlist: PlaylistSnapshot) => void) {
     receive('playlist_changed', callback)
 }
 
-function playerTime(callback: (time: number) => void) {
-    receive('player_time', callback)
+function playlistDelta(callback: (delta: PlaylistDelta) => void) {
+    receive('playlist_delta', callback)
+}
+
+function playbackClock(callback: (clock: PlaybackClock) => void) {
+    receive('playback_clock', callback)
 }
 
 function playerTimeUpdateActivation(callback: (time: number) => void) {
@@ -136,9 +167,7 @@ function playerTimeUpdateActivation(callback: (time: number) => void) {
 
 function receive(eventName: ReceiveEvent, callback: (arg: any) => void): void {
     socket.on(eventName, (payload: any) => {
-        if (eventName !== 'player_time') {
-            console.log('Calling Callback for received event', eventName, 'with payload', payload);
-        }
+        console.log('Calling Callback for received event', eventName, 'with payload', payload);
         callback(payload);
     })
 }
@@ -155,7 +184,8 @@ type SendEvent =
     'delete_track_from_playlist' |
     'change_playlist_track_position' |
     'play_track_of_playlist' |
-    'seek_to'
+    'seek_to' |
+    'request_playlist'
 
 function setVolume(item: Device, new_volume: number) {
     emit('set_volume', {device_name: item.device_name, volume: new_volume})
@@ -203,6 +233,10 @@ function playTrackOfPlaylist(playlistEntryId: string) {
     emit('play_track_of_playlist', toPlaylistEntryIdJson(playlistEntryId))
 }
 
+function requestPlaylist() {
+    emit('request_playlist', {})
+}
+
 function seekTo(timeInMilliseconds: number) {
     emit('seek_to', {player_time: timeInMilliseconds})
 }
@@ -242,12 +276,14 @@ export {
     playNextTrack,
     playPreviousTrack,
     playlistChanged,
+    playlistDelta,
+    requestPlaylist,
     addTrackToPlaylist,
     playTrackOfPlaylist,
     deleteTrackFromPlaylist,
     changePlaylistTrackPosition,
     formatDuration,
-    playerTime,
+    playbackClock,
     playerTimeUpdateActivation,
     seekTo
 }
\ No newline at end of file
@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+import queue
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock
+
+from . import *
+
+# the listeners receive a frame of silence whenever the source (the HTTP output of VLC) delivered no audio for
+# longer than SOURCE_UNDERRUN_IN_SECONDS, e.g. while VLC switches to the next track, buffers after a seek or is paused
+SOURCE_UNDERRUN_IN_SECONDS = 0.5
+# silence is sent ahead of time, such that the buffers of the listeners never run dry
+SILENCE_LEAD_IN_SECONDS = 0.2
+SOURCE_RECONNECT_DELAY_IN_SECONDS = 0.1
+SOURCE_READ_TIMEOUT_IN_SECONDS = 2
+SOURCE_READ_SIZE = 4096
+# about 3 seconds of audio, older frames are dropped for listeners which do not keep up
+LISTENER_QUEUE_SIZE_IN_FRAMES = 128
+LISTENER_QUEUE_TIMEOUT_IN_SECONDS = 1
+# bytes of audio between two ICY metadata blocks, for listeners which request metadata (header Icy-MetaData: 1)
+ICY_METADATA_INTERVAL = 8192
+# MPEG 1, layer III, 192 kbit/s, 44.1 kHz, stereo: format of VLC_CONTINUOUS_TRANSCODE_CMD
+DEFAULT_FRAME_HEADER = bytes([0xFF, 0xFB, 0xB0, 0x04])
+
+# kbit/s by bitrate index of layer III, for MPEG 1 and for MPEG 2 / 2.5
+MPEG_1_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MPEG_2_BITRATES = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+# Hz by version bits and sample rate index
+SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+logger = logging.getLogger(PlayerLoggerName.CONTINUOUS_STREAM.value)
+
+
+@unique
+class OutputStreamMode(Enum):
+	# VLC serves the stream of each track, the Sonos coordinators are tuned to the stream of every track and after seeks
+	PER_TRACK = 'per-track'
+	# the output stream is served by ContinuousStream, the Sonos coordinators are only tuned if they are not connected
+	CONTINUOUS = 'continuous'
+
+
+# Returns the length in bytes and the duration in seconds of the MP3 (layer III) frame starting with the header,
+# or None if the bytes are no valid frame header.
+def parse_mp3_frame_header(header: bytes) -> Optional[Tuple[int, float]]:
+	if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+		return None
+	version = (header[1] >> 3) & 0x03
+	layer = (header[1] >> 1) & 0x03
+	bitrate_index = header[2] >> 4
+	sample_rate_index = (header[2] >> 2) & 0x03
+	if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+		return None
+	padding = (header[2] >> 1) & 0x01
+	sample_rate = SAMPLE_RATES[version][sample_rate_index]
+	if version == 3:
+		return 144000 * MPEG_1_BITRATES[bitrate_index] // sample_rate + padding, 1152 / sample_rate
+	return 72000 * MPEG_2_BITRATES[bitrate_index] // sample_rate + padding, 576 / sample_rate
+
+
+# A frame of silence in the format of the given frame: a frame without CRC and padding whose side information and
+# main data are zero.
+def create_silent_mp3_frame(header: bytes) -> bytes:
+	silent_header = bytes([header[0], header[1] | 0x01, header[2] & 0xFD, header[3]])
+	frame_length, _ = parse_mp3_frame_header(silent_header)
+	return silent_header + bytes(frame_length - len(silent_header))
+
+
+def create_icy_metadata_block(title: Optional[str]) -> bytes:
+	if title is None:
+		return b'\x00'
+	metadata = "StreamTitle='{}';".format(title.replace("'", '')).encode('utf-8')[:255 * 16]
+	length = (len(metadata) + 15) // 16
+	return bytes([length]) + metadata.ljust(length * 16, b'\x00')
+
+
+# Splits a byte stream into MP3 frames. Bytes which do not belong to a frame (e.g. a truncated frame at the start
+# of a stream or tags) are skipped. A frame is only returned once the header of the following frame is valid,
+# such that a sync word within audio data is not mistaken for a frame.
+class Mp3FrameSplitter:
+
+	def __init__(self):
+		self._buffer = bytearray()
+		self.skipped_bytes = 0
+
+	def reset(self) -> None:
+		self._buffer.clear()
+
+	def feed(self, data: bytes) -> List[bytes]:
+		self._buffer.extend(data)
+		frames = []
+		position = 0
+		while len(self._buffer) - position >= 4:
+			frame = parse_mp3_frame_header(self._buffer[position:position + 4])
+			if frame is None:
+				position = position + 1
+				self.skipped_bytes = self.skipped_bytes + 1
+				continue
+			frame_length = frame[0]
+			if len(self._buffer) - position < frame_length + 4:
+				break
+			if parse_mp3_frame_header(self._buffer[position + frame_length:position + frame_length + 4]) is None:
+				position = position + 1
+				self.skipped_bytes = self.skipped_bytes + 1
+				continue
+			frames.append(bytes(self._buffer[position:position + frame_length]))
+			position = position + frame_length
+		del self._buffer[:position]
+		return frames
+
+	# returns the last frame of a stream which ended, if it is complete
+	def flush(self) -> List[bytes]:
+		frame = parse_mp3_frame_header(self._buffer[:4])
+		frames = [bytes(self._buffer)] if frame and frame[0] == len(self._buffer) else []
+		self._buffer.clear()
+		return frames
+
+
+class StreamListener:
+
+	def __init__(self, address: str, icy_metadata: bool):
+		self.address = address
+		self.icy_metadata = icy_metadata
+		self.frames: queue.Queue = queue.Queue(maxsize=LISTENER_QUEUE_SIZE_IN_FRAMES)
+		self.dropped_frames = 0
+
+	# a listener which does not keep up loses its oldest frame, the other buffered frames are kept
+	def put(self, frame: bytes) -> None:
+		while True:
+			try:
+				self.frames.put_nowait(frame)
+				return
+			except queue.Full:
+				try:
+					self.frames.get_nowait()
+					self.dropped_frames = self.dropped_frames + 1
+				except queue.Empty:
+					pass
+
+	def discard_frames(self) -> None:
+		try:
+			while True:
+				self.frames.get_nowait()
+		except queue.Empty:
+			pass
+
+
+# Long-lived HTTP audio output: all listeners (the Sonos coordinators) receive one continuous MP3 stream, into
+# which the audio of the source is spliced frame by frame. The source is the HTTP output of VLC, which is closed
+# and opened again by VLC for every track, the stream of the listeners is not interrupted: the source is read
+# again as soon as it is available and gaps are filled with silence. Seeks are applied by VLC to the source,
+# frames of the previous position buffered for the listeners are discarded.
+# The stream can be consumed by any HTTP client, e.g. curl http://localhost:8080/yousonos.mp3 > out.mp3
+class ContinuousStream(StoppableThread):
+
+	def __init__(self, port: int, stream_name: str, source_url: str):
+		super().__init__(name='ContinuousStreamThread')
+		self._stream_name = stream_name
+		self._source_url = source_url
+		self._stopped = Event()
+		self._lock = Lock()
+		self._listeners: Set[StreamListener] = set()
+		self._title: Optional[str] = None
+		# monotonic time until which the listeners received audio
+		self._sent_until = time.monotonic()
+		self._sending_silence = True
+		self._silent_frame = create_silent_mp3_frame(DEFAULT_FRAME_HEADER)
+		self._silent_frame_duration = parse_mp3_frame_header(self._silent_frame)[1]
+		self._statistics = {'source_connections': 0, 'source_frames': 0, 'silent_frames': 0, 'dropped_frames': 0}
+		self._http_server = ThreadingHTTPServer(('', port), self._create_request_handler())
+		self._http_server.daemon_threads = True
+		self._http_thread = Thread(target=self._http_server.serve_forever, name='ContinuousStreamHttpThread', daemon=True)
+		self._source_thread = Thread(target=self._read_source, name='ContinuousStreamSourceThread', daemon=True)
+
+	def get_port(self) -> int:
+		return self._http_server.server_address[1]
+
+	def get_listener_addresses(self) -> Set[str]:
+		with self._lock:
+			return {listener.address for listener in self._listeners}
+
+	def get_statistics(self) -> Dict[str, int]:
+		with self._lock:
+			return dict(self._statistics, listeners=len(self._listeners),
+						dropped_frames=self._statistics['dropped_frames'] +
+									   sum(listener.dropped_frames for listener in self._listeners))
+
+	def set_title(self, title: str) -> None:
+		with self._lock:
+			self._title = title
+
+	# called on track changes and seeks, such that the listeners do not play audio of the previous position
+	def discard_buffered_frames(self) -> None:
+		with self._lock:
+			for listener in self._listeners:
+				listener.discard_frames()
+
+	def stop(self) -> None:
+		self._stopped.set()
+		self._http_server.shutdown()
+
+	def run(self) -> None:
+		logger.info('Serving continuous output stream on port %d (source: %s).', self.get_port(), self._source_url)
+		self._http_thread.start()
+		self._source_thread.start()
+		try:
+			while not self._stopped.is_set():
+				with self._lock:
+					now = time.monotonic()
+					if not self._sending_silence and now > self._sent_until + SOURCE_UNDERRUN_IN_SECONDS:
+						logger.debug('No audio from the source for %.3f seconds. Sending silence ...', now - self._sent_until)
+						self._sending_silence = True
+					while self._sending_silence and self._sent_until - now < SILENCE_LEAD_IN_SECONDS:
+						self._broadcast(self._silent_frame, self._silent_frame_duration)
+						self._statistics['silent_frames'] = self._statistics['silent_frames'] + 1
+				self._stopped.wait(self._silent_frame_duration)
+		finally:
+			self._http_server.server_close()
+
+	def _read_source(self) -> None:
+		splitter = Mp3FrameSplitter()
+		while not self._stopped.is_set():
+			splitter.reset()
+			try:
+				with urllib.request.urlopen(self._source_url, timeout=SOURCE_READ_TIMEOUT_IN_SECONDS) as source:
+					logger.debug('Connected to source %s.', self._source_url)
+					with self._lock:
+						self._statistics['source_connections'] = self._statistics['source_connections'] + 1
+					while not self._stopped.is_set():
+						data = source.read1(SOURCE_READ_SIZE)
+						if not data:
+							self._splice(splitter.flush())
+							break
+						self._splice(splitter.feed(data))
+			except OSError:
+				# the source is only available while VLC plays a track
+				pass
+			self._stopped.wait(SOURCE_RECONNECT_DELAY_IN_SECONDS)
+
+	def _splice(self, frames: List[bytes]) -> None:
+		if not frames:
+			return
+		with self._lock:
+			self._sending_silence = False
+			for frame in frames:
+				frame_duration = parse_mp3_frame_header(frame)[1]
+				self._broadcast(frame, frame_duration)
+				self._statistics['source_frames'] = self._statistics['source_frames'] + 1
+			# the silence follows the format of the source
+			if frames[-1][:4] != self._silent_frame[:4]:
+				self._silent_frame = create_silent_mp3_frame(frames[-1][:4])
+				self._silent_frame_duration = parse_mp3_frame_header(self._silent_frame)[1]
+
+	# must be called with the lock held
+	def _broadcast(self, frame: bytes, frame_duration: float) -> None:
+		self._sent_until = max(self._sent_until, time.monotonic()) + frame_duration
+		for listener in self._listeners:
+			listener.put(frame)
+
+	def _add_listener(self, listener: StreamListener) -> None:
+		with self._lock:
+			self._listeners.add(listener)
+		logger.info('Listener %s connected to the continuous output stream.', listener.address)
+
+	def _remove_listener(self, listener: StreamListener) -> None:
+		with self._lock:
+			self._listeners.discard(listener)
+			self._statistics['dropped_frames'] = self._statistics['dropped_frames'] + listener.dropped_frames
+		logger.info('Listener %s disconnected from the continuous output stream.', listener.address)
+
+	def _get_title(self) -> Optional[str]:
+		with self._lock:
+			return self._title
+
+	def _stream_to(self, listener: StreamListener, output: Any) -> None:
+		bytes_until_metadata = ICY_METADATA_INTERVAL
+		sent_title = None
+		while not self._stopped.is_set():
+			try:
+				frame = listener.frames.get(timeout=LISTENER_QUEUE_TIMEOUT_IN_SECONDS)
+			except queue.Empty:
+				continue
+			if not listener.icy_metadata:
+				output.write(frame)
+				continue
+			while frame:
+				output.write(frame[:bytes_until_metadata])
+				written = min(len(frame), bytes_until_metadata)
+				frame = frame[written:]
+				bytes_until_metadata = bytes_until_metadata - written
+				if bytes_until_metadata == 0:
+					title = self._get_title()
+					output.write(create_icy_metadata_block(title if title != sent_title else None))
+					sent_title = title
+					bytes_until_metadata = ICY_METADATA_INTERVAL
+
+	def _create_request_handler(self) -> type:
+		continuous_stream = self
+
+		class ContinuousStreamRequestHandler(BaseHTTPRequestHandler):
+
+			def do_HEAD(self) -> None:
+				self._send_headers()
+
+			def do_GET(self) -> None:
+				if not self._send_headers():
+					return
+				listener = StreamListener(self.client_address[0], self._requests_icy_metadata())
+				continuous_stream._add_listener(listener)
+				try:
+					continuous_stream._stream_to(listener, self.wfile)
+				except OSError:
+					pass
+				finally:
+					continuous_stream._remove_listener(listener)
+
+			def log_message(self, format: str, *args: Any) -> None:
+				logger.debug('%s - %s', self.address_string(), format % args)
+
+			def _requests_icy_metadata(self) -> bool:
+				return self.headers.get('Icy-MetaData', '0').strip() == '1'
+
+			def _send_headers(self) -> bool:
+				if self.path.split('?')[0].lstrip('/') != continuous_stream._stream_name:
+					self.send_error(404)
+					return False
+				self.send_response(200)
+				self.send_header('Content-Type', 'audio/mpeg')
+				self.send_header('Cache-Control', 'no-cache, no-store')
+				self.send_header('Connection', 'close')
+				if self._requests_icy_metadata():
+					self.send_header('icy-metaint', str(ICY_METADATA_INTERVAL))
+				self.end_headers()
+				return True
+
+		return ContinuousStreamRequestHandler
+
+
+# Tunes the Sonos coordinators only if they are not connected to the continuous stream, e.g. on the first track
+# or after a coordinator was added or restarted. The title of the track is sent as ICY metadata instead.
+class ContinuousStreamConsumer(StreamConsumer):
+
+	def __init__(self, continuous_stream: ContinuousStream, sonos_environment: SonosEnvironment):
+		self._continuous_stream = continuous_stream
+		self._sonos_environment = sonos_environment
+
+	def play_stream(self, track: Track) -> None:
+		self._continuous_stream.set_title('{} - {}'.format(track.get_title(), track.get_artist()))
+		self._continuous_stream.discard_buffered_frames()
+		self._sonos_environment.play_stream(track, self._continuous_stream.get_listener_addresses())
@@ -1,63 +1,361 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from collections import deque
+from contextlib import nullcontext
+from threading import Lock
+from typing import Hashable, NamedTuple
+
+from redis import asyncio as async_redis
+from redis.exceptions import ResponseError
+
 from . import *
+from CommandBus import CommandTransport, CONSUMER_GROUP_NAME, STREAM_MESSAGE_FIELD, STREAM_MESSAGE_FIELD_BYTES, \
+	get_stream_name, get_unique_consumer_name
 
 logger = logging.getLogger(PlayerLoggerName.EVENT_CONSUMER.value)
 
+SATURATED_LANE_RETRY_INTERVAL_IN_SECONDS = 0.05
+
+STREAM_READ_BLOCK_TIME_IN_MILLIS = 1000
+STREAM_READ_COUNT = 100
+# entries which are not acknowledged by another consumer of the group within this time are claimed
+PENDING_ENTRY_RECLAIM_MIN_IDLE_TIME_IN_MILLIS = 30 * 1000
+PENDING_ENTRY_RECLAIM_INTERVAL_IN_SECONDS = 10
+# entries which were delivered more often are acknowledged without handling them (poison messages)
+MAX_NUMBER_OF_DELIVERIES = 5
+MESSAGE_ID = 'id'
+
+PLAYLIST_ORDERING_KEY = 'playlist'
+SET_VOLUME_ORDERING_KEY_PREFIX = 'device:'
+
+
+# time at which the server received the event (None if unknown), span context of the publisher of the event and time
+# at which the consumer received the event
+class EventOrigin(NamedTuple):
+	received_at: Optional[float]
+	span_context: SpanContext
+	consumed_at_in_nanos: int
 
+
+# event, sid, payload, message id and origin of the event
+EventQueueEntry = Tuple[ReceiveEvent, str, Any, str, EventOrigin]
+
+
+# Consumes the events of a redis channel on an asyncio event loop. Events are dispatched concurrently to
+# run_event(...), which is executed on the command lane of the worker pool. Events with the same ordering key
+# (see get_ordering_key(...)) are handled one after the other in the order of their arrival.
+#
+# Consecutive events with equal coalescing keys (see get_coalescing_key(...)), e.g. the volume changes of a dragged
+# slider, are coalesced: an event is handled after coalescing_window_in_seconds and only if no newer event with the
+# same coalescing key was received in the meantime, superseded events are acknowledged without handling them.
+#
+# If batch_state_writes is set, all state writes and emits of an event are flushed in one redis transaction after
+# the event was handled (see write_batch()). The redis round trips of each event are logged and accumulated per
+# event type (see get_round_trip_statistics()). The handling time and the latency since the reception of the event by
+# the server are recorded as metrics per event type.
+#
+# Each event is handled in the trace of its publisher (a new trace for events published outside of traces). The time
+# until the handling starts is recorded as consume span, the handling as handle span.
+#
+# With the streams transport, events are read from a redis stream as member consumer_name of a consumer group.
+# Several processes can consume the same stream, each event is delivered to one of them. Events are acknowledged
+# after they were handled. Events which were not acknowledged are read again after a restart of the consumer
+# or are claimed by another consumer of the group.
 class EventConsumer(StoppableThread):
 
-	def __init__(self, args: Namespace, queue_name: str):
+	def __init__(self, args: Namespace, queue_name: str, executor: WorkerLaneExecutor, consumer_name: str,
+				 batch_state_writes: bool, coalescing_window_in_seconds: float = 0):
 		super(EventConsumer, self).__init__()
 		self._queue_name = queue_name
-		self.redis = redis.from_url(args.redis_url, decode_responses=True)
-		self.redis_pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
-		self.redis_pubsub.subscribe(self._queue_name)
+		self._stream_name = get_stream_name(queue_name)
+		self._consumer_name = consumer_name
+		self._transport = CommandTransport(args.command_transport)
+		self._redis_url = args.redis_url
+		self._executor = executor
+		# responses are not decoded, messages may be encoded with a binary codec
+		self.redis = redis.from_url(args.redis_url)
+		self._async_redis: async_redis.Redis = None
+		self._stopped = False
+		self._queues_by_ordering_key: Dict[Hashable, Deque[EventQueueEntry]] = {}
+		self._coalescing_window_in_seconds = coalescing_window_in_seconds
+		self._coalesced_events: Dict[ReceiveEvent, int] = {}
+		self._queue_processing_tasks: Set[asyncio.Task] = set()
+		self._batch_state_writes = batch_state_writes
+		self._round_trip_statistics_lock = Lock()
+		self._round_trips_by_event: Dict[ReceiveEvent, Tuple[int, int]] = {}
 
 	def run(self):
+		asyncio.run(self._consume())
+
+	async def _consume(self) -> None:
+		self._async_redis = async_redis.from_url(self._redis_url)
 		try:
-			for message in self.redis_pubsub.listen():
+			async for message in self._listen():
 				try:
 					stopped = self.handle_message(message)
 					if stopped:
 						break
 				except Exception as e:
 					logger.exception('Exception in main loop of %s when handling message: %s', type(self).__name__, message)
+					# the message can not be handled, redelivering it would fail again
+					await self._acknowledge(message.get(MESSAGE_ID))
 		finally:
-			self.redis_pubsub.unsubscribe()
-			self.redis_pubsub.punsubscribe()
-			self.redis_pubsub.close()
+			for task in list(self._queue_processing_tasks):
+				task.cancel()
+			await self._async_redis.aclose()
+
+	def _listen(self):
+		if self._transport is CommandTransport.STREAMS:
+			return self._listen_on_stream()
+		return self._listen_on_channel()
+
+	async def _listen_on_channel(self):
+		pubsub = self._async_redis.pubsub(ignore_subscribe_messages=True)
+		await pubsub.subscribe(self._queue_name)
+		try:
+			async for message in pubsub.listen():
+				yield message
+		finally:
+			await pubsub.unsubscribe()
+			await pubsub.punsubscribe()
+			await pubsub.aclose()
+
+	async def _listen_on_stream(self):
+		await self._create_consumer_group()
+		# entries delivered to this consumer before a restart, which were not acknowledged
+		last_id = '0'
+		while not self._stopped:
+			messages, last_id = await self._read_from_stream(last_id, block=None)
+			if not last_id:
+				break
+			for message in messages:
+				yield message
+		last_reclaim_timestamp = time.monotonic()
+		while not self._stopped:
+			if time.monotonic() - last_reclaim_timestamp > PENDING_ENTRY_RECLAIM_INTERVAL_IN_SECONDS:
+				last_reclaim_timestamp = time.monotonic()
+				for message in await self._reclaim_pending_entries():
+					yield message
+			messages, _ = await self._read_from_stream('>', block=STREAM_READ_BLOCK_TIME_IN_MILLIS)
+			for message in messages:
+				yield message
+
+	async def _create_consumer_group(self) -> None:
+		try:
+			# commands published before the group was created for the first time are ignored
+			await self._call_redis('xgroup_create', self._stream_name, CONSUMER_GROUP_NAME, id='$', mkstream=True)
+		except ResponseError as e:
+			if 'BUSYGROUP' not in str(e):
+				raise
+
+	async def _read_from_stream(self, last_id: str, block: int) -> Tuple[List[Dict], str]:
+		response = await self._call_redis('xreadgroup', CONSUMER_GROUP_NAME, self._consumer_name,
+										  {self._stream_name: last_id}, count=STREAM_READ_COUNT, block=block)
+		messages = []
+		last_read_id = None
+		for _, entries in response or []:
+			messages.extend(await self._to_messages(entries))
+			if entries:
+				last_read_id = entries[-1][0]
+		return messages, last_read_id
+
+	async def _reclaim_pending_entries(self) -> List[Dict]:
+		pending_entries = await self._call_redis('xpending_range', self._stream_name, CONSUMER_GROUP_NAME,
+												 '-', '+', STREAM_READ_COUNT)
+		reclaimable_ids = []
+		for pending_entry in pending_entries:
+			if pending_entry['consumer'] == self._consumer_name.encode('utf-8') or \
+					pending_entry['time_since_delivered'] < PENDING_ENTRY_RECLAIM_MIN_IDLE_TIME_IN_MILLIS:
+				continue
+			if pending_entry['times_delivered'] >= MAX_NUMBER_OF_DELIVERIES:
+				logger.error('%s drops stream entry %s of %s after %d failed deliveries.', type(self).__name__,
+							 pending_entry['message_id'], self._stream_name, pending_entry['times_delivered'])
+				await self._acknowledge(pending_entry['message_id'])
+				continue
+			reclaimable_ids.append(pending_entry['message_id'])
+		if not reclaimable_ids:
+			return []
+		entries = await self._call_redis('xclaim', self._stream_name, CONSUMER_GROUP_NAME, self._consumer_name,
+										 PENDING_ENTRY_RECLAIM_MIN_IDLE_TIME_IN_MILLIS, reclaimable_ids)
+		logger.info('%s reclaimed %d pending stream entries of %s.', type(self).__name__, len(entries), self._stream_name)
+		return await self._to_messages(entries)
+
+	async def _to_messages(self, entries) -> List[Dict]:
+		messages = []
+		for message_id, fields in entries:
+			if not fields:
+				# entry was trimmed from the stream
+				await self._acknowledge(message_id)
+				continue
+			messages.append({MESSAGE_ID: message_id, STREAM_MESSAGE_FIELD: fields[STREAM_MESSAGE_FIELD_BYTES]})
+		return messages
+
+	async def _acknowledge(self, message_id: str) -> None:
+		if message_id is None:
+			return
+		try:
+			await self._call_redis('xack', self._stream_name, CONSUMER_GROUP_NAME, message_id)
+		except Exception:
+			logger.warning('Acknowledging stream entry %s of %s failed.', message_id, self._stream_name, exc_info=True)
+
+	async def _call_redis(self, command: str, *args, **kwargs) -> Any:
+		return await getattr(self._async_redis, command)(*args, **kwargs)
 
 	def handle_message(self, message) -> bool:
 		logger.debug('%s received message: %s', type(self).__name__, message)
-		message_dict = json.loads(message['data'])
+		message_dict = decode(message['data'])
 		event = ReceiveEvent(message_dict[General.EVENT_NAME])
 		if event == ReceiveEvent.STOP:
 			return True
 		payload = message_dict[General.EVENT_PAYLOAD]
 		sid = message_dict[General.SID]
-		logger.info('%s received event \'%s\' from \'%s\' with payload: %s', type(self).__name__, event.value, sid, payload)
-		self.run_event(event, sid, payload)
+		origin = EventOrigin(message_dict.get(General.RECEIVED_AT), self._get_span_context(message_dict), time.time_ns())
+		logger.info('%s received event \'%s\' from \'%s\' with payload: %s (trace: %s)', type(self).__name__, event.value,
+					sid, payload, origin.span_context.trace_id)
+		self._dispatch(event, sid, payload, message.get(MESSAGE_ID), origin)
 		return False
 
+	@staticmethod
+	def _get_span_context(message_dict: Dict[str, Any]) -> SpanContext:
+		trace_id = message_dict.get(General.TRACE_ID)
+		if not trace_id:
+			return SpanContext(new_trace_id(), None)
+		return SpanContext(trace_id, message_dict.get(General.PARENT_SPAN_ID))
+
 	def stop(self) -> None:
-		self.redis.publish(self._queue_name, json.dumps({General.EVENT_NAME: ReceiveEvent.STOP.value,
-													General.EVENT_PAYLOAD: {},
-													General.SID: None}))
+		self._stopped = True
+		if self._transport is CommandTransport.PUBSUB:
+			self.redis.publish(self._queue_name, encode({General.EVENT_NAME: ReceiveEvent.STOP.value,
+													 General.EVENT_PAYLOAD: {},
+													 General.SID: None}))
+
+	# Events with equal ordering keys are handled sequentially, all other events concurrently.
+	# By default all events of the channel are handled sequentially.
+	def get_ordering_key(self, event: ReceiveEvent, sid: str, payload: Any) -> Hashable:
+		return self._queue_name
+
+	# Consecutive events with equal keys are coalesced (the newest wins), events without key (None) are never
+	# coalesced. Events are only coalesced with events of the same ordering key.
+	def get_coalescing_key(self, event: ReceiveEvent, sid: str, payload: Any) -> Optional[Hashable]:
+		return None
 
 	@abstractmethod
 	def run_event(self, event: ReceiveEvent, sid: str, payload: Any) -> None: raise NotImplementedError
 
+	def get_coalescing_statistics(self) -> Dict[str, int]:
+		return {event.value: number_of_events for event, number_of_events in self._coalesced_events.items()}
+
+	def get_round_trip_statistics(self) -> Dict[str, Dict[str, IntOrStr]]:
+		with self._round_trip_statistics_lock:
+			return {event.value: {'events': number_of_events,
+								  'round_trips': round_trips,
+								  'mean_round_trips': round_trips / number_of_events}
+					for event, (number_of_events, round_trips) in self._round_trips_by_event.items()}
+
+	def _run_event_and_count_round_trips(self, event: ReceiveEvent, sid: str, payload: Any, origin: EventOrigin) -> None:
+		record_span('consume', origin.span_context, origin.consumed_at_in_nanos, time.time_ns(), SpanKind.CONSUMER,
+					queue=self._queue_name)
+		round_trips_before = get_redis_round_trips()
+		start = time.monotonic()
+		try:
+			with start_trace('handle ' + event.value, origin.span_context, event=event.value, sid=str(sid)), \
+					write_batch() if self._batch_state_writes else nullcontext():
+				self.run_event(event, sid, payload)
+		finally:
+			# the counter is thread local, the round trips of other events handled concurrently are not included
+			observe(Metric.COMMAND_HANDLING, time.monotonic() - start, event=event.value)
+			round_trips = get_redis_round_trips() - round_trips_before
+			with self._round_trip_statistics_lock:
+				number_of_events, total_round_trips = self._round_trips_by_event.get(event, (0, 0))
+				self._round_trips_by_event[event] = (number_of_events + 1, total_round_trips + round_trips)
+			logger.info('%s handled event \'%s\' with %d redis round trips (trace: %s).', type(self).__name__, event.value,
+						round_trips, origin.span_context.trace_id)
+
+	def _dispatch(self, event: ReceiveEvent, sid: str, payload: Any, message_id: str, origin: EventOrigin) -> None:
+		ordering_key = self.get_ordering_key(event, sid, payload)
+		queue = self._queues_by_ordering_key.get(ordering_key)
+		if queue is None:
+			queue = deque()
+			self._queues_by_ordering_key[ordering_key] = queue
+			task = asyncio.create_task(self._process_queue(ordering_key, queue))
+			self._queue_processing_tasks.add(task)
+			task.add_done_callback(self._queue_processing_tasks.discard)
+		queue.append((event, sid, payload, message_id, origin))
+
+	async def _process_queue(self, ordering_key: Hashable, queue: Deque[EventQueueEntry]) -> None:
+		# the queue is removed as soon as it is drained, events are only dispatched on the event loop
+		# thread, hence, no event can be added between the check for emptiness and the removal
+		while queue:
+			event, sid, payload, message_id, origin = await self._next_event(queue)
+			try:
+				await self._run_event_in_executor(event, sid, payload, origin)
+			except Exception:
+				logger.exception('Exception in %s when handling event \'%s\' from \'%s\' with payload: %s',
+								 type(self).__name__, event.value, sid, payload)
+			if origin.received_at is not None:
+				# server and player share the clock, see the playback clock
+				observe(Metric.COMMAND_LATENCY, time.time() - origin.received_at, event=event.value)
+			# failed events are logged and acknowledged as well, redelivering them would fail again
+			await self._acknowledge(message_id)
+		del self._queues_by_ordering_key[ordering_key]
+
+	async def _next_event(self, queue: Deque[EventQueueEntry]) -> EventQueueEntry:
+		next_event = queue.popleft()
+		coalescing_key = self.get_coalescing_key(*next_event[:3])
+		if coalescing_key is None:
+			return next_event
+		if self._coalescing_window_in_seconds > 0:
+			await asyncio.sleep(self._coalescing_window_in_seconds)
+		while queue and self.get_coalescing_key(*queue[0][:3]) == coalescing_key:
+			superseded_event = next_event
+			next_event = queue.popleft()
+			self._coalesced_events[superseded_event[0]] = self._coalesced_events.get(superseded_event[0], 0) + 1
+			logger.debug('%s coalesced event \'%s\' with payload %s (superseded by payload %s).', type(self).__name__,
+						 superseded_event[0].value, superseded_event[2], next_event[2])
+			await self._acknowledge(superseded_event[3])
+		return next_event
+
+	async def _run_event_in_executor(self, event: ReceiveEvent, sid: str, payload: Any, origin: EventOrigin) -> None:
+		future = self._executor.try_submit(self._run_event_and_count_round_trips, event, sid, payload, origin)
+		while future is None:
+			# never block the event loop on a saturated lane
+			await asyncio.sleep(SATURATED_LANE_RETRY_INTERVAL_IN_SECONDS)
+			future = self._executor.try_submit(self._run_event_and_count_round_trips, event, sid, payload, origin)
+		await asyncio.wrap_future(future)
+
 
 class PlayerEventsConsumer(EventConsumer):
 
-	def __init__(self, args: Namespace, sonos_environment: SonosEnvironment, player: Player, track_factory: TrackFactory, playlist: Playlist):
-		super().__init__(args, General.QUEUE_CHANNEL_NAME_PLAYER_COMMANDS)
+	def __init__(self, args: Namespace, sonos_environment: SonosEnvironment, player: Player, track_factory: TrackFactory,
+				 playlist: Playlist, executor: WorkerLaneExecutor):
+		# there is one player, which reads its own unacknowledged commands again after a restart.
+		# state changes of a command (e.g. player state, current track and playlist on play) are flushed together
+		super().__init__(args, General.QUEUE_CHANNEL_NAME_PLAYER_COMMANDS, executor, socket.gethostname(), True,
+						 args.command_coalescing_window / 1000)
 		self._sonos_environment = sonos_environment
 		self._player = player
 		self._track_factory = track_factory
 		self._playlist = playlist
 
+	def get_ordering_key(self, event: ReceiveEvent, sid: str, payload: Any) -> Hashable:
+		# volume changes of different devices are independent of each other and of the playback
+		if event == ReceiveEvent.SET_VOLUME:
+			return SET_VOLUME_ORDERING_KEY_PREFIX + payload['device_name']
+		# events which change the current entry or its playback (e.g. play a track, then seek in it) are applied in
+		# the order they were sent
+		return PLAYLIST_ORDERING_KEY
+
+	def get_coalescing_key(self, event: ReceiveEvent, sid: str, payload: Any) -> Optional[Hashable]:
+		# only the newest volume of a device and the newest seek position of a client are applied. Seeks of different
+		# clients are not coalesced: each client waits for the player time update activation of its own seek
+		if event == ReceiveEvent.SET_VOLUME:
+			return self.get_ordering_key(event, sid, payload), event
+		if event == ReceiveEvent.SEEK_TO:
+			return self.get_ordering_key(event, sid, payload), event, sid
+		return None
+
 	def run_event(self, event: ReceiveEvent, sid: str, payload: Any):
 		if event == ReceiveEvent.TOGGLE_PLAY_PAUSE:
 			self._player.toggle_play_pause()
@@ -92,10 +390,16 @@ class PlayerEventsConsumer(EventConsumer):
 
 class SearchEventConsumer(EventConsumer):
 
-	def __init__(self, args: Namespace, search_service: SearchService):
-		super().__init__(args, General.QUEUE_CHANNEL_NAME_SEARCH)
+	def __init__(self, args: Namespace, search_service: SearchService, executor: WorkerLaneExecutor):
+		# several search workers may consume the search commands. search results are emitted as soon as they are
+		# available, hence, writes are not batched
+		super().__init__(args, General.QUEUE_CHANNEL_NAME_SEARCH, executor, get_unique_consumer_name(), False)
 		self._search_service = search_service
 
+	def get_ordering_key(self, event: ReceiveEvent, sid: str, payload: Any) -> Hashable:
+		# searches of different clients are independent of each other
+		return sid
+
 	def run_event(self, event: ReceiveEvent, sid: str, payload: Any):
 		if event == ReceiveEvent.SEARCH_TRACKS:
 			self._search_service.run_search(payload['search_term'], payload['batch_index'],
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from random import random
+from typing import Generic, Iterator, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class IndexedSequenceNode(Generic[T]):
+
+	__slots__ = ('value', '_priority', '_size', '_left', '_right', '_parent')
+
+	def __init__(self, value: T):
+		self.value = value
+		self._priority = random()
+		self._size = 1
+		self._left: Optional[IndexedSequenceNode[T]] = None
+		self._right: Optional[IndexedSequenceNode[T]] = None
+		self._parent: Optional[IndexedSequenceNode[T]] = None
+
+
+# Sequence backed by an implicit treap (randomized balanced binary tree ordered by position).
+# Inserting, removing and moving values as well as determining the position of a node take O(log n) expected time.
+# Nodes returned by insert(...) remain valid handles of their value until the value is removed.
+class IndexedSequence(Generic[T]):
+
+	def __init__(self):
+		self._root: Optional[IndexedSequenceNode[T]] = None
+
+	def __len__(self) -> int:
+		return self._size(self._root)
+
+	def __iter__(self) -> Iterator[T]:
+		return (node.value for node in self.nodes())
+
+	def nodes(self, start: int = 0) -> Iterator[IndexedSequenceNode[T]]:
+		node = self.node_at(start) if 0 <= start < len(self) else None
+		while node is not None:
+			yield node
+			node = self.next_node(node)
+
+	def clear(self) -> None:
+		self._root = None
+
+	def insert(self, index: int, value: T) -> IndexedSequenceNode[T]:
+		node = IndexedSequenceNode(value)
+		self._insert_node(index, node)
+		return node
+
+	def append(self, value: T) -> IndexedSequenceNode[T]:
+		return self.insert(len(self), value)
+
+	def remove(self, node: IndexedSequenceNode[T]) -> None:
+		left, rest = self._split(self._root, self.index_of(node))
+		removed, right = self._split(rest, 1)
+		if removed is not node:
+			raise ValueError('Node {} is not part of this sequence.'.format(node))
+		self._root = self._merge(left, right)
+
+	def move(self, node: IndexedSequenceNode[T], index: int) -> None:
+		self.remove(node)
+		self._insert_node(index, node)
+
+	def index_of(self, node: IndexedSequenceNode[T]) -> int:
+		index = self._size(node._left)
+		while node._parent is not None:
+			if node is node._parent._right:
+				index = index + self._size(node._parent._left) + 1
+			node = node._parent
+		if node is not self._root:
+			raise ValueError('Node is not part of this sequence.')
+		return index
+
+	def node_at(self, index: int) -> IndexedSequenceNode[T]:
+		if not 0 <= index < len(self):
+			raise IndexError('Index {} out of range (size: {}).'.format(index, len(self)))
+		node = self._root
+		while True:
+			left_size = self._size(node._left)
+			if index < left_size:
+				node = node._left
+			elif index == left_size:
+				return node
+			else:
+				index = index - left_size - 1
+				node = node._right
+
+	def next_node(self, node: IndexedSequenceNode[T]) -> Optional[IndexedSequenceNode[T]]:
+		if node._right is not None:
+			node = node._right
+			while node._left is not None:
+				node = node._left
+			return node
+		while node._parent is not None and node is node._parent._right:
+			node = node._parent
+		return node._parent
+
+	def previous_node(self, node: IndexedSequenceNode[T]) -> Optional[IndexedSequenceNode[T]]:
+		if node._left is not None:
+			node = node._left
+			while node._right is not None:
+				node = node._right
+			return node
+		while node._parent is not None and node is node._parent._left:
+			node = node._parent
+		return node._parent
+
+	def _insert_node(self, index: int, node: IndexedSequenceNode[T]) -> None:
+		node._left = node._right = node._parent = None
+		node._size = 1
+		left, right = self._split(self._root, max(0, min(index, len(self))))
+		self._root = self._merge(self._merge(left, node), right)
+
+	@staticmethod
+	def _size(node: Optional[IndexedSequenceNode[T]]) -> int:
+		return node._size if node is not None else 0
+
+	def _update(self, node: IndexedSequenceNode[T]) -> None:
+		node._size = self._size(node._left) + self._size(node._right) + 1
+		if node._left is not None:
+			node._left._parent = node
+		if node._right is not None:
+			node._right._parent = node
+
+	def _split(self, node: Optional[IndexedSequenceNode[T]], count: int) \
+			-> Tuple[Optional[IndexedSequenceNode[T]], Optional[IndexedSequenceNode[T]]]:
+		# splits the subtree of node into one tree with the first count values and one tree with the remaining values
+		if node is None:
+			return None, None
+		node._parent = None
+		if self._size(node._left) < count:
+			left, right = self._split(node._right, count - self._size(node._left) - 1)
+			node._right = left
+			self._update(node)
+			return node, right
+		left, right = self._split(node._left, count)
+		node._left = right
+		self._update(node)
+		return left, node
+
+	def _merge(self, left: Optional[IndexedSequenceNode[T]], right: Optional[IndexedSequenceNode[T]]) \
+			-> Optional[IndexedSequenceNode[T]]:
+		# all values of left precede all values of right
+		if left is None:
+			return right
+		if right is None:
+			return left
+		if left._priority > right._priority:
+			left._right = self._merge(left._right, right)
+			self._update(left)
+			left._parent = None
+			return left
+		right._left = self._merge(left, right._left)
+		self._update(right)
+		right._parent = None
+		return right
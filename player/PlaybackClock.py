@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import time
+from threading import Lock
+
+from . import *
+
+# a new anchor is emitted if the actual position deviates more than this from the position derived from the last anchor
+DRIFT_THRESHOLD_IN_MILLIS = 500
+
+logger = logging.getLogger(PlayerLoggerName.PLAYBACK_CLOCK.value)
+
+
+# Clients derive the player time from the last anchor (position at a wall-clock timestamp and playback rate).
+# Anchors are emitted when the playback changes (play, pause, seek, track change), when the actual position drifts
+# away from the derived position (e.g. due to buffering) and as beacon every beacon_interval_in_seconds.
+class PlaybackClock:
+
+	def __init__(self, beacon_interval_in_seconds: int):
+		self._beacon_interval_in_millis = beacon_interval_in_seconds * 1000
+		self._lock = Lock()
+		self._position = 0
+		self._rate = 0.0
+		self._timestamp = self._now()
+
+	def set_anchor(self, position: int, playing: bool) -> None:
+		with self._lock:
+			self._set_anchor(position, 1.0 if playing else 0.0)
+
+	def update_position(self, position: int) -> None:
+		with self._lock:
+			now = self._now()
+			drift = abs(position - self._get_position(now))
+			if drift > DRIFT_THRESHOLD_IN_MILLIS or now - self._timestamp >= self._beacon_interval_in_millis:
+				logger.debug('Correcting playback clock (drift: %d ms)', drift)
+				self._set_anchor(position, self._rate)
+
+	def get_position(self) -> int:
+		with self._lock:
+			return self._get_position(self._now())
+
+	def _get_position(self, now: int) -> int:
+		return int(self._position + self._rate * (now - self._timestamp))
+
+	def _set_anchor(self, position: int, rate: float) -> None:
+		self._position = max(0, position)
+		self._rate = rate
+		self._timestamp = self._now()
+		save_and_emit(DbKey.PLAYBACK_CLOCK, SendEvent.PLAYBACK_CLOCK,
+					  {General.PLAYBACK_CLOCK_POSITION: self._position,
+					   General.PLAYBACK_CLOCK_RATE: self._rate,
+					   General.PLAYBACK_CLOCK_TIMESTAMP: self._timestamp})
+
+	@staticmethod
+	def _now() -> int:
+		return int(time.time() * 1000)
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
 import time
+from concurrent.futures import Future
+from threading import Lock, RLock
+from typing import TYPE_CHECKING
 
 from . import *
-from vlc import MediaPlayer, Instance, EventType
+
+if TYPE_CHECKING:
+	from vlc import MediaPlayer, Instance
 
 logger = logging.getLogger(PlayerLoggerName.PLAYER.value)
 
@@ -20,18 +25,37 @@ class PlayerObserver(ABC):
 	def player_status_changed(self, previous_status: PlayerStatus, new_status: PlayerStatus, current_track: Track) -> None:
 		pass
 
+class NextTrackProvider(ABC):
+
+	@abstractmethod
+	def get_next_track(self) -> Track: raise NotImplementedError
+
 NETWORK_CACHING_DURATION_IN_SECONDS = 2
 
 class Player:
 
-	def __init__(self, args: Namespace, stream_consumer: StreamConsumer):
+	def __init__(self, args: Namespace, stream_consumer: StreamConsumer, resolution_executor: WorkerLaneExecutor):
 		self._observers: Set[PlayerObserver] = set()
 		self._terminal_observers: Set[PlayerObserver] = set()
 		self._stream_consumer = stream_consumer
+		self._next_track_provider: NextTrackProvider = None
+		# commands are handled concurrently, the lock serializes the state changes of the VLC player
+		self._lock = RLock()
+		# The media of the next track is prepared (i.e. the stream is resolved and the VLC media is created)
+		# when the playing track is about to end, such that the next track can be started without delay.
+		self._preparation_lead_time_in_millis = args.next_track_preparation_lead_time * 1000
+		self._preparation_executor = resolution_executor
+		self._preparation_lock = Lock()
+		self._preparation_started = False
+		self._prepared_track: Track = None
+		self._prepared_media: Future = None
+		self._track_end_timestamp: float = None
+		self._playback_clock = PlaybackClock(args.playback_clock_beacon_interval)
 		vlc_args = ["--network-caching=" + str(NETWORK_CACHING_DURATION_IN_SECONDS * 1000)]
 		if args.verbose > 0:
 			vlc_args.append('-' + 'v' * args.verbose)
 		logger.debug('Init new VLC player with args %s ...', str(vlc_args))
+		from vlc import Instance
 		self._vlc_instance: Instance = Instance(vlc_args)
 		self._vlc_player: MediaPlayer = self._vlc_instance.media_player_new()
 		logger.info('VLC player created. Player: %s', self._vlc_player)
@@ -46,6 +70,9 @@ class Player:
 	def get_null_track(self) -> Track:
 		return self._null_track
 
+	def set_next_track_provider(self, next_track_provider: NextTrackProvider) -> None:
+		self._next_track_provider = next_track_provider
+
 	def add_observer(self, observer: PlayerObserver) -> None:
 		self._observers.add(observer)
 
@@ -59,39 +86,52 @@ class Player:
 			self._terminal_observers.remove(observer)
 
 	def play(self, track: Track) -> None:
-		logger.debug('Next playing: %s', self._track)
-		self._set_track(track)
-		self._init_stream()
-		self._play()
-		logger.info('Started playing: %s', self._track)
+		logger.debug('Next playing: %s', track)
+		# the stream is resolved before the player is locked, such that e.g. play / pause of the current track
+		# is not blocked by the resolution of the next track
+		vlc_media = self._take_prepared_media(track)
+		if not vlc_media:
+			with timed(Metric.TRACK_START_PHASE, phase='create_vlc_media'), span('create vlc media'):
+				vlc_media = track.create_vlc_media(self._vlc_instance)
+		with self._lock:
+			self._set_track(track)
+			self._init_stream(vlc_media)
+			self._play()
+			logger.info('Started playing: %s', self._track)
+			self._record_handoff_latency()
 
 	def toggle_play_pause(self) -> None:
-		if self._player_state is PlayerStatus.STOPPED:
-			raise ValueError('Toggling of play / pause is not allowed if player is stopped.')
-		if self._player_state is PlayerStatus.PLAYING:
-			self._pause()
-			logger.info('Paused playing: %s', self._track)
-			return
-		if self._player_state is PlayerStatus.PAUSED:
-			self._play()
-			logger.info('Continue playing: %s', self._track)
-			return
+		with self._lock:
+			if self._player_state is PlayerStatus.STOPPED:
+				raise ValueError('Toggling of play / pause is not allowed if player is stopped.')
+			if self._player_state is PlayerStatus.PLAYING:
+				self._pause()
+				logger.info('Paused playing: %s', self._track)
+				return
+			if self._player_state is PlayerStatus.PAUSED:
+				self._play()
+				logger.info('Continue playing: %s', self._track)
+				return
 
 	def stop(self) -> None:
-		self._set_track(self._null_track)
-		self._vlc_player.stop()
-		self._update_player_state(PlayerStatus.STOPPED)
+		with self._lock:
+			self._track_end_timestamp = None
+			self._set_track(self._null_track)
+			self._vlc_player.stop()
+			self._update_player_state(PlayerStatus.STOPPED)
 
 	def seek_to(self, player_time: int) -> int:
-		limited_player_time = player_time
-		if player_time < 0:
-			limited_player_time = 0
-		if self._track.get_duration() < player_time:
-			limited_player_time = self._track.get_duration()
-		logger.info('Set player time to: %d / %d', player_time, self._track.get_duration())
-		self._vlc_player.set_time(limited_player_time)
-		self._init_stream_consumer()
-		return self._vlc_player.get_time()
+		with self._lock:
+			limited_player_time = player_time
+			if player_time < 0:
+				limited_player_time = 0
+			if self._track.get_duration() < player_time:
+				limited_player_time = self._track.get_duration()
+			logger.info('Set player time to: %d / %d', player_time, self._track.get_duration())
+			self._vlc_player.set_time(limited_player_time)
+			self._init_stream_consumer()
+			self._playback_clock.set_anchor(limited_player_time, self._player_state is PlayerStatus.PLAYING)
+			return self._vlc_player.get_time()
 
 	def _set_track(self, track: Track) -> None:
 		self._track = track
@@ -111,36 +151,107 @@ class Player:
 		logger.debug('vlc_player.pause() result code: %s', r)
 		self._update_player_state(PlayerStatus.PAUSED)
 
-	def _init_stream(self) -> None:
-		vlc_media = self._track.create_vlc_media(self._vlc_instance)
+	def _init_stream(self, vlc_media: Any) -> None:
+		with self._preparation_lock:
+			self._preparation_started = False
 		mrl = vlc_media.get_mrl()
 		logger.debug('VLC media %s, VLC mrl: %s', vlc_media, mrl)
 		r = self._vlc_player.stop()
 		logger.debug('VLC player stopped. vlc_player.stop() result code: %s', r)
-		r = self._vlc_player.set_media(vlc_media)
+		with timed(Metric.TRACK_START_PHASE, phase='set_media'), span('vlc set media'):
+			r = self._vlc_player.set_media(vlc_media)
 		logger.debug('VLC player media set. vlc_player.set_media(...) result code: %s', r)
 
 	def _init_track_end_callback(self) -> None:
+		from vlc import EventType
 		event_manager = self._vlc_player.event_manager()
 		event_manager.event_attach(EventType.MediaPlayerEndReached, self._get_track_end_callback())
 
 	def _init_player_time_callback(self) -> None:
+		from vlc import EventType
 		event_manager = self._vlc_player.event_manager()
 		def callback(event):
-			emit(SendEvent.PLAYER_TIME, event.u.new_time)
+			self._playback_clock.update_position(event.u.new_time)
+			self._prepare_next_track_if_ending(event.u.new_time)
 		event_manager.event_attach(EventType.MediaPlayerTimeChanged, callback)
 
+	def _prepare_next_track_if_ending(self, player_time: int) -> None:
+		if self._track.get_duration() - player_time > self._preparation_lead_time_in_millis or not self._next_track_provider:
+			return
+		with self._preparation_lock:
+			if self._preparation_started:
+				return
+			self._preparation_started = True
+		next_track = self._next_track_provider.get_next_track()
+		if next_track:
+			# never block the VLC event thread, preparation is retried on the next time update if the lane is saturated
+			prepared_media = self._preparation_executor.try_submit(next_track.create_vlc_media, self._vlc_instance)
+			with self._preparation_lock:
+				if not prepared_media:
+					self._preparation_started = False
+					return
+				logger.debug('Preparing next track: %s', next_track)
+				self._discard_prepared_media()
+				self._prepared_track = next_track
+				self._prepared_media = prepared_media
+
+	def _take_prepared_media(self, track: Track) -> Any:
+		with self._preparation_lock:
+			if self._prepared_track is not track:
+				self._discard_prepared_media()
+				return None
+			prepared_media = self._prepared_media
+			self._prepared_track = None
+			self._prepared_media = None
+		try:
+			vlc_media = prepared_media.result()
+			logger.debug('Using prepared VLC media for %s', track)
+			return vlc_media
+		except Exception:
+			logger.warning('Preparation of %s failed.', track, exc_info=True)
+			return None
+
+	def _discard_prepared_media(self) -> None:
+		if self._prepared_media:
+			def release(future: Future) -> None:
+				if not future.cancelled() and not future.exception():
+					future.result().release()
+			self._prepared_media.cancel()
+			self._prepared_media.add_done_callback(release)
+		self._prepared_track = None
+		self._prepared_media = None
+
+	def _record_handoff_latency(self) -> None:
+		if self._track_end_timestamp is None:
+			return
+		latency = time.time() - self._track_end_timestamp
+		self._track_end_timestamp = None
+		observe(Metric.TRACK_HANDOFF, latency)
+		logger.info('Track handoff took %.3f seconds (including %d seconds of network caching).',
+					latency, NETWORK_CACHING_DURATION_IN_SECONDS)
+
 	def _get_track_end_callback(self) -> Callable[[Any], None]:
 		def callback(event):
+			ended_track = self._track
+			if self._next_track_provider and self._next_track_provider.get_next_track():
+				# handoff latency is only recorded if there is a next track
+				self._track_end_timestamp = time.time()
 			time.sleep(NETWORK_CACHING_DURATION_IN_SECONDS)
-			self._set_track(self._null_track)
-			self._update_player_state(PlayerStatus.STOPPED)
+			with self._lock:
+				# a track started (or the player stopped) in the meantime, skipping to the next track would skip it
+				if self._track is not ended_track:
+					logger.debug('Track changed after the end of %s, next track is not played.', ended_track)
+					return
+				self._set_track(self._null_track)
+				self._update_player_state(PlayerStatus.STOPPED)
 			publish_on_player_command_channel(ReceiveEvent.NEXT_TRACK, {})
 		return callback
 
 	def _update_player_state(self, player_state: PlayerStatus) -> None:
 		self._update_observers(player_state)
 		self._player_state = player_state
+		player_time = self._vlc_player.get_time() if player_state is not PlayerStatus.STOPPED else 0
+		self._playback_clock.set_anchor(player_time, player_state is PlayerStatus.PLAYING)
 		player_state_dict = {'player_state': player_state.value}
 		save_and_emit(DbKey.PLAYER_STATE, SendEvent.PLAYER_STATE, player_state_dict)
 
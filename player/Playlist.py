@@ -1,33 +1,89 @@
 from __future__ import annotations
 
 import time
-from concurrent.futures import FIRST_EXCEPTION, CancelledError, TimeoutError, wait
-from concurrent.futures.thread import ThreadPoolExecutor
+from threading import RLock
 from uuid import UUID
 
 from . import *
 
-MIN_NUMBER_OF_PLAYLIST_PROPERTY_DICT_RESOLVER_THREADS = 10
-MAX_NUMBER_OF_PLAYLIST_PROPERTY_DICT_RESOLVER_THREADS = 1000
-MAX_PLAYLIST_PROPERTY_DICT_RESOLUTION_WAIT_TIME_IN_SECS = 20
-PLAYLIST_PROPERTY_DICT_RESOLVER_THREAD_PREFIX = 'PlaylistPropertyDictResolverThread'
+VERSION = General.PLAYLIST_VERSION
+ENTRIES = General.PLAYLIST_ENTRIES
+OPERATIONS = 'operations'
+OPERATION = 'op'
+POSITION = 'position'
+ENTRY = 'entry'
 
-class Playlist(PlayerObserver):
 
-	def __init__(self, playlist_entry_factory: PlaylistEntryFactory):
+@unique
+class PlaylistOperation(Enum):
+	INSERT = 'insert'
+	REMOVE = 'remove'
+	MOVE = 'move'
+	STATUS = 'status'
+	UPDATE = 'update'
+
+
+class Playlist(PlayerObserver, NextTrackProvider, UpcomingTracksProvider, TrackRefreshObserver):
+
+	def __init__(self, playlist_entry_factory: PlaylistEntryFactory, track_refresh_scheduler: TrackRefreshScheduler,
+				 resolution_executor: WorkerLaneExecutor, playlist_storage: PlaylistStorage):
 		super().__init__()
 		self._playlist_entry_factory = playlist_entry_factory
-		self.playlist_entries: List[PlaylistEntry] = []
-		self._playlist_entry_property_dict_resolver_count = MIN_NUMBER_OF_PLAYLIST_PROPERTY_DICT_RESOLVER_THREADS
-		self._playlist_entry_property_dict_resolver_executor = ThreadPoolExecutor(
-			max_workers=self._playlist_entry_property_dict_resolver_count,
-			thread_name_prefix=PLAYLIST_PROPERTY_DICT_RESOLVER_THREAD_PREFIX)
+		self._playlist_storage = playlist_storage
+		self._track_refresh_scheduler = track_refresh_scheduler
+		self._resolution_executor = resolution_executor
+		# The entries are kept in an indexed sequence and are accessible by ID in O(1). Stati of the entries are
+		# derived from the position of the current entry, hence, only entries between the previous and the new
+		# current entry change their status if another entry becomes current.
+		self._entries: IndexedSequence[PlaylistEntry] = IndexedSequence()
+		self._nodes: Dict[UUID, IndexedSequenceNode[PlaylistEntry]] = {}
+		self._entries_by_track: Dict[Track, PlaylistEntry] = {}
+		self._current_entry: PlaylistEntry = None
+		self._status_changed_entries: Dict[UUID, PlaylistEntry] = {}
+		# Clients receive a snapshot of the playlist on connect and the versioned changes (operations) afterwards.
+		# The property dicts of the last emitted version are kept to compute and persist new versions without
+		# resolving the tracks of all entries again.
+		self._version = 0
+		self._property_dicts: Dict[UUID, Dict] = {}
+		# Guards the entries (the indexed sequence is not thread safe: the index of an entry is computed from the
+		# parent pointers of its node) and the emitted versions. The lock is never held while the player is called,
+		# the player notifies its observers (e.g. this playlist) while holding its own lock.
+		self._emit_lock = RLock()
+
+	def __len__(self) -> int:
+		with self._emit_lock:
+			return len(self._entries)
+
+	# iterates over a copy of the entries
+	def __iter__(self) -> Iterator[PlaylistEntry]:
+		with self._emit_lock:
+			return iter(list(self._entries))
 
 	def player_status_changed(self, previous_status: PlayerStatus, new_status: PlayerStatus, current_track: Track) -> None:
-		self._save_and_emit_playlist()
+		if self._current_entry:
+			self._mark_status_changed(self._current_entry)
+		self._save_and_emit_playlist([])
 
-	def read_playlist_from_db(self) -> None:
-		self.playlist_entries = self._playlist_entry_factory.playlist_entries_from_props_list(read_list_from_db(DbKey.PLAYLIST))
+	# With fast_start, the entries are created from the stored property dicts without network access and the player
+	# is not initialized with the current track. The tracks are resolved in the background, the current track first,
+	# followed by the upcoming tracks in playlist order.
+	def read_playlist_from_db(self, fast_start: bool = False) -> None:
+		version = self._playlist_storage.read_version()
+		if version is None and self._playlist_storage.has_legacy_playlist():
+			# otherwise the legacy playlist would be abandoned by the first version written
+			number_of_entries = self._playlist_storage.migrate_legacy_playlist()
+			logger.info('Migrated the stored playlist with %s entries to per entry storage.', number_of_entries)
+			version = self._playlist_storage.read_version()
+		self._version = version or 0
+		stored_entries = self._playlist_storage.read_entries()
+		if fast_start:
+			self._set_entries(self._playlist_entry_factory.playlist_entries_from_stored_props_list(stored_entries))
+			self._save_and_emit_snapshot()
+			self._schedule_resolution_of_upcoming_tracks()
+			return
+		# the entries are streamed from redis while the first entries are already resolved
+		self._set_entries(self._playlist_entry_factory.playlist_entries_from_props_list(stored_entries))
+		self._save_and_emit_snapshot()
 		def init_player(entry: PlaylistEntry) -> None:
 			# after startup we want the current playlist entry to be loaded but paused
 			# play() ensures the track is loaded and playing
@@ -37,12 +93,84 @@ class Playlist(PlayerObserver):
 			# set to paused
 			entry.toggle_play_pause()
 		self.on_current(init_player)
-		self._save_and_emit_playlist()
 
+	def _schedule_resolution_of_upcoming_tracks(self) -> None:
+		with self._emit_lock:
+			if self._current_entry:
+				node = self._nodes[self._current_entry.playlist_entry_id]
+			else:
+				node = self._entries.node_at(0) if len(self._entries) > 0 else None
+			while node:
+				# urgent tracks are resolved in the order they are scheduled
+				self._track_refresh_scheduler.schedule(node.value.track, urgent=True)
+				node = self._entries.next_node(node)
+
+	# the callback is called without holding the lock
 	def on_current(self, callback: Callable[[PlaylistEntry], None]) -> None:
-		if self.playlist_entries:
-			current = next((entry for entry in self.playlist_entries if entry.is_current()), self.playlist_entries[0])
-			callback(current)
+		with self._emit_lock:
+			current_entry = self._current_entry
+			if not current_entry and len(self._entries) > 0:
+				current_entry = self._entries.node_at(0).value
+		if current_entry:
+			callback(current_entry)
+
+	def get_entry_status(self, entry: PlaylistEntry) -> PlaylistEntryStatus:
+		with self._emit_lock:
+			if entry is self._current_entry:
+				return PlaylistEntryStatus.CURRENT
+			if not self._current_entry or \
+					self._index_of(entry) > self._index_of(self._current_entry):
+				return PlaylistEntryStatus.WAITING
+			return PlaylistEntryStatus.COMPLETED
+
+	def get_previous_entry(self, entry: PlaylistEntry) -> PlaylistEntry:
+		with self._emit_lock:
+			previous_node = self._entries.previous_node(self._nodes[entry.playlist_entry_id])
+			return previous_node.value if previous_node else None
+
+	def get_next_entry(self, entry: PlaylistEntry) -> PlaylistEntry:
+		with self._emit_lock:
+			next_node = self._entries.next_node(self._nodes[entry.playlist_entry_id])
+			return next_node.value if next_node else None
+
+	def track_availability_changed(self, track: Track) -> None:
+		with self._emit_lock:
+			entry = self._entries_by_track.get(track)
+			if not entry:
+				return
+			property_dict = self._property_dicts.get(entry.playlist_entry_id)
+			if not property_dict:
+				return
+			property_dict[TRACK][AVAILABLE] = track.is_available()
+			self._save_and_emit_playlist([{OPERATION: PlaylistOperation.UPDATE.value, ENTRY: property_dict}])
+
+	def get_next_track(self) -> Track:
+		with self._emit_lock:
+			if not self._current_entry:
+				return None
+			next_entry = self.get_next_entry(self._current_entry)
+			return next_entry.track if next_entry else None
+
+	def get_upcoming_tracks(self, count: int) -> List[Track]:
+		with self._emit_lock:
+			tracks = []
+			node = self._nodes[self._current_entry.playlist_entry_id] if self._current_entry else None
+			while node and len(tracks) < count:
+				node = self._entries.next_node(node)
+				if node:
+					tracks.append(node.value.track)
+			return tracks
+
+	def set_current_entry(self, entry: PlaylistEntry) -> None:
+		with self._emit_lock:
+			previous_index = self._index_of(self._current_entry) if self._current_entry else 0
+			self._mark_stati_changed_between(previous_index, self._index_of(entry))
+			self._current_entry = entry
+			# ensure that the streams of the current and the next track are resolved in the background
+			self._track_refresh_scheduler.schedule(entry.track, urgent=True)
+			next_entry = self.get_next_entry(entry)
+			if next_entry:
+				self._track_refresh_scheduler.schedule(next_entry.track, urgent=True)
 
 	def play_previous(self) -> None:
 		def play_previous(entry: PlaylistEntry) -> None:
@@ -55,7 +183,7 @@ class Playlist(PlayerObserver):
 		self.on_current(play_next)
 
 	def play_track_of_playlist(self, playlist_entry_id: str) -> None:
-		def callback(position: int, entry: PlaylistEntry) -> None:
+		def callback(entry: PlaylistEntry) -> None:
 			entry.toggle_play_pause()
 		self._run_if_present(playlist_entry_id, callback)
 
@@ -63,96 +191,225 @@ class Playlist(PlayerObserver):
 		def stop_current(entry: PlaylistEntry) -> None:
 			entry.stop()
 		self.on_current(stop_current)
-		self.playlist_entries.clear()
-		self._save_and_emit_playlist()
+		self._set_entries([])
+		self._save_and_emit_snapshot()
 
 	def add_track_at_end(self, url: str) -> None:
-		self.add_track(url, len(self.playlist_entries))
+		self.add_track(url, len(self))
 
 	def add_track(self, url: str, position: int) -> None:
 		new_playlist_entry = self._playlist_entry_factory.create_playlist_entry_from_youtube_url(url)
-		self.playlist_entries.insert(min(position, len(self.playlist_entries)), new_playlist_entry)
-		self._save_and_emit_playlist()
+		# resolve the property dict before the entry is added (without holding the lock), such that unresolvable
+		# entries never enter the playlist
+		property_dict = new_playlist_entry.get_property_dict()
+		with self._emit_lock:
+			position = min(position, len(self._entries))
+			self._property_dicts[new_playlist_entry.playlist_entry_id] = property_dict
+			self._insert_entry(position, new_playlist_entry)
+			self._mark_status_changed(new_playlist_entry)
+			self._save_and_emit_playlist([{OPERATION: PlaylistOperation.INSERT.value, POSITION: position,
+										   ENTRY: property_dict}])
 
 	def delete_track(self, playlist_entry_id: str) -> None:
 		# TODO think about behaviour if track to delete is same as current in player.
 		# TODO 1) how should behaviour be if paused? how if playing? 2) how if started from playlist? how if started from search results?
-		def callback (position: int, entry: PlaylistEntry) -> None:
+		def callback (entry: PlaylistEntry) -> None:
 			def next_if_current(current: PlaylistEntry) -> None:
 				if entry == current:
 					current.stop()
 					current.play_next()
 			self.on_current(next_if_current)
-			self.playlist_entries.pop(position)
-			self._save_and_emit_playlist()
+			with self._emit_lock:
+				if entry.playlist_entry_id not in self._nodes:
+					return
+				self._remove_entry(entry)
+				self._save_and_emit_playlist([{OPERATION: PlaylistOperation.REMOVE.value, ID: playlist_entry_id}])
 		self._run_if_present(playlist_entry_id, callback)
 
 	def change_track_position(self, playlist_entry_id: str, target_position: int) -> None:
-		def callback (position: int, entry: PlaylistEntry) -> None:
-			if position != target_position:
-				self.playlist_entries.pop(position)
-				self.playlist_entries.insert(min(target_position, len(self.playlist_entries)), entry)
-				self._save_and_emit_playlist()
+		def callback (entry: PlaylistEntry) -> None:
+			with self._emit_lock:
+				node = self._nodes.get(entry.playlist_entry_id)
+				if not node:
+					return
+				position = self._entries.index_of(node)
+				new_position = min(target_position, len(self._entries) - 1)
+				if position != new_position:
+					if entry is self._current_entry:
+						self._mark_stati_changed_between(position, new_position)
+					else:
+						self._mark_status_changed(entry)
+					self._entries.move(node, new_position)
+					self._save_and_emit_playlist([{OPERATION: PlaylistOperation.MOVE.value, ID: playlist_entry_id,
+												   POSITION: new_position}])
 		self._run_if_present(playlist_entry_id, callback)
 
-	def _run_if_present(self, play_list_entry_id: str, callback: Callable[[int, PlaylistEntry], None]) -> None:
-		play_list_entry_uuid = UUID(play_list_entry_id)
-		position, entry = next(((position, entry) for position, entry in enumerate(self.playlist_entries)
-								if entry.playlist_entry_id == play_list_entry_uuid), (None, None))
-		if entry: # test *only* for entry, since if position == 0 bool(position) evaluates to False
-			callback(position, entry)
-
-	def _update_entry_links(self) -> None:
-		previous_entry: PlaylistEntry = None
-		for index, entry in enumerate(self.playlist_entries):
-			next_entry: PlaylistEntry = None
-			index_of_next = index + 1
-			if index_of_next < len(self.playlist_entries):
-				next_entry = self.playlist_entries[index_of_next]
-			entry.set_links(previous_entry, next_entry)
-			previous_entry = entry
-
-	def _update_stati(self) -> None:
-		def update_stati(entry: PlaylistEntry) -> None:
-			entry.update_playlist_entry_stati()
-		self.on_current(update_stati)
-
-	def _adjust_playlist_entry_property_dict_resolver_executor(self):
-		playlist_size = len(self.playlist_entries)
-		if self._playlist_entry_property_dict_resolver_count != playlist_size and \
-			self._playlist_entry_property_dict_resolver_count < MAX_NUMBER_OF_PLAYLIST_PROPERTY_DICT_RESOLVER_THREADS:
-			self._playlist_entry_property_dict_resolver_count = max(MIN_NUMBER_OF_PLAYLIST_PROPERTY_DICT_RESOLVER_THREADS,
-											min(MAX_NUMBER_OF_PLAYLIST_PROPERTY_DICT_RESOLVER_THREADS, playlist_size))
-			self._playlist_entry_property_dict_resolver_executor = ThreadPoolExecutor(
-				max_workers=self._playlist_entry_property_dict_resolver_count ,
-				thread_name_prefix=PLAYLIST_PROPERTY_DICT_RESOLVER_THREAD_PREFIX)
-
-	def _save_and_emit_playlist(self) -> None:
-		self._update_entry_links()
-		self._update_stati()
-		self._adjust_playlist_entry_property_dict_resolver_executor()
-		entries_with_futures = [(playlist_entry, self._playlist_entry_property_dict_resolver_executor.submit(playlist_entry.get_property_dict))
-								for playlist_entry in self.playlist_entries]
-		# don't wait longer than until first exception occurs. In case of an exception _save_and_emit_playlist(...) will be executed again anyways.
-		wait([entry_with_future[1] for entry_with_future in entries_with_futures], timeout=MAX_PLAYLIST_PROPERTY_DICT_RESOLUTION_WAIT_TIME_IN_SECS,
-			 return_when=FIRST_EXCEPTION)
-		property_dicts = []
-		unresolved_entry = None
-		for entry_with_future in entries_with_futures:
-			try:
-				property_dicts.append(entry_with_future[1].result(timeout=0)) # we waited already
-			except (CancelledError, TimeoutError) as err:
-				logger.warning('Resolving playlist entry failed due to timeout or cancellation.', exc_info=True)
-			except Exception as err:
-				logger.exception('Exception on attempt to resolve playlist entry. Playlist entry \'%s\' will be deleted.',
-								 exc_info=True)
-				unresolved_entry = entry_with_future[0]
-				break
-		if unresolved_entry:
-			# this initiates a new update/save/emit cycle
-			self.delete_track(str(unresolved_entry.playlist_entry_id))
-		else:
-			# we need to ensure that save_and_emit(...) is only called if no exception occurred.
-			# instead of testing truthy of unresolved_entry we could also add a flag and call delete_track(...)
-			# before breaking the loop.
-			save_and_emit(DbKey.PLAYLIST, SendEvent.PLAYLIST_CHANGED, property_dicts)
+	# the callback is called without holding the lock
+	def _run_if_present(self, play_list_entry_id: str, callback: Callable[[PlaylistEntry], None]) -> None:
+		with self._emit_lock:
+			node = self._nodes.get(UUID(play_list_entry_id))
+		if node:
+			callback(node.value)
+
+	def _index_of(self, entry: PlaylistEntry) -> int:
+		with self._emit_lock:
+			return self._entries.index_of(self._nodes[entry.playlist_entry_id])
+
+	def _set_entries(self, entries: List[PlaylistEntry]) -> None:
+		with self._emit_lock:
+			for entry in self._entries:
+				entry.set_playlist(None)
+				self._track_refresh_scheduler.unschedule(entry.track)
+			self._entries.clear()
+			self._nodes.clear()
+			self._entries_by_track.clear()
+			self._current_entry = None
+			for entry in entries:
+				current = entry.is_current()
+				self._insert_entry(len(self._entries), entry)
+				if current:
+					self._current_entry = entry
+
+	def _insert_entry(self, position: int, entry: PlaylistEntry) -> None:
+		with self._emit_lock:
+			self._nodes[entry.playlist_entry_id] = self._entries.insert(position, entry)
+			self._entries_by_track[entry.track] = entry
+			entry.set_playlist(self)
+			self._track_refresh_scheduler.schedule(entry.track)
+
+	def _remove_entry(self, entry: PlaylistEntry) -> None:
+		with self._emit_lock:
+			if entry is self._current_entry:
+				# the removed entry is still current if it was the last one of the playlist
+				self._current_entry = None
+				self._mark_stati_changed_between(0, len(self._entries) - 1)
+			entry.set_playlist(None)
+			self._entries.remove(self._nodes.pop(entry.playlist_entry_id))
+			self._entries_by_track.pop(entry.track, None)
+			self._track_refresh_scheduler.unschedule(entry.track)
+			self._property_dicts.pop(entry.playlist_entry_id, None)
+
+	def _mark_status_changed(self, entry: PlaylistEntry) -> None:
+		with self._emit_lock:
+			self._status_changed_entries[entry.playlist_entry_id] = entry
+
+	def _mark_stati_changed_between(self, first_position: int, second_position: int) -> None:
+		start = min(first_position, second_position)
+		count = abs(first_position - second_position) + 1
+		with self._emit_lock:
+			for node in self._entries.nodes(start):
+				if count == 0:
+					break
+				self._status_changed_entries[node.value.playlist_entry_id] = node.value
+				count = count - 1
+
+	def _create_status_operations(self) -> List[Dict]:
+		operations = []
+		for entry in self._status_changed_entries.values():
+			property_dict = self._property_dicts.get(entry.playlist_entry_id)
+			if not property_dict or entry.playlist_entry_id not in self._nodes:
+				continue
+			status_dict = entry.get_status_dict()
+			if property_dict[STATUS] != status_dict[STATUS] or property_dict[TRACK][TRACK_STATUS] != status_dict[TRACK_STATUS]:
+				property_dict[STATUS] = status_dict[STATUS]
+				property_dict[TRACK][TRACK_STATUS] = status_dict[TRACK_STATUS]
+				status_dict[OPERATION] = PlaylistOperation.STATUS.value
+				operations.append(status_dict)
+		self._status_changed_entries.clear()
+		return operations
+
+	def _create_snapshot(self) -> Dict:
+		return {VERSION: self._version,
+				ENTRIES: [self._property_dicts[entry.playlist_entry_id] for entry in self._entries]}
+
+	def _save_and_emit_playlist(self, operations: List[Dict]) -> None:
+		with self._emit_lock:
+			operations.extend(self._create_status_operations())
+			if not operations:
+				return
+			self._version = self._version + 1
+			# each version is written and emitted before the lock is released
+			with isolated_write_batch():
+				self._save_playlist(operations)
+				emit(SendEvent.PLAYLIST_DELTA, {VERSION: self._version, OPERATIONS: operations})
+
+	# only the entries affected by the operations are written
+	def _save_playlist(self, operations: List[Dict]) -> None:
+		with write_batch() as pipeline:
+			for operation in operations:
+				operation_type = PlaylistOperation(operation[OPERATION])
+				entry_id = operation[ENTRY][ID] if ENTRY in operation else operation[ID]
+				if operation_type is PlaylistOperation.REMOVE:
+					self._playlist_storage.remove_entry(pipeline, entry_id)
+					continue
+				node = self._nodes.get(UUID(entry_id))
+				property_dict = self._property_dicts.get(UUID(entry_id))
+				if not node or not property_dict:
+					# removed in the meantime, the removal is saved with the next version
+					continue
+				if operation_type is PlaylistOperation.INSERT:
+					self._playlist_storage.insert_entry(pipeline, entry_id, property_dict, self._previous_entry_id(node))
+				elif operation_type is PlaylistOperation.MOVE:
+					self._playlist_storage.move_entry(pipeline, entry_id, self._previous_entry_id(node))
+				else:
+					self._playlist_storage.update_entry(pipeline, entry_id, property_dict)
+			self._playlist_storage.set_version(pipeline, self._version)
+			invalidate_state(DbKey.PLAYLIST)
+
+	def _save_snapshot(self) -> None:
+		with write_batch() as pipeline:
+			self._playlist_storage.replace(pipeline, self._version,
+										   [(str(entry.playlist_entry_id), self._property_dicts[entry.playlist_entry_id])
+											for entry in self._entries])
+			invalidate_state(DbKey.PLAYLIST)
+
+	def _previous_entry_id(self, node: IndexedSequenceNode[PlaylistEntry]) -> Optional[str]:
+		previous_node = self._entries.previous_node(node)
+		return str(previous_node.value.playlist_entry_id) if previous_node else None
+
+	# Entries whose tracks are not resolved yet (or fail to resolve) are emitted as unavailable and resolved in the
+	# background, the snapshot never waits for the network. Resolved entries are emitted as updates.
+	def _save_and_emit_snapshot(self) -> None:
+		with self._emit_lock:
+			unresolved_entries = []
+			self._property_dicts = {}
+			for entry in self._entries:
+				property_dict = self._create_property_dict_without_resolution(entry)
+				if not property_dict:
+					property_dict = entry.get_placeholder_property_dict()
+					unresolved_entries.append(entry)
+				self._property_dicts[entry.playlist_entry_id] = property_dict
+			self._status_changed_entries.clear()
+			self._version = self._version + 1
+			with isolated_write_batch():
+				self._save_snapshot()
+				emit(SendEvent.PLAYLIST_CHANGED, self._create_snapshot())
+		for entry in unresolved_entries:
+			self._resolution_executor.submit(self._resolve_property_dict, entry)
+
+	def _create_property_dict_without_resolution(self, entry: PlaylistEntry) -> Optional[Dict]:
+		if not entry.track.has_metadata():
+			return None
+		try:
+			return entry.get_property_dict()
+		except Exception:
+			logger.warning('Creating the property dict of playlist entry \'%s\' failed. The entry is marked as '
+						   'unavailable.', entry.playlist_entry_id, exc_info=True)
+			return None
+
+	def _resolve_property_dict(self, entry: PlaylistEntry) -> None:
+		try:
+			property_dict = entry.get_property_dict()
+		except Exception:
+			logger.warning('Resolving playlist entry \'%s\' failed. The entry stays unavailable.',
+						   entry.playlist_entry_id, exc_info=True)
+			return
+		with self._emit_lock:
+			if entry.playlist_entry_id not in self._property_dicts:
+				# removed in the meantime
+				return
+			# the status may have changed during the resolution
+			property_dict[STATUS] = entry.status.value
+			property_dict[TRACK][TRACK_STATUS] = entry.track.track_status.value
+			self._property_dicts[entry.playlist_entry_id] = property_dict
+			self._save_and_emit_playlist([{OPERATION: PlaylistOperation.UPDATE.value, ENTRY: property_dict}])
@@ -1,12 +1,12 @@
 from __future__ import annotations
 
 import uuid
-from concurrent.futures.thread import ThreadPoolExecutor
 from uuid import UUID
 
 from . import *
+from .Track import STATUS as TRACK_STATUS
 
-ID = 'playlist_entry_id'
+ID = General.PLAYLIST_ENTRY_ID
 TRACK = 'track'
 STATUS = 'status'
 
@@ -22,11 +22,11 @@ class PlaylistEntryStatus(Enum):
 class PlaylistEntry:
 
 	def __init__(self, track: Track, initial_status: PlaylistEntryStatus, id: UUID):
-		self._playlist_entry_status = initial_status
+		# the status of an entry in a playlist is derived from its position relative to the current entry of the playlist
+		self._initial_status = initial_status
 		self._track = track
 		self._playlist_entry_id = id
-		self._previous_entry: PlaylistEntry = None
-		self._next_entry: PlaylistEntry = None
+		self._playlist: Playlist = None
 
 	@property
 	def playlist_entry_id(self) -> UUID:
@@ -36,16 +36,26 @@ class PlaylistEntry:
 	def track(self) -> Track:
 		return self._track
 
+	@property
+	def status(self) -> PlaylistEntryStatus:
+		if self._playlist:
+			return self._playlist.get_entry_status(self)
+		return self._initial_status
+
 	@property
 	def previous_entry(self) -> PlaylistEntry:
-		return self._previous_entry
+		if self._playlist:
+			return self._playlist.get_previous_entry(self)
+		return None
 
 	@property
 	def next_entry(self) -> PlaylistEntry:
-		return self._next_entry
+		if self._playlist:
+			return self._playlist.get_next_entry(self)
+		return None
 
 	def is_current(self):
-		return self._playlist_entry_status == PlaylistEntryStatus.CURRENT
+		return self.status == PlaylistEntryStatus.CURRENT
 
 	def play(self) -> None:
 		self._set_to_current()
@@ -56,7 +66,7 @@ class PlaylistEntry:
 		self.track.toggle_play_pause()
 
 	def play_previous(self) -> None:
-		if self._previous_entry:
+		if self.previous_entry:
 			self.previous_entry.play()
 		else:
 			self.play()
@@ -70,57 +80,51 @@ class PlaylistEntry:
 	def stop(self) -> None:
 		self.track.stop()
 
+	def set_playlist(self, playlist: Playlist) -> None:
+		if self._playlist and not playlist:
+			self._initial_status = self.status
+		self._playlist = playlist
+
 	def _set_to_current(self) -> None:
-		self._playlist_entry_status = PlaylistEntryStatus.CURRENT
-		self.update_playlist_entry_stati()
-
-	def update_playlist_entry_stati(self) -> None:
-		def on_previous(entry: PlaylistEntry) -> None:
-			entry._playlist_entry_status = PlaylistEntryStatus.COMPLETED
-		self._apply_on_all_preceding_entries(on_previous)
-		def on_succeeding(entry: PlaylistEntry) -> None:
-			entry._playlist_entry_status = PlaylistEntryStatus.WAITING
-		self._apply_on_all_succeeding_entries(on_succeeding)
-
-	def _apply_on_all_preceding_entries(self, callback: Callable[[PlaylistEntry], None]) -> None:
-		previous_entry = self.previous_entry
-		while previous_entry is not None:
-			callback(previous_entry)
-			previous_entry = previous_entry.previous_entry
-
-	def _apply_on_all_succeeding_entries(self, callback: Callable[[PlaylistEntry], None]) -> None:
-		next_entry = self.next_entry
-		while next_entry is not None:
-			callback(next_entry)
-			next_entry = next_entry.next_entry
-
-	def set_links(self, previous: PlaylistEntry, next: PlaylistEntry) -> None:
-		self._previous_entry = previous
-		self._next_entry = next
+		if self._playlist:
+			self._playlist.set_current_entry(self)
+		else:
+			self._initial_status = PlaylistEntryStatus.CURRENT
 
 	def __str__(self) -> str:
 		return 'PLaylist entry for track: {} (status: {}, id: {})'\
-			.format(self.track, self._playlist_entry_status, self.playlist_entry_id)
+			.format(self.track, self.status, self.playlist_entry_id)
 
 	def get_property_dict(self) -> Dict:
 		return {ID: str(self.playlist_entry_id),
 				TRACK: self.track.get_property_dict(),
-				STATUS: self._playlist_entry_status.value}
+				STATUS: self.status.value}
+
+	# without network access, see Track.get_placeholder_property_dict
+	def get_placeholder_property_dict(self) -> Dict:
+		return {ID: str(self.playlist_entry_id),
+				TRACK: self.track.get_placeholder_property_dict(),
+				STATUS: self.status.value}
+
+	def get_status_dict(self) -> Dict:
+		return {ID: str(self.playlist_entry_id),
+				STATUS: self.status.value,
+				TRACK_STATUS: self.track.track_status.value}
 
 
 class PlaylistEntryFactory:
-	def __init__(self, track_factory: TrackFactory):
+	def __init__(self, track_factory: TrackFactory, resolution_executor: WorkerLaneExecutor):
 		self._track_factory = track_factory
+		self._resolution_executor = resolution_executor
 
 	def create_playlist_entry_from_youtube_url(self, url: str) -> PlaylistEntry:
 		return PlaylistEntry(self._track_factory.create_youtube_track(url), PlaylistEntryStatus.WAITING, uuid.uuid4())
 
-	def playlist_entries_from_props_list(self, playlist_entry_dicts: List) -> List[PlaylistEntry]:
-		logger.info("Creating playlist entries from playlist entry dict: %s", playlist_entry_dicts)
-		executor = ThreadPoolExecutor(max_workers=100, thread_name_prefix='PlaylistLoaderThread')
-		futures = [(playlist_entry_dict, executor.submit(self._load_playlist_entry_from_property_dict, playlist_entry_dict))
+	# the dicts may be streamed, entries are resolved while further dicts are read
+	def playlist_entries_from_props_list(self, playlist_entry_dicts: Iterable[Dict]) -> List[PlaylistEntry]:
+		futures = [(playlist_entry_dict, self._resolution_executor.submit(self._load_playlist_entry_from_property_dict, playlist_entry_dict))
 				   for playlist_entry_dict in playlist_entry_dicts]
-		executor.shutdown()
+		logger.info("Creating %d playlist entries from playlist entry dicts.", len(futures))
 		playlist_entries = []
 		for future in futures:
 			try:
@@ -130,6 +134,20 @@ class PlaylistEntryFactory:
 				logger.warning("Resolving the following playlist entry dict failed: %s", future[0], exc_info=True)
 		return playlist_entries
 
+	# without network access, the tracks are resolved lazily
+	def playlist_entries_from_stored_props_list(self, playlist_entry_dicts: Iterable[Dict]) -> List[PlaylistEntry]:
+		playlist_entries = []
+		for playlist_entry_dict in playlist_entry_dicts:
+			try:
+				track = self._track_factory.track_from_stored_dict(playlist_entry_dict[TRACK])
+				playlist_entries.append(PlaylistEntry(track, PlaylistEntryStatus(playlist_entry_dict[STATUS]),
+													  UUID(playlist_entry_dict[ID])))
+			except Exception:
+				logger.warning("Creating playlist entry from the following dict failed: %s", playlist_entry_dict,
+							   exc_info=True)
+		logger.info("Created %d playlist entries from stored playlist entry dicts.", len(playlist_entries))
+		return playlist_entries
+
 	def _load_playlist_entry_from_property_dict(self, playlist_entry_dict: Dict) -> PlaylistEntry:
 		logger.debug("Creating playlist entry from playlist entry dict: %s", playlist_entry_dict)
 		track_dict = playlist_entry_dict[TRACK]
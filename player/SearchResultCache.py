@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from . import *
+
+SEARCH_RESULT_KEY_PREFIX = General.APP_NAME + '_search_result:'
+
+VIDEO_IDS = 'video_ids'
+NEXT_PAGE_TOKEN = 'next_page_token'
+HAS_NEXT_PAGE = 'has_next_page'
+TRACK_DICTS = 'track_dicts'
+KEYWORD_SEARCH = 'keyword_search'
+
+logger = logging.getLogger(PlayerLoggerName.SEARCH_RESULT_CACHE.value)
+
+
+class SearchResultCacheEntry:
+
+	def __init__(self, key: str, video_ids: List[str] = None, next_page_token: str = None, has_next_page=False,
+				 track_dicts: Dict[str, PropDict] = None, keyword_search=False):
+		self.key = key
+		# results of a keyword search or of the URL of a video or playlist
+		self.keyword_search = keyword_search
+		self.video_ids: List[str] = video_ids or []
+		self.next_page_token = next_page_token
+		self.has_next_page = has_next_page
+		self.track_dicts: Dict[str, PropDict] = track_dicts or {}
+		# guards the loading of further video IDs, which can be requested by multiple search tasks at the same time
+		self.lock = Lock()
+
+	@staticmethod
+	def from_dict(key: str, entry_dict: Dict) -> SearchResultCacheEntry:
+		# entries persisted before the kind of the search was stored are read as keyword search results
+		return SearchResultCacheEntry(key, entry_dict[VIDEO_IDS], entry_dict[NEXT_PAGE_TOKEN],
+									  entry_dict[HAS_NEXT_PAGE], entry_dict[TRACK_DICTS],
+									  entry_dict.get(KEYWORD_SEARCH, True))
+
+	def to_dict(self) -> Dict:
+		return {VIDEO_IDS: list(self.video_ids),
+				NEXT_PAGE_TOKEN: self.next_page_token,
+				HAS_NEXT_PAGE: self.has_next_page,
+				TRACK_DICTS: dict(self.track_dicts),
+				KEYWORD_SEARCH: self.keyword_search}
+
+	def is_empty(self) -> bool:
+		return not self.video_ids and not self.has_next_page
+
+
+# Cache of search results (video IDs and resolved track property dicts) shared by all search tasks.
+# Entries are held in memory in least recently used order and are persisted in redis, such that they survive
+# restarts of the player. Entries expire after ttl_in_hours. Entries are persisted on the persistence lane, they are
+# only held in memory if the lane is saturated.
+class SearchResultCache:
+
+	def __init__(self, db: redis.Redis, max_size: int, ttl_in_hours: int, persistence_executor: WorkerLaneExecutor):
+		self._db = db
+		self._persistence_executor = persistence_executor
+		self._max_size = max_size
+		self._ttl_in_seconds = ttl_in_hours * 60 * 60
+		self._lock = Lock()
+		self._entries: OrderedDict[str, Tuple[SearchResultCacheEntry, float]] = OrderedDict()
+		self._hits = 0
+		self._misses = 0
+
+	@staticmethod
+	def keyword_key(search_term: str) -> str:
+		# keyword searches are case insensitive
+		return ' '.join(search_term.split()).lower()
+
+	@staticmethod
+	def url_key(search_term: str) -> str:
+		# URLs and video IDs are case sensitive
+		return search_term.strip()
+
+	def get(self, search_term: str) -> SearchResultCacheEntry:
+		if self._max_size <= 0:
+			return None
+		for key in [self.url_key(search_term), self.keyword_key(search_term)]:
+			entry = self._get_from_memory(key) or self._get_from_db(key)
+			if entry:
+				with self._lock:
+					self._hits = self._hits + 1
+				logger.info('Search result cache hit for \'%s\' (hits: %d, misses: %d)', key, self._hits, self._misses)
+				return entry
+		with self._lock:
+			self._misses = self._misses + 1
+		return None
+
+	def put(self, entry: SearchResultCacheEntry) -> None:
+		if self._max_size <= 0 or entry.is_empty():
+			return
+		self._put_in_memory(entry, time.time() + self._ttl_in_seconds)
+		# the entry is serialized right away, it is extended by further pages while it is written
+		if not self._persistence_executor.try_submit(self._write, entry.key, json.dumps(entry.to_dict())):
+			logger.debug('Persistence lane is saturated. Search result of \'%s\' is not persisted.', entry.key)
+
+	def _write(self, key: str, entry_json: str) -> None:
+		try:
+			self._db.set(SEARCH_RESULT_KEY_PREFIX + key, entry_json, ex=self._ttl_in_seconds)
+		except Exception:
+			logger.warning('Persisting search result of \'%s\' failed.', key, exc_info=True)
+
+	def get_statistics(self) -> Dict[str, int]:
+		with self._lock:
+			return {'hits': self._hits, 'misses': self._misses, 'size': len(self._entries)}
+
+	def _get_from_memory(self, key: str) -> SearchResultCacheEntry:
+		with self._lock:
+			entry_with_expiration = self._entries.get(key)
+			if not entry_with_expiration:
+				return None
+			entry, expiration = entry_with_expiration
+			if expiration < time.time():
+				del self._entries[key]
+				return None
+			self._entries.move_to_end(key)
+			return entry
+
+	def _get_from_db(self, key: str) -> SearchResultCacheEntry:
+		try:
+			pipeline = self._db.pipeline()
+			pipeline.get(SEARCH_RESULT_KEY_PREFIX + key)
+			pipeline.ttl(SEARCH_RESULT_KEY_PREFIX + key)
+			value, ttl = pipeline.execute()
+			if not value or ttl is None or ttl <= 0:
+				return None
+			entry = SearchResultCacheEntry.from_dict(key, json.loads(value))
+			self._put_in_memory(entry, time.time() + ttl)
+			return entry
+		except Exception:
+			logger.warning('Reading search result of \'%s\' from redis failed.', key, exc_info=True)
+			return None
+
+	def _put_in_memory(self, entry: SearchResultCacheEntry, expiration: float) -> None:
+		with self._lock:
+			self._entries[entry.key] = (entry, expiration)
+			self._entries.move_to_end(entry.key)
+			while len(self._entries) > self._max_size:
+				self._entries.popitem(last=False)
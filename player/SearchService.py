@@ -1,14 +1,16 @@
 from __future__ import annotations
 
-from concurrent.futures import Executor, as_completed, Future, CancelledError, TimeoutError
-from concurrent.futures.thread import ThreadPoolExecutor
+import re
+from concurrent.futures import as_completed, Future, CancelledError, TimeoutError
+from datetime import datetime
 from threading import Lock
-
-from googleapiclient.errors import Error
-from googleapiclient.discovery import build, Resource
+from typing import TYPE_CHECKING
 
 from . import *
 
+if TYPE_CHECKING:
+	from googleapiclient.discovery import Resource
+
 YOUTUBE_API_SERVICE_NAME = 'youtube'
 YOUTUBE_API_VERSION = 'v3'
 
@@ -16,7 +18,17 @@ SEARCH_RESULT_INITIAL_EMIT_BATCH_SIZE = 3
 MINIMAL_WAIT_TIME_IN_SECONDS = 7
 MAXIMAL_WAIT_TIME_IN_SECONDS = 100
 WAIT_TIME_PER_TRACK_IN_SECONDS = 3
-NUMBER_OF_WORKERS = 5
+
+YOUTUBE_WATCH_URL = 'https://www.youtube.com/watch?v='
+ISO_8601_DURATION_PATTERN = re.compile(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?')
+
+
+@unique
+class KeywordSearchMetadataSource(Enum):
+	# metadata of all results of a page is fetched with one call of the YouTube API
+	YOUTUBE_API = 'youtube-api'
+	# metadata of each result is resolved with youtube-dl
+	YOUTUBE_DL = 'youtube-dl'
 
 logger = logging.getLogger(PlayerLoggerName.SEARCH_SERVICE.value)
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
@@ -83,82 +95,154 @@ class PlaylistSearchStrategy(UrlBasedSearchStrategy):
 
 class KeywordSearchResultIterator(SearchResult, Iterator[Track]):
 
+	# Iterates over the video IDs of a search result cache entry. Further video IDs are fetched from the
+	# YouTube API and added to the cache entry if the entry has a next page.
 	def __init__(self, track_factory: TrackFactory, youtube_api: Resource, search_term: str,
-				 max_keyword_search_results: int) -> None:
+				 max_keyword_search_results: int, cache_entry: SearchResultCacheEntry,
+				 search_result_cache: SearchResultCache, metadata_source: KeywordSearchMetadataSource) -> None:
 		self._track_factory = track_factory
 		self._youtube_api = youtube_api
 		self._max_keyword_search_results = max_keyword_search_results
-		self._next_page_token = None
-		self._has_next_page = True
+		self._metadata_source = metadata_source
+		self._metadata: Dict[str, VideoMetadata] = {}
 		self._search_term = search_term
-		self._result_count = 0
-		self._video_ids = self._query_youtube_api()
-		self._result_count = len(self._video_ids)
+		self._cache_entry = cache_entry
+		self._search_result_cache = search_result_cache
 		self._index = 0
+		self._load_next_page()
+
+	@property
+	def cache_entry(self) -> SearchResultCacheEntry:
+		return self._cache_entry
 
 	def __iter__(self) -> Iterator[Track]:
 		return self
 
 	def __next__(self) -> Track:
 		video_id = self._get_next_video_id()
+		metadata = self._metadata.pop(video_id, None)
+		if metadata:
+			return self._track_factory.create_youtube_track_from_metadata(metadata)
 		return self._track_factory.create_youtube_track(video_id, lazy_load=True)
 
 	def is_empty(self) -> bool:
-		return self._result_count == 0
+		return len(self._cache_entry.video_ids) == 0
 
 	def _get_next_video_id(self) -> str:
-		if self._index >= len(self._video_ids):
-			if self._has_next_page:
-				self._video_ids = self._query_youtube_api()
-				self._result_count = self._result_count + len(self._video_ids)
-				self._index = 0
+		if self._index >= len(self._cache_entry.video_ids):
+			self._load_next_page()
 
-		if self._index >= len(self._video_ids):
+		if self._index >= len(self._cache_entry.video_ids):
 			raise StopIteration
 
-		next_video_id = self._video_ids[self._index]
+		next_video_id = self._cache_entry.video_ids[self._index]
 		self._index = self._index + 1
 		return next_video_id
 
+	def _load_next_page(self) -> None:
+		with self._cache_entry.lock:
+			# another search task with the same search term may have loaded the next page in the meantime
+			if self._index < len(self._cache_entry.video_ids) or not self._cache_entry.has_next_page \
+					or not self._youtube_api:
+				return
+			self._cache_entry.video_ids.extend(self._query_youtube_api())
+		self._search_result_cache.put(self._cache_entry)
+
 	def _query_youtube_api(self) -> List[str]:
-		max_results = min(10, self._max_keyword_search_results - self._result_count)
+		max_results = min(10, self._max_keyword_search_results - len(self._cache_entry.video_ids))
 		if max_results <= 0:
+			self._cache_entry.has_next_page = False
 			return []
 		logger.info(f"Querying YouTube API for \'{self._search_term}' (max results: {max_results})")
-		search_response = self._youtube_api.search().list(
-			q=self._search_term,
-			part='id',
-			maxResults=max_results,
-			type='video',
-			pageToken=self._next_page_token
-		).execute()
-		self._next_page_token = search_response.get('nextPageToken', None)
-		if not self._next_page_token:
-			self._has_next_page = False
-		return [search_result['id']['videoId'] for search_result in search_response.get('items', [])]
+		with span('youtube api search', max_results=max_results):
+			search_response = self._youtube_api.search().list(
+				q=self._search_term,
+				part='id',
+				maxResults=max_results,
+				type='video',
+				pageToken=self._cache_entry.next_page_token
+			).execute()
+		self._cache_entry.next_page_token = search_response.get('nextPageToken', None)
+		if not self._cache_entry.next_page_token:
+			self._cache_entry.has_next_page = False
+		video_ids = [search_result['id']['videoId'] for search_result in search_response.get('items', [])]
+		if self._metadata_source == KeywordSearchMetadataSource.YOUTUBE_API and video_ids:
+			return self._query_youtube_api_for_metadata(video_ids)
+		return video_ids
+
+	def _query_youtube_api_for_metadata(self, video_ids: List[str]) -> List[str]:
+		logger.info('Querying YouTube API for metadata of %d videos', len(video_ids))
+		with span('youtube api videos', videos=len(video_ids)):
+			videos_response = self._youtube_api.videos().list(
+				id=','.join(video_ids),
+				part='snippet,contentDetails',
+				maxResults=len(video_ids)
+			).execute()
+		for item in videos_response.get('items', []):
+			metadata = self._create_metadata(item)
+			self._metadata[metadata.video_id] = metadata
+		# videos without metadata (e.g. deleted or private videos) can not be played
+		available_video_ids = [video_id for video_id in video_ids if video_id in self._metadata]
+		if len(available_video_ids) < len(video_ids):
+			logger.debug('No metadata found for videos: %s', set(video_ids) - set(available_video_ids))
+		return available_video_ids
+
+	def _create_metadata(self, item: Dict) -> VideoMetadata:
+		snippet = item['snippet']
+		thumbnails = snippet.get('thumbnails', {})
+		def thumbnail_url(*names: str) -> str:
+			return next((thumbnails[name]['url'] for name in names if name in thumbnails), None)
+		# the stream is not resolved, hence, it is expired already
+		return VideoMetadata(item['id'], snippet.get('title'), snippet.get('channelTitle'),
+							 self._parse_duration_in_seconds(item.get('contentDetails', {}).get('duration', '')),
+							 YOUTUBE_WATCH_URL + item['id'],
+							 {'bigthumbhd': thumbnail_url('maxres', 'standard'),
+							  'bigthumb': thumbnail_url('high', 'medium'),
+							  'thumb': thumbnail_url('default')},
+							 datetime.now())
+
+	@staticmethod
+	def _parse_duration_in_seconds(iso_8601_duration: str) -> int:
+		match = ISO_8601_DURATION_PATTERN.fullmatch(iso_8601_duration)
+		if not match:
+			return 0
+		days, hours, minutes, seconds = [int(group) if group else 0 for group in match.groups()]
+		return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
 
 
 class KeywordSearchStrategy(SearchStrategy):
 
-	def __init__(self, track_factory: TrackFactory, youtube_api: Resource, max_keyword_search_results: int) -> None:
+	def __init__(self, track_factory: TrackFactory, youtube_api: Resource, max_keyword_search_results: int,
+				 search_result_cache: SearchResultCache, metadata_source: KeywordSearchMetadataSource) -> None:
 		self._track_factory = track_factory
 		self._youtube_api = youtube_api
 		self._max_keyword_search_results = max_keyword_search_results
+		self._search_result_cache = search_result_cache
+		self._metadata_source = metadata_source
 
 	def search(self, search_term: str) -> Iterator[Track]:
+		cache_entry = SearchResultCacheEntry(SearchResultCache.keyword_key(search_term), has_next_page=True,
+											 keyword_search=True)
 		return KeywordSearchResultIterator(self._track_factory, self._youtube_api, search_term,
-										   self._max_keyword_search_results)
+										   self._max_keyword_search_results, cache_entry, self._search_result_cache,
+										   self._metadata_source)
 
 
 class SearchResultTrack:
 
-	def __init__(self, index: int, track: Track) -> None:
+	def __init__(self, index: int, track: Track, cache_entry: SearchResultCacheEntry) -> None:
 		self._index = index
 		self._track = track
+		self._cache_entry = cache_entry
 
 	def get_property_dict(self):
+		video_id = self._track.get_video_id()
+		track_dict = self._cache_entry.track_dicts.get(video_id)
+		if not track_dict:
+			track_dict = self._track.get_property_dict()
+			self._cache_entry.track_dicts[video_id] = track_dict
 		return {'index': self._index,
-				'track': self._track.get_property_dict()}
+				'track': track_dict}
 
 	def __str__(self) -> str:
 		return '{} {}'.format(self._index, str(self._track))
@@ -166,14 +250,24 @@ class SearchResultTrack:
 
 class SearchTask:
 
-	def __init__(self, search_term: str, sid: str, track_factory: TrackFactory, executor: Executor,
-				 youtube_api: Resource, max_keyword_search_results: int) -> None:
+	def __init__(self, search_term: str, sid: str, track_factory: TrackFactory, executor: WorkerLaneExecutor,
+				 resolution_executor: WorkerLaneExecutor, youtube_api: Resource, max_keyword_search_results: int, search_result_cache: SearchResultCache,
+				 metadata_source: KeywordSearchMetadataSource) -> None:
 		self._search_term = search_term
 		self._sid = sid
+		# the search task runs on the search lane and waits for the strategies and tracks resolved on the resolution lane
 		self._executor = executor
+		self._resolution_executor = resolution_executor
+		self._track_factory = track_factory
+		self._youtube_api = youtube_api
+		self._max_keyword_search_results = max_keyword_search_results
+		self._search_result_cache = search_result_cache
+		self._metadata_source = metadata_source
+		self._cache_entry = SearchResultCacheEntry(SearchResultCache.url_key(search_term))
 		self._search_strategies = [PlaylistSearchStrategy(track_factory), TrackSearchStrategy(track_factory)]
 		if youtube_api:
-			self._search_strategies.append(KeywordSearchStrategy(track_factory, youtube_api, max_keyword_search_results))
+			self._search_strategies.append(KeywordSearchStrategy(track_factory, youtube_api, max_keyword_search_results,
+																 search_result_cache, metadata_source))
 		# appending and extending a list is thread-safe according to
 		# https://stackoverflow.com/questions/6319207/are-lists-thread-safe and
 		# http://effbot.org/pyfaq/what-kinds-of-global-value-mutation-are-thread-safe.htm
@@ -185,6 +279,8 @@ class SearchTask:
 		self._tracks_iterator = iter(())
 		self._lock = Lock()
 		self._search_results: Dict[int, SearchResultTrack] = {}
+		# time of the start of the search until its first results are emitted
+		self._start_time: Optional[float] = None
 
 	@property
 	def sid(self) -> str:
@@ -195,6 +291,7 @@ class SearchTask:
 		return self._search_term
 
 	def start(self, batch_index: int, requested_search_indices: List[int]) -> None:
+		self._start_time = time.monotonic()
 		future = self._executor.submit(self._start, batch_index, requested_search_indices)
 		self._futures.append(future)
 
@@ -228,7 +325,16 @@ class SearchTask:
 				self._lock.release()
 
 	def _find_search_result(self) -> Iterator[Track]:
-		futures: List[Future] = [self._executor.submit(search_strategy.search, self._search_term) for search_strategy in self._search_strategies]
+		cache_entry = self._search_result_cache.get(self._search_term)
+		if cache_entry:
+			self._cache_entry = cache_entry
+			if cache_entry.keyword_search:
+				return KeywordSearchResultIterator(self._track_factory, self._youtube_api, self._search_term,
+												   self._max_keyword_search_results, cache_entry,
+												   self._search_result_cache, self._metadata_source)
+			return iter(UrlBasedSearchResult([self._track_factory.create_youtube_track(video_id, lazy_load=True)
+											  for video_id in cache_entry.video_ids]))
+		futures: List[Future] = [self._resolution_executor.submit(search_strategy.search, self._search_term) for search_strategy in self._search_strategies]
 		self._futures.extend(futures)
 		track_iterable: Iterable[Track] = ()
 		for future in futures:
@@ -236,7 +342,15 @@ class SearchTask:
 			if not track_iterable.is_empty():
 				break
 		[future.cancel() for future in futures]
-		return iter(track_iterable)
+		if isinstance(track_iterable, KeywordSearchResultIterator):
+			self._cache_entry = track_iterable.cache_entry
+			return track_iterable
+		# the tracks of a URL are iterated once to be cached and once to be emitted
+		tracks = list(track_iterable)
+		if tracks:
+			self._cache_entry.video_ids = [track.get_video_id() for track in tracks]
+			self._search_result_cache.put(self._cache_entry)
+		return iter(tracks)
 
 	def _fetch_search_result(self, future: Future, futures: List[Future]) -> SearchResult:
 		def description():
@@ -250,18 +364,19 @@ class SearchTask:
 			batch_index_end = max(max(requested_search_indices), batch_index_end)
 		try:
 			while self._result_index <= batch_index_end:
-				self._search_results[self._result_index] = SearchResultTrack(self._result_index, next(self._tracks_iterator))
+				self._search_results[self._result_index] = SearchResultTrack(self._result_index, next(self._tracks_iterator),
+																			 self._cache_entry)
 				self._result_index = self._result_index + 1
 		except StopIteration:
 				self._search_completed = True
 		return [self._search_results[result_index] for result_index in requested_search_indices if self._search_results.get(result_index)]
 
 	def _send_result_batch(self, batch_index: int, result_batch: [SearchResultTrack]) -> None:
-		result_batch_futures: List[Future] = [self._executor.submit(entry.get_property_dict) for entry in result_batch]
+		result_batch_futures: List[Future] = [self._resolution_executor.submit(entry.get_property_dict) for entry in result_batch]
 		self._futures.extend(result_batch_futures)
 		property_dicts = []
 		next_emit = SEARCH_RESULT_INITIAL_EMIT_BATCH_SIZE
-		timeout = min(MINIMAL_WAIT_TIME_IN_SECONDS + (len(result_batch) * WAIT_TIME_PER_TRACK_IN_SECONDS) / NUMBER_OF_WORKERS, MAXIMAL_WAIT_TIME_IN_SECONDS)
+		timeout = min(MINIMAL_WAIT_TIME_IN_SECONDS + (len(result_batch) * WAIT_TIME_PER_TRACK_IN_SECONDS) / self._resolution_executor.max_workers, MAXIMAL_WAIT_TIME_IN_SECONDS)
 		for track_future in as_completed(result_batch_futures, timeout=timeout):
 			property_dict = self._fetch_property_dict(track_future, result_batch_futures, result_batch)
 			if property_dict:
@@ -272,6 +387,8 @@ class SearchTask:
 				property_dicts = []
 		self._batch_completed = True
 		self._emit_search_result(batch_index, property_dicts)
+		# persist the resolved track dicts
+		self._search_result_cache.put(self._cache_entry)
 
 	def _fetch_property_dict(self, track_future: Future, result_batch_futures: List[Future], result_batch: [SearchResultTrack]):
 		def description():
@@ -289,6 +406,9 @@ class SearchTask:
 			'results': property_dicts
 		}
 		logger.info('emitting search result for \'%s\' of size %d (%s)', self._search_term, len(property_dicts), search_result)
+		if self._start_time is not None:
+			observe(Metric.SEARCH_TIME_TO_FIRST_RESULT, time.monotonic() - self._start_time)
+			self._start_time = None
 		emit(SendEvent.SEARCH_RESULTS, search_result, sid=self._sid)
 
 	def _fetch_result(self, future: Future, default_result, description_callback):
@@ -307,31 +427,53 @@ class SearchTask:
 
 class SearchService:
 
-	def __init__(self, track_factory: TrackFactory, youtube_api_key: str, max_keyword_search_results: int):
+	def __init__(self, track_factory: TrackFactory, youtube_api_key: str, max_keyword_search_results: int,
+				 search_result_cache: SearchResultCache, metadata_source: KeywordSearchMetadataSource,
+				 worker_pool: WorkerPoolGovernor):
 		self._track_factory = track_factory
+		self._search_result_cache = search_result_cache
+		self._metadata_source = metadata_source
 		self._youtube_api_key = youtube_api_key
 		self._max_keyword_search_results = max_keyword_search_results
-		self._executor = ThreadPoolExecutor(max_workers=NUMBER_OF_WORKERS, thread_name_prefix='SearchServiceThread')
+		self._executor = worker_pool.lane(WorkerLane.SEARCH)
+		self._resolution_executor = worker_pool.lane(WorkerLane.RESOLUTION)
 		self._search_tasks: Dict[str, SearchTask] = {}
+		# searches of different clients are run concurrently
+		self._search_tasks_lock = Lock()
 		self._youtube_api: Resource = None
-		if self._youtube_api_key:
-			try:
-				self._youtube_api: Resource = build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
-						developerKey=self._youtube_api_key)
-			except Error:
-				logger.warning('Error on attempt to initialize YouTube API service. Did you specify an invalid API key? '
-							   'Keyword search will be disabled.', exc_info=True)
-		else:
+		self._youtube_api_initialized = False
+		if not self._youtube_api_key:
 			logger.info('No Google / YouTube API key was specified. Keyword search will be disabled.')
 
+	# The YouTube API service is built on the first search (not at startup) from the discovery document bundled
+	# with googleapiclient, hence, neither the import nor the build delays the startup or requests the document.
+	def _get_youtube_api(self) -> Optional[Resource]:
+		if self._youtube_api_initialized or not self._youtube_api_key:
+			return self._youtube_api
+		self._youtube_api_initialized = True
+		from googleapiclient.discovery import build
+		from googleapiclient.errors import Error
+		try:
+			self._youtube_api = build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, developerKey=self._youtube_api_key,
+									  static_discovery=True)
+		except Error:
+			logger.warning('Error on attempt to initialize YouTube API service. Did you specify an invalid API key? '
+						   'Keyword search will be disabled.', exc_info=True)
+		return self._youtube_api
+
 	def run_search(self, search_term: str, batch_index: int, requested_search_indices: List[int], sid: str) -> None:
 		logger.info('run search for \'%s\' of %s (requested search result indices: %s)', search_term, sid, requested_search_indices)
+		with self._search_tasks_lock:
+			self._run_search(search_term, batch_index, requested_search_indices, sid)
+
+	def _run_search(self, search_term: str, batch_index: int, requested_search_indices: List[int], sid: str) -> None:
 		search_task = self._search_tasks.get(sid)
 		if not search_task or search_task.search_term != search_term:
 			if search_task:
 				search_task.cancel()
-			search_task = SearchTask(search_term, sid, self._track_factory, self._executor, self._youtube_api,
-									 self._max_keyword_search_results)
+			search_task = SearchTask(search_term, sid, self._track_factory, self._executor, self._resolution_executor,
+									 self._get_youtube_api(),
+									 self._max_keyword_search_results, self._search_result_cache, self._metadata_source)
 			search_task.start(batch_index, requested_search_indices)
 			self._search_tasks[sid] = search_task
 		else:
@@ -340,10 +482,11 @@ class SearchService:
 
 	def cancel_search(self, sid: str) -> None:
 		logger.info('cancel search for %s', sid)
-		search_task = self._search_tasks.get(sid)
-		if search_task:
-			search_task.cancel()
-		self._cleanup_search_tasks()
+		with self._search_tasks_lock:
+			search_task = self._search_tasks.get(sid)
+			if search_task:
+				search_task.cancel()
+			self._cleanup_search_tasks()
 
 	# FIXME: memory leak: user queries for big playlist (iterator does not complete) and terminates session. Max search task age?
 	def _cleanup_search_tasks(self):
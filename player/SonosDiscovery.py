@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import select
+import struct
+import time
+from threading import Event
+from urllib.parse import urlparse
+
+from . import *
+
+SSDP_MULTICAST_ADDRESS = '239.255.255.250'
+SSDP_PORT = 1900
+SSDP_MAX_MESSAGE_SIZE = 8192
+SONOS_DEVICE_TYPE = 'urn:schemas-upnp-org:device:ZonePlayer:1'
+# devices are considered gone if they neither announce themselves nor answer a search within max-age
+DEFAULT_MAX_AGE_IN_SECONDS = 1800
+# max time in which the listener reacts on a stop and checks for gone devices
+SELECT_TIMEOUT_IN_SECONDS = 1
+M_SEARCH_MESSAGE = ('M-SEARCH * HTTP/1.1\r\n'
+					'HOST: {}:{}\r\n'
+					'MAN: "ssdp:discover"\r\n'
+					'MX: 1\r\n'
+					'ST: ' + SONOS_DEVICE_TYPE + '\r\n'
+					'\r\n')
+
+logger = logging.getLogger(PlayerLoggerName.SONOS_DISCOVERY.value)
+
+
+@unique
+class SonosDiscoveryMode(Enum):
+	# full discovery (soco.discover()) in a fixed interval
+	PERIODIC = 'periodic'
+	# persistent SSDP listener, which reports added and removed devices
+	INCREMENTAL = 'incremental'
+
+
+class SsdpObserver(ABC):
+
+	@abstractmethod
+	def ssdp_device_alive(self, ip_address: str) -> None: raise NotImplementedError
+
+	@abstractmethod
+	def ssdp_device_gone(self, ip_address: str) -> None: raise NotImplementedError
+
+
+def parse_ssdp_message(data: bytes) -> Tuple[str, Dict[str, str]]:
+	lines = data.decode('utf-8', errors='replace').split('\r\n')
+	headers = {}
+	for line in lines[1:]:
+		name, separator, value = line.partition(':')
+		if separator:
+			headers[name.strip().upper()] = value.strip()
+	return lines[0], headers
+
+
+# Listens for announcements (NOTIFY ssdp:alive / ssdp:byebye) of Sonos devices and searches for Sonos devices
+# (M-SEARCH) every search_interval_in_seconds. The observer is only notified if a device appears, disappears or
+# changes its IP address, repeated announcements of known devices are ignored.
+# Address and port are configurable, such that the listener can be run against a local fake UPnP responder.
+class SsdpListener(StoppableThread):
+
+	def __init__(self, observer: SsdpObserver, search_interval_in_seconds: int,
+				 multicast_address: str = SSDP_MULTICAST_ADDRESS, port: int = SSDP_PORT):
+		super().__init__(name='SsdpListenerThread')
+		self._observer = observer
+		self._search_interval_in_seconds = search_interval_in_seconds
+		self._multicast_address = multicast_address
+		self._port = port
+		# IP address and expiration time of the known devices by UID
+		self._devices: Dict[str, Tuple[str, float]] = {}
+		self._stopped = Event()
+
+	def stop(self) -> None:
+		self._stopped.set()
+
+	def run(self) -> None:
+		listen_socket = self._create_listen_socket()
+		# answers to searches are sent to the (unicast) address of the searching socket
+		search_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		search_socket.bind(('', 0))
+		last_search_timestamp = None
+		try:
+			while not self._stopped.is_set():
+				if last_search_timestamp is None or \
+						time.monotonic() - last_search_timestamp >= self._search_interval_in_seconds:
+					last_search_timestamp = time.monotonic()
+					self._search(search_socket)
+				readable_sockets, _, _ = select.select([listen_socket, search_socket], [], [], SELECT_TIMEOUT_IN_SECONDS)
+				for readable_socket in readable_sockets:
+					data, address = readable_socket.recvfrom(SSDP_MAX_MESSAGE_SIZE)
+					try:
+						self._handle_message(data, address[0])
+					except Exception:
+						logger.warning('Handling SSDP message from %s failed: %s', address, data, exc_info=True)
+				self._expire_devices()
+		finally:
+			listen_socket.close()
+			search_socket.close()
+
+	def _create_listen_socket(self) -> socket.socket:
+		listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if hasattr(socket, 'SO_REUSEPORT'):
+			listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		listen_socket.bind(('', self._port))
+		try:
+			membership = struct.pack('4s4s', socket.inet_aton(self._multicast_address), socket.inet_aton('0.0.0.0'))
+			listen_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+		except OSError:
+			# e.g. no multicast route, devices are still found by the periodic searches
+			logger.warning('Joining SSDP multicast group %s failed. Announcements of Sonos devices are not received.',
+						   self._multicast_address, exc_info=True)
+		return listen_socket
+
+	def _search(self, search_socket: socket.socket) -> None:
+		logger.debug('Searching Sonos devices on %s:%d ...', self._multicast_address, self._port)
+		try:
+			search_socket.sendto(M_SEARCH_MESSAGE.format(self._multicast_address, self._port).encode('utf-8'),
+								 (self._multicast_address, self._port))
+		except OSError:
+			logger.warning('Sending SSDP search failed.', exc_info=True)
+
+	def _handle_message(self, data: bytes, sender_ip_address: str) -> None:
+		start_line, headers = parse_ssdp_message(data)
+		if start_line.startswith('NOTIFY'):
+			if headers.get('NT') != SONOS_DEVICE_TYPE:
+				return
+			if headers.get('NTS') == 'ssdp:byebye':
+				self._device_gone(self._get_uid(headers))
+				return
+		elif not start_line.startswith('HTTP/1.1 200') or headers.get('ST') != SONOS_DEVICE_TYPE:
+			return
+		ip_address = urlparse(headers['LOCATION']).hostname if 'LOCATION' in headers else sender_ip_address
+		self._device_alive(self._get_uid(headers), ip_address, self._get_max_age(headers))
+
+	def _device_alive(self, uid: str, ip_address: str, max_age_in_seconds: int) -> None:
+		expiration = time.monotonic() + max_age_in_seconds
+		known_device = self._devices.get(uid)
+		if known_device and known_device[0] == ip_address:
+			self._devices[uid] = (ip_address, expiration)
+			return
+		if known_device:
+			# the device changed its IP address
+			del self._devices[uid]
+			self._observer.ssdp_device_gone(known_device[0])
+		logger.info('Sonos device %s appeared at %s.', uid, ip_address)
+		# the device is only known once the observer added it, otherwise it is added on its next announcement
+		self._observer.ssdp_device_alive(ip_address)
+		self._devices[uid] = (ip_address, expiration)
+
+	def _device_gone(self, uid: str) -> None:
+		known_device = self._devices.pop(uid, None)
+		if known_device:
+			logger.info('Sonos device %s at %s disappeared.', uid, known_device[0])
+			self._observer.ssdp_device_gone(known_device[0])
+
+	def _expire_devices(self) -> None:
+		now = time.monotonic()
+		for uid in [uid for uid, (_, expiration) in self._devices.items() if expiration < now]:
+			self._device_gone(uid)
+
+	@staticmethod
+	def _get_uid(headers: Dict[str, str]) -> str:
+		# e.g. uuid:RINCON_000E58A0B2C201400::urn:schemas-upnp-org:device:ZonePlayer:1
+		return headers.get('USN', '').split('::')[0].replace('uuid:', '', 1)
+
+	@staticmethod
+	def _get_max_age(headers: Dict[str, str]) -> int:
+		for directive in headers.get('CACHE-CONTROL', '').split(','):
+			name, _, value = directive.partition('=')
+			if name.strip().lower() == 'max-age' and value.strip().isdigit():
+				return int(value.strip())
+		return DEFAULT_MAX_AGE_IN_SECONDS
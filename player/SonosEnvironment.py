@@ -1,14 +1,17 @@
 from __future__ import annotations
 
-import soco
-from soco.core import SoCo
 import threading
+import time
+from concurrent.futures import wait
+from typing import TYPE_CHECKING
 
 from Util import StoppableThreadWithEvent, StoppableThread
 from . import *
 
+if TYPE_CHECKING:
+	from soco.core import SoCo
+
 INITIAL_SONOS_VOLUME = 5
-SONOS_DISCOVERY_INTERVAL_IN_SECONDS = 30
 
 logger = logging.getLogger(PlayerLoggerName.SONOS_ENVIRONMENT.value)
 
@@ -20,94 +23,264 @@ class StreamConsumer(ABC):
 
 
 T = TypeVar('T')
-SonosDevicesByName = Dict[str, SoCo]
+SonosDevicesByName = Dict[str, 'SoCo']
 
 
-class SonosEnvironment(StreamConsumer):
+# Latencies of the calls to each Sonos device. Calls which exceed the timeout are counted as timeouts when the
+# timeout expires and their latency is recorded when they complete.
+class SonosCallStatistics:
 
 	def __init__(self):
+		self._lock = threading.Lock()
+		self._statistics_by_device_name: Dict[str, Dict[str, float]] = {}
+
+	def record_call(self, device_name: str, latency_in_seconds: float, failed: bool) -> None:
+		with self._lock:
+			statistics = self._get_device_statistics(device_name)
+			statistics['calls'] = statistics['calls'] + 1
+			statistics['failures'] = statistics['failures'] + (1 if failed else 0)
+			statistics['total_latency_in_seconds'] = statistics['total_latency_in_seconds'] + latency_in_seconds
+			statistics['max_latency_in_seconds'] = max(statistics['max_latency_in_seconds'], latency_in_seconds)
+
+	def record_timeout(self, device_name: str) -> None:
+		with self._lock:
+			statistics = self._get_device_statistics(device_name)
+			statistics['timeouts'] = statistics['timeouts'] + 1
+
+	def get_statistics(self) -> Dict[str, Dict[str, float]]:
+		with self._lock:
+			return {device_name: dict(statistics,
+									  mean_latency_in_seconds=statistics['total_latency_in_seconds'] / statistics['calls']
+									  if statistics['calls'] else 0.0)
+					for device_name, statistics in self._statistics_by_device_name.items()}
+
+	def _get_device_statistics(self, device_name: str) -> Dict[str, float]:
+		return self._statistics_by_device_name.setdefault(device_name, {'calls': 0, 'failures': 0, 'timeouts': 0,
+																		 'total_latency_in_seconds': 0.0,
+																		 'max_latency_in_seconds': 0.0})
+
+
+# The discovery never holds the lock of the devices across network I/O: devices are discovered and resolved without
+# the lock, the lock is only held to replace the devices with a new dict (the dict is never modified). Zone
+# unification and the emit of the setup only happen if devices were added, removed or renamed. The group
+# coordinators are read once per setup change (after the zone unification), not on every play, unpause or seek.
+#
+# Calls to several devices (tuning the coordinators to the stream, reading and setting volumes) are sent
+# concurrently on the Sonos I/O lane of the worker pool. Devices which fail or do not answer within
+# call_timeout_in_seconds are reported and skipped, the call succeeds on the other devices.
+class SonosEnvironment(StreamConsumer, SsdpObserver):
+
+	def __init__(self, discovery_mode: SonosDiscoveryMode, discovery_interval_in_seconds: int,
+				 sonos_io_executor: WorkerLaneExecutor, call_timeout_in_seconds: int):
 		self._sonos_devices_lock = threading.Lock()
+		self._discovery_interval_in_seconds = discovery_interval_in_seconds
+		self._sonos_io_executor = sonos_io_executor
+		self._call_timeout_in_seconds = call_timeout_in_seconds
+		self._call_statistics = SonosCallStatistics()
+		# last known volumes, used if reading the volume of a device fails. Updated by the workers of the Sonos I/O
+		# lane and the threads handling commands
+		self._volumes_lock = threading.Lock()
+		self._volumes: Dict[str, int] = {}
+		# coordinators of the current devices, guarded by the lock of the devices
+		self._sonos_coordinators: SonosDevicesByName = {}
 		self._sonos_devices = self._find_sonos_devices()
 		if self._add_all_devices_to_one_zone(self._sonos_devices):
 			logger.info(f"Initial Sonos device setup after zone unification: "
 						f"{self._create_devices_description(self._sonos_devices)}")
+		self._update_sonos_coordinators(self._sonos_devices)
 		self._update_db_and_emit(self._sonos_devices, SendEvent.SONOS_SETUP)
 		self.set_sonos_volume_for_all_devices(INITIAL_SONOS_VOLUME)
-		self._monitoring_thread = StoppableThreadWithEvent(self._monitor_sonos_environment)
+		if discovery_mode is SonosDiscoveryMode.INCREMENTAL:
+			self._monitoring_thread = SsdpListener(self, discovery_interval_in_seconds)
+		else:
+			self._monitoring_thread = StoppableThreadWithEvent(self._monitor_sonos_environment)
 
 	def start_sonos_environment_monitoring(self) -> StoppableThread:
 		self._monitoring_thread.start()
 		return self._monitoring_thread
 
+	def get_call_statistics(self) -> Dict[str, Dict[str, float]]:
+		return self._call_statistics.get_statistics()
+
 	def set_sonos_volume_for_all_devices(self, volume: int) -> None:
-		def set_sonos_volume_for_all_devices(sonos_devices: SonosDevicesByName):
-			for device in sonos_devices.values():
-				self._set_device_volume(device, volume)
-			self._update_db_and_emit(sonos_devices, SendEvent.VOLUME_CHANGED)
-		return self._with_sonos_devices(set_sonos_volume_for_all_devices)
+		sonos_devices = self._get_sonos_devices()
+		self._set_device_volumes(sonos_devices, volume)
+		self._update_db_and_emit(sonos_devices, SendEvent.VOLUME_CHANGED)
 
 	def set_sonos_volume(self, device_name: str, volume: int, originator_sid: str) -> None:
-		def set_sonos_volume(sonos_devices: SonosDevicesByName) -> None:
-			device = sonos_devices.get(device_name)
-			if not device:
-				raise ValueError(f"No Sonos device with name {device_name} found. "
-								 f"Present Sonos devices: {sonos_devices}")
-			self._set_device_volume(device, volume)
-			self._update_db_and_emit(sonos_devices, SendEvent.VOLUME_CHANGED, originator_sid=originator_sid)
-		return self._with_sonos_devices(set_sonos_volume)
-
-	def play_stream(self, track: Track) -> None:
-		def play_stream(sonos_devices: SonosDevicesByName) -> None:
-			sonos_coordinators = self._find_sonos_coordinators(sonos_devices)
-			stream_url = track.get_out_stream_url(sonos_coordinators[0].ip_address)
-			logger.debug('Tuning Sonos coordinator devices (%s) to stream on %s ...', sonos_coordinators, stream_url)
-			for sonos_coordinator in sonos_coordinators:
-				sonos_coordinator.stop()
-				title = '{} - {}'.format(track.get_title(), track.get_artist())
+		sonos_devices = self._get_sonos_devices()
+		device = sonos_devices.get(device_name)
+		if not device:
+			raise ValueError(f"No Sonos device with name {device_name} found. "
+							 f"Present Sonos devices: {sonos_devices}")
+		if not self._set_device_volumes({device_name: device}, volume):
+			raise ValueError(f"Setting the volume of Sonos device {device_name} failed.")
+		self._update_db_and_emit(sonos_devices, SendEvent.VOLUME_CHANGED, originator_sid=originator_sid)
+
+	# coordinators with an IP address in connected_ip_addresses already play the (continuous) stream and are not tuned
+	def play_stream(self, track: Track, connected_ip_addresses: Set[str] = frozenset()) -> None:
+		sonos_coordinators = self._get_sonos_coordinators()
+		stream_url = track.get_out_stream_url(next(iter(sonos_coordinators.values())).ip_address)
+		sonos_coordinators = {device_name: device for device_name, device in sonos_coordinators.items()
+							  if device.ip_address not in connected_ip_addresses}
+		if not sonos_coordinators:
+			logger.debug('All Sonos coordinator devices are connected to the stream on %s.', stream_url)
+			return
+		title = '{} - {}'.format(track.get_title(), track.get_artist())
+		logger.debug('Tuning Sonos coordinator devices (%s) to stream on %s ...', sonos_coordinators, stream_url)
+		def play_uri(sonos_coordinator: SoCo) -> None:
+			sonos_coordinator.stop()
+			with timed(Metric.TRACK_START_PHASE, phase='play_uri'):
 				sonos_coordinator.play_uri(stream_url, title=title, force_radio=True)
-				logger.debug('Sonos coordinator (%s) started playing URL %s', sonos_coordinator, stream_url)
-		self._with_sonos_devices(play_stream)
+		tuned_coordinators = self._call_devices('Tuning to the stream', sonos_coordinators, play_uri)
+		if not tuned_coordinators:
+			# the groups may have changed without a change of the devices, the coordinators are read again next time
+			with self._sonos_devices_lock:
+				self._sonos_coordinators = {}
+			raise ValueError('Tuning the Sonos coordinator devices {} to stream on {} failed.'.format(
+				list(sonos_coordinators), stream_url))
+		logger.debug('Sonos coordinators (%s) started playing URL %s', list(tuned_coordinators), stream_url)
+
+	def ssdp_device_alive(self, ip_address: str) -> None:
+		from soco.core import SoCo
+		device = SoCo(ip_address)
+		# network I/O, without holding the lock
+		self._apply_device_changes({device.player_name: device}, [])
 
-	def _with_sonos_devices(self, callback: Callable[[SonosDevicesByName], T]) -> T:
+	def ssdp_device_gone(self, ip_address: str) -> None:
+		self._apply_device_changes({}, [ip_address])
+
+	# the devices dict is never modified, it can be used without holding the lock
+	def _get_sonos_devices(self) -> SonosDevicesByName:
 		with self._sonos_devices_lock:
-			return callback(self._sonos_devices)
+			return self._sonos_devices
 
-	def _set_device_volume(self, device: SoCo, volume: int):
-		device.volume = volume
-		logger.info('Volume of Sonos device with name \'%s\' changed to %d.', device.player_name, device.volume)
+	# the coordinators are read again if they are unknown (e.g. reading them failed after the last setup change)
+	def _get_sonos_coordinators(self) -> SonosDevicesByName:
+		with self._sonos_devices_lock:
+			sonos_coordinators = self._sonos_coordinators
+			sonos_devices = self._sonos_devices
+		if not sonos_coordinators:
+			sonos_coordinators = self._update_sonos_coordinators(sonos_devices)
+		if not sonos_coordinators:
+			raise ValueError('No Sonos coordinator device found. Found devices: {0}'.format(sonos_devices))
+		return sonos_coordinators
+
+	def _update_sonos_coordinators(self, sonos_devices: SonosDevicesByName) -> SonosDevicesByName:
+		# network I/O, without holding the lock
+		sonos_coordinators = self._find_sonos_coordinators(sonos_devices)
+		with self._sonos_devices_lock:
+			# the devices may have been replaced in the meantime, their coordinators are read on their setup change
+			if sonos_devices is self._sonos_devices:
+				self._sonos_coordinators = sonos_coordinators
+		return sonos_coordinators
+
+	# returns the names of the devices whose volume was set
+	def _set_device_volumes(self, sonos_devices: SonosDevicesByName, volume: int) -> List[str]:
+		def set_volume(device: SoCo) -> None:
+			device.volume = volume
+		device_names = list(self._call_devices('Setting the volume', sonos_devices, set_volume))
+		with self._volumes_lock:
+			self._volumes.update((device_name, volume) for device_name in device_names)
+		for device_name in device_names:
+			logger.info('Volume of Sonos device with name \'%s\' changed to %d.', device_name, volume)
+		return device_names
+
+	# Calls the devices concurrently and returns the results of the devices which succeeded by device name.
+	def _call_devices(self, description: str, sonos_devices: SonosDevicesByName,
+					  call: Callable[[SoCo], T]) -> Dict[str, T]:
+		device_names_by_future = {self._sonos_io_executor.submit(self._call_device, description, device_name, device,
+																 call): device_name
+								  for device_name, device in sonos_devices.items()}
+		done, not_done = wait(device_names_by_future, timeout=self._call_timeout_in_seconds)
+		results = {}
+		failed_device_names = []
+		for future in done:
+			try:
+				results[device_names_by_future[future]] = future.result()
+			except Exception:
+				logger.debug('%s failed on Sonos device \'%s\'.', description, device_names_by_future[future], exc_info=True)
+				failed_device_names.append(device_names_by_future[future])
+		for future in not_done:
+			self._call_statistics.record_timeout(device_names_by_future[future])
+			failed_device_names.append(device_names_by_future[future])
+		if failed_device_names:
+			logger.warning('%s failed or timed out on %d of %d Sonos devices: %s', description, len(failed_device_names),
+						   len(sonos_devices), failed_device_names)
+		return results
+
+	def _call_device(self, description: str, device_name: str, device: SoCo, call: Callable[[SoCo], T]) -> T:
+		start_timestamp = time.monotonic()
+		failed = True
+		try:
+			with span('sonos call', call=description, device=device_name):
+				result = call(device)
+			failed = False
+			return result
+		finally:
+			self._call_statistics.record_call(device_name, time.monotonic() - start_timestamp, failed)
 
 	def _update_db_and_emit(self, sonos_devices: SonosDevicesByName, event: SendEvent, originator_sid=None):
 		sonos_setup = self._create_sonos_setup_dict(sonos_devices)
 		save_and_emit(DbKey.SONOS_SETUP, event, sonos_setup, skip_sid=originator_sid)
 
 	def _create_sonos_setup_dict(self, sonos_devices: SonosDevicesByName) -> List[PropDict]:
-		sorted_devices = list(sonos_devices.values())
-		sorted_devices.sort(key=lambda device: device.player_name)
-		return [{'device_name': device.player_name, 'current_volume': device.volume, 'max_volume': 100}
-				for device in sorted_devices]
+		volumes = self._call_devices('Reading the volume', sonos_devices, lambda device: device.volume)
+		with self._volumes_lock:
+			self._volumes.update(volumes)
+			return [{'device_name': device_name, 'current_volume': self._volumes[device_name], 'max_volume': 100}
+					for device_name in sorted(sonos_devices) if device_name in self._volumes]
 
 	def _monitor_sonos_environment(self) -> None:
 		while True:
-			if self._monitoring_thread.get_exit_event().wait(SONOS_DISCOVERY_INTERVAL_IN_SECONDS):
+			if self._monitoring_thread.get_exit_event().wait(self._discovery_interval_in_seconds):
 				break
 			new_sonos_devices = {}
 			try:
 				new_sonos_devices = self._find_sonos_devices()
 			except Exception:
 				logger.warning('Exception in Sonos discovery routine.', exc_info=True)
+			with self._sonos_devices_lock:
+				changed = self._replace_sonos_devices(new_sonos_devices)
+			self._sonos_setup_changed(new_sonos_devices, changed)
 
-			def set_sonos_devices(previous_sonos_devices: SonosDevicesByName) -> None:
-				unified= self._add_all_devices_to_one_zone(new_sonos_devices)
-				self._sonos_devices = new_sonos_devices
-				logger.info(f"Sonos environment monitoring routine completed (Groups unification took place: {unified}). "
-							f"New setup: {self._create_devices_description(new_sonos_devices)}.")
-				self._update_db_and_emit(new_sonos_devices, SendEvent.SONOS_SETUP)
-			try:
-				self._with_sonos_devices(set_sonos_devices)
-			except Exception:
-				logger.warning('Exception in unifying or reassigning Sonos devices.', exc_info=True)
+	def _apply_device_changes(self, found_devices: SonosDevicesByName, lost_ip_addresses: List[str]) -> None:
+		# devices found again (e.g. renamed ones) replace their previous entry
+		removed_ip_addresses = set(lost_ip_addresses).union(device.ip_address for device in found_devices.values())
+		with self._sonos_devices_lock:
+			new_sonos_devices = {name: device for name, device in self._sonos_devices.items()
+								 if device.ip_address not in removed_ip_addresses}
+			new_sonos_devices.update(found_devices)
+			changed = self._replace_sonos_devices(new_sonos_devices)
+		self._sonos_setup_changed(new_sonos_devices, changed)
+
+	# must be called with the lock held, no network I/O
+	def _replace_sonos_devices(self, new_sonos_devices: SonosDevicesByName) -> bool:
+		if self._get_topology(new_sonos_devices) == self._get_topology(self._sonos_devices):
+			return False
+		self._sonos_devices = new_sonos_devices
+		self._sonos_coordinators = {}
+		return True
+
+	def _sonos_setup_changed(self, new_sonos_devices: SonosDevicesByName, changed: bool) -> None:
+		if not changed:
+			logger.debug('Sonos discovery completed. Sonos devices are unchanged.')
+			return
+		try:
+			unified = self._add_all_devices_to_one_zone(new_sonos_devices)
+			logger.info(f"Sonos devices changed (Groups unification took place: {unified}). "
+						f"New setup: {self._create_devices_description(new_sonos_devices)}.")
+			self._update_db_and_emit(new_sonos_devices, SendEvent.SONOS_SETUP)
+		except Exception:
+			logger.warning('Exception in unifying or emitting Sonos devices.', exc_info=True)
+		self._update_sonos_coordinators(new_sonos_devices)
+
+	@staticmethod
+	def _get_topology(sonos_devices: SonosDevicesByName) -> Dict[str, str]:
+		return {name: device.ip_address for name, device in sonos_devices.items()}
 
 	def _find_sonos_devices(self) -> SonosDevicesByName:
+		import soco
 		discovered = soco.discover()
 		if not discovered:
 			logger.warning('No Sonos zones found.')
@@ -129,10 +302,11 @@ class SonosEnvironment(StreamConsumer):
 			return True
 		return False
 
-	def _find_sonos_coordinators(self, sonos_devices: SonosDevicesByName) -> List[SoCo]:
-		coordinators = [device for device in sonos_devices.values() if device.is_coordinator]
-		if not coordinators:
-			raise ValueError('No Sonos coordinator device found. Found devices: {0}'.format(sonos_devices))
+	def _find_sonos_coordinators(self, sonos_devices: SonosDevicesByName) -> SonosDevicesByName:
+		is_coordinator = self._call_devices('Reading the group coordinator', sonos_devices,
+											lambda device: device.is_coordinator)
+		coordinators = {device_name: device for device_name, device in sonos_devices.items()
+						if is_coordinator.get(device_name)}
 		logger.debug('Found Sonos coordinator devices: %s', coordinators)
 		return coordinators
 
@@ -4,22 +4,36 @@ import re
 
 from random import randint
 from datetime import timedelta, datetime
-
-from pafy.backend_youtube_dl import YtdlPafy
-from pafy import get_playlist
+from typing import TYPE_CHECKING
 
 from . import *
 
+if TYPE_CHECKING:
+	from pafy.backend_youtube_dl import YtdlPafy
+
 URL = 'url'
 TYPE = 'track_type'
 STATUS = 'track_status'
 COVER_URL= 'cover_url'
 DURATION= 'duration'
+AVAILABLE = 'available'
 
 AVERAGE_TRACK_VALIDITY_IN_HOURS = 3
 
 logger = logging.getLogger(PlayerLoggerName.TRACK.value)
 
+
+# counts and traces the resolutions of YouTube videos and playlists by result
+@contextmanager
+def _youtube_resolution(resolution_type: str, url: str) -> Iterator[None]:
+	try:
+		with span('youtube resolve ' + resolution_type, url=url):
+			yield
+	except Exception:
+		increment(Metric.YOUTUBE_RESOLUTIONS, type=resolution_type, result='error')
+		raise
+	increment(Metric.YOUTUBE_RESOLUTIONS, type=resolution_type, result='success')
+
 @unique
 class TrackType(Enum):
 	YOU_TUBE = Source.YOUTUBE.value
@@ -66,6 +80,10 @@ class Track(PlayerObserver):
 	@abstractmethod
 	def create_vlc_media(self, vlc_instance) -> Any: raise NotImplementedError
 
+	# ID of the video of the track, None for tracks without video
+	def get_video_id(self) -> Optional[str]:
+		return None
+
 	def get_out_stream_url(self, reference_ip: str, reference_port=General.VLC_OUT_STREAM_DEFAULT_PORT) -> str:
 		if self._args.out_stream_url:
 			return self._args.out_stream_url
@@ -75,6 +93,19 @@ class Track(PlayerObserver):
 	@abstractmethod
 	def get_duration(self) -> int: raise NotImplementedError
 
+	def is_available(self) -> bool:
+		return True
+
+	# true if the property dict can be created without network access
+	def has_metadata(self) -> bool:
+		return True
+
+	def get_stream_expiration(self) -> datetime:
+		return None
+
+	def refresh_stream(self) -> None:
+		pass
+
 	def player_status_changed(self, previous_status: PlayerStatus, new_status: PlayerStatus, current_track: Track) -> None:
 		if current_track == self:
 			self._track_status = TrackStatus(new_status.value)
@@ -108,7 +139,12 @@ class Track(PlayerObserver):
 				COVER_URL: self.get_cover_url(),
 				TYPE: self.get_track_type().value,
 				STATUS: self._track_status.value,
-				DURATION: self.get_duration()}
+				DURATION: self.get_duration(),
+				AVAILABLE: self.is_available()}
+
+	# property dict of a track which is not resolved yet, shown as unavailable until it is resolved
+	def get_placeholder_property_dict(self) -> {}:
+		return dict(self.get_property_dict(), **{AVAILABLE: False})
 
 	def _save_and_emit_current_track(self) -> None:
 		properties = self.get_property_dict()
@@ -117,11 +153,21 @@ class Track(PlayerObserver):
 
 class YouTubeTrack(Track):
 
-	def __init__(self, args: Namespace, player: Player, track_status: TrackStatus, url: str, pafy: YtdlPafy):
+	def __init__(self, args: Namespace, player: Player, track_status: TrackStatus, url: str, pafy: YtdlPafy,
+				 metadata_cache: VideoMetadataCache, metadata: VideoMetadata = None,
+				 audio_cache: TranscodedAudioCache = None):
 		super().__init__(args, player, track_status)
 		self._url = url
 		self._pafy: YtdlPafy = pafy
-		self._expiration_timestamp = self._get_new_expiration_date()
+		self._metadata_cache = metadata_cache
+		self._audio_cache = audio_cache
+		self._metadata: VideoMetadata = metadata
+		self._available = True
+		if pafy or not metadata:
+			self._expiration_timestamp = self._get_new_expiration_date()
+		else:
+			# track created from cached metadata: the stream is resolved on first access to _pafy_data
+			self._expiration_timestamp = metadata.stream_expiration
 
 	def _get_new_expiration_date(self) -> datetime:
 		# YouTube stream URLs expire after a certain time, probably after one or two days.
@@ -139,13 +185,64 @@ class YouTubeTrack(Track):
 	@property
 	def _pafy_data(self) -> YtdlPafy:
 		if not self._pafy or self._is_expired():
-			self._pafy: YtdlPafy = YtdlPafy(self._url)
-			self._expiration_timestamp = self._get_new_expiration_date()
-			logger.info('Resolved youtube video (expires at: %s): %s', self._expiration_timestamp.isoformat(), self._pafy)
+			self._resolve()
 		return self._pafy
 
-	def __str__(self) -> str:
+	def _resolve(self) -> None:
+		from pafy.backend_youtube_dl import YtdlPafy
+		try:
+			with _youtube_resolution('video', self._url):
+				pafy = YtdlPafy(self._url)
+		except Exception:
+			self._available = False
+			raise
+		self._pafy = pafy
+		self._expiration_timestamp = self._get_new_expiration_date()
+		self._available = True
+		logger.info('Resolved youtube video (expires at: %s): %s', self._expiration_timestamp.isoformat(), self._pafy)
+		self._update_metadata()
+
+	def is_available(self) -> bool:
+		return self._available
+
+	def has_metadata(self) -> bool:
+		return self._metadata is not None or (self._pafy is not None and not self._is_expired())
+
+	# without network access, the URL (or video ID) of the track is shown as title
+	def get_placeholder_property_dict(self) -> {}:
+		return {'title': self._url,
+				'artist': '',
+				'author': '',
+				URL: self._url,
+				COVER_URL: '',
+				TYPE: self.get_track_type().value,
+				STATUS: self._track_status.value,
+				DURATION: 0,
+				AVAILABLE: False}
+
+	def get_stream_expiration(self) -> datetime:
 		if not self._pafy:
+			return None
+		return self._expiration_timestamp
+
+	def refresh_stream(self) -> None:
+		self._resolve()
+
+	@property
+	def _video_metadata(self) -> VideoMetadata:
+		if not self._metadata:
+			# resolving the pafy data updates the metadata, already present pafy data is converted lazily
+			self._pafy_data
+			if not self._metadata:
+				self._update_metadata()
+		return self._metadata
+
+	def _update_metadata(self) -> None:
+		self._metadata = VideoMetadata.from_pafy(self._pafy, self._expiration_timestamp)
+		self._metadata_cache.put(self._metadata)
+
+	def __str__(self) -> str:
+		if not self._pafy and not self._metadata:
 			return '<uninitialized track with URL or ID {}>'.format(self._url)
 		return super().__str__()
 
@@ -156,31 +253,45 @@ class YouTubeTrack(Track):
 		return self._determine_artist_and_title()[0]
 
 	def get_author(self) -> str:
-		return self._pafy_data.author
+		return self._video_metadata.author
 
 	def get_url(self) -> str:
-		return self._pafy_data.watchv_url
+		return self._video_metadata.watchv_url
 
 	def get_cover_url(self) -> str:
-		return self._pafy_data.bigthumbhd or self._pafy_data.bigthumb or self._pafy_data.thumb
+		return self._video_metadata.get_cover_url()
 
 	def get_track_type(self) -> TrackType:
 		return TrackType.YOU_TUBE
 
+	def get_video_id(self) -> str:
+		from pafy.backend_shared import extract_video_id
+		return extract_video_id(self._url)
+
 	def create_vlc_media(self, vlc_instance):
+		cached_audio_path = self._audio_cache.get_path(self.get_video_id()) if self._audio_cache else None
+		if cached_audio_path:
+			playback_command = self._audio_cache.get_playback_command()
+			logger.debug('Create new VLC media from cached audio %s with command: %s', cached_audio_path, playback_command)
+			return vlc_instance.media_new(cached_audio_path, playback_command)
+		with timed(Metric.TRACK_START_PHASE, phase='resolve'), span('resolve stream', url=self._url):
+			input_stream_url = self.get_audio_stream_url()
+		logger.debug('Create new VLC media from %s with command: %s', input_stream_url, self._args.vlc_command)
+		return vlc_instance.media_new(input_stream_url, self._args.vlc_command)
+
+	def get_audio_stream_url(self) -> str:
 		input_stream = self._get_best_stream()
 		logger.debug('Best audio stream of %s: %s (URL: %s)', self, input_stream, input_stream.url)
-		logger.debug('Create new VLC media from %s with command: %s', input_stream.url, self._args.vlc_command)
-		return vlc_instance.media_new(input_stream.url, self._args.vlc_command)
+		return input_stream.url
 
 	def get_duration(self) -> int:
-		return self._pafy_data.length * 1000
+		return self._video_metadata.length * 1000
 
 	def _get_best_stream(self) -> Any:
 		return self._pafy_data.getbestaudio()
 
 	def _determine_artist_and_title(self) -> (str, str):
-		title: str = self._pafy_data.title
+		title: str = self._video_metadata.title
 		if not title:
 			return self._strip_splits(['', self.get_author()])
 
@@ -241,28 +352,68 @@ class NullTrack(Track):
 		return 0
 
 class TrackFactory:
-	def __init__(self, args: Namespace, player: Player):
+	def __init__(self, args: Namespace, player: Player, metadata_cache: VideoMetadataCache,
+				 audio_cache: TranscodedAudioCache = None):
 		self._args = args
 		self._player = player
+		self._metadata_cache = metadata_cache
+		self._audio_cache = audio_cache
 
 	def create_youtube_track(self, url: str, track_status=TrackStatus.STOPPED, lazy_load=False) -> YouTubeTrack:
+		metadata = self._metadata_cache.get(url)
+		if metadata:
+			return YouTubeTrack(self._args, self._player, track_status, url, None, self._metadata_cache, metadata,
+								self._audio_cache)
 		pafy_data: YtdlPafy = None
 		if not lazy_load:
-			pafy_data = YtdlPafy(url)
-		return YouTubeTrack(self._args, self._player, track_status, url, pafy_data)
+			from pafy.backend_youtube_dl import YtdlPafy
+			with _youtube_resolution('video', url):
+				pafy_data = YtdlPafy(url)
+		return YouTubeTrack(self._args, self._player, track_status, url, pafy_data, self._metadata_cache,
+							audio_cache=self._audio_cache)
+
+	def create_youtube_track_from_metadata(self, metadata: VideoMetadata, track_status=TrackStatus.STOPPED) -> YouTubeTrack:
+		self._metadata_cache.put(metadata)
+		return YouTubeTrack(self._args, self._player, track_status, metadata.video_id, None, self._metadata_cache, metadata,
+							self._audio_cache)
 
 	def create_youtube_tracks_from_playlist(self, preprocessed_url: str) -> List[YouTubeTrack]:
-		playlist = get_playlist(preprocessed_url)
+		from pafy import get_playlist
+		with _youtube_resolution('playlist', preprocessed_url):
+			playlist = get_playlist(preprocessed_url)
 		playlist_items = playlist['items']
 		if not playlist_items:
 			logger.warning('Playlist at URL \'{}\' exists but does not contain any items. Resolved playlist: {}'
 							 .format(preprocessed_url, playlist))
 			return []
-		return [YouTubeTrack(self._args, self._player, TrackStatus.STOPPED, item['pafy'].videoid, item['pafy']) for item in playlist_items]
+		return [YouTubeTrack(self._args, self._player, TrackStatus.STOPPED, item['pafy'].videoid, item['pafy'],
+							 self._metadata_cache, audio_cache=self._audio_cache) for item in playlist_items]
 
 	def _create_youtube_track_from_dict(self, track_dict) -> YouTubeTrack:
 		return self.create_youtube_track(track_dict[URL], track_status=TrackStatus(track_dict[STATUS]))
 
+	# Creates the track from its stored property dict without network access: the metadata is taken from the
+	# metadata cache or rebuilt from the dict, the stream is resolved on first access (or by the refresh scheduler).
+	def track_from_stored_dict(self, track_dict) -> Track:
+		if TrackType(track_dict[TYPE]) == TrackType.NULL:
+			return self._player.get_null_track()
+		url = track_dict[URL]
+		metadata = self._metadata_cache.get(url) or self._metadata_from_track_dict(track_dict)
+		return YouTubeTrack(self._args, self._player, TrackStatus(track_dict[STATUS]), url, None, self._metadata_cache,
+							metadata, self._audio_cache)
+
+	@staticmethod
+	def _metadata_from_track_dict(track_dict) -> VideoMetadata:
+		from pafy.backend_shared import extract_video_id
+		# the title is split again into artist and title by the track
+		title = track_dict['title']
+		if track_dict['artist']:
+			title = '{} - {}'.format(track_dict['artist'], title)
+		# expired, such that the stream and the metadata are resolved on first access
+		return VideoMetadata(extract_video_id(track_dict[URL]), title, track_dict['author'],
+							 track_dict[DURATION] // 1000, track_dict[URL], {'bigthumbhd': track_dict[COVER_URL]},
+							 datetime.now())
+
 	def track_from_dict(self, track_dict) -> Track:
 		type = TrackType(track_dict[TYPE])
 		if type == TrackType.NULL:
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import time
+from datetime import datetime
+from threading import Condition
+
+from . import *
+
+REFRESH_MARGIN_IN_SECONDS = 15 * 60
+
+logger = logging.getLogger(PlayerLoggerName.TRACK_REFRESH_SCHEDULER.value)
+
+
+class TrackRefreshObserver(ABC):
+
+	@abstractmethod
+	def track_availability_changed(self, track: Track) -> None: raise NotImplementedError
+
+
+# Refreshes the streams of registered tracks in the background before they expire, such that playing or emitting
+# a track does not block on stream resolution. Tracks are refreshed in the order of their expiration timestamps
+# on at most number_of_workers workers of the resolution lane. Tracks scheduled as urgent (e.g. the current and the next track of the playlist)
+# are resolved immediately if they have not been resolved yet.
+class TrackRefreshScheduler(StoppableThread):
+
+	def __init__(self, number_of_workers: int, resolution_executor: WorkerLaneExecutor):
+		super().__init__(name='TrackRefreshSchedulerThread')
+		self._number_of_workers = number_of_workers
+		self._executor = resolution_executor
+		self._condition = Condition()
+		self._stopped = False
+		self._observers: Set[TrackRefreshObserver] = set()
+		self._registered_tracks: Set[Track] = set()
+		self._due_timestamps: Dict[Track, float] = {}
+		self._queue: List = []
+		self._sequence = itertools.count()
+		self._refreshing_tracks: Set[Track] = set()
+
+	def add_observer(self, observer: TrackRefreshObserver) -> None:
+		self._observers.add(observer)
+
+	def schedule(self, track: Track, urgent=False) -> None:
+		expiration: datetime = track.get_stream_expiration()
+		if expiration:
+			due_timestamp = expiration.timestamp() - REFRESH_MARGIN_IN_SECONDS
+		elif urgent:
+			due_timestamp = time.time()
+		else:
+			# unresolved tracks are resolved on demand
+			return
+		with self._condition:
+			self._registered_tracks.add(track)
+			if track in self._refreshing_tracks:
+				return
+			previous_due_timestamp = self._due_timestamps.get(track)
+			if previous_due_timestamp is not None and previous_due_timestamp <= due_timestamp:
+				return
+			self._due_timestamps[track] = due_timestamp
+			heapq.heappush(self._queue, (due_timestamp, next(self._sequence), track))
+			self._condition.notify()
+
+	def unschedule(self, track: Track) -> None:
+		with self._condition:
+			self._registered_tracks.discard(track)
+			self._due_timestamps.pop(track, None)
+
+	def stop(self) -> None:
+		with self._condition:
+			self._stopped = True
+			self._condition.notify()
+
+	def run(self) -> None:
+		while True:
+			with self._condition:
+				track = self._wait_for_due_track()
+				if not track:
+					break
+				self._refreshing_tracks.add(track)
+			self._executor.submit(self._refresh, track)
+
+	def _wait_for_due_track(self) -> Track:
+		while not self._stopped:
+			timeout = None
+			if len(self._refreshing_tracks) < self._number_of_workers:
+				track, timeout = self._pop_due_track()
+				if track:
+					return track
+			self._condition.wait(timeout)
+		return None
+
+	def _pop_due_track(self) -> (Track, float):
+		while self._queue:
+			due_timestamp, _, track = self._queue[0]
+			if self._due_timestamps.get(track) != due_timestamp:
+				# track was rescheduled or unscheduled
+				heapq.heappop(self._queue)
+				continue
+			wait_time = due_timestamp - time.time()
+			if wait_time > 0:
+				return None, wait_time
+			heapq.heappop(self._queue)
+			del self._due_timestamps[track]
+			return track, None
+		return None, None
+
+	def _refresh(self, track: Track) -> None:
+		was_available = track.is_available()
+		try:
+			track.refresh_stream()
+			logger.info('Refreshed stream of %s (expires at: %s)', track, track.get_stream_expiration())
+		except Exception:
+			logger.warning('Refreshing the stream of %s failed. Track is marked as unavailable.', track, exc_info=True)
+		finally:
+			with self._condition:
+				self._refreshing_tracks.discard(track)
+				registered = track in self._registered_tracks
+				self._condition.notify()
+		if registered and track.is_available():
+			self.schedule(track)
+		if was_available != track.is_available():
+			for observer in list(self._observers):
+				observer.track_availability_changed(track)
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import queue
+import re
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import TYPE_CHECKING
+
+from . import *
+
+if TYPE_CHECKING:
+	from vlc import Instance
+
+CACHE_FILE_SUFFIX = '.audio'
+PARTIAL_FILE_SUFFIX = '.partial'
+# transcoding of a track is aborted if it takes longer than its duration times this factor plus the fixed margin
+TRANSCODING_TIMEOUT_FACTOR = 2
+TRANSCODING_TIMEOUT_MARGIN_IN_SECONDS = 60
+TRANSCODING_POLL_INTERVAL_IN_SECONDS = 0.5
+BYTES_PER_MEGABYTE = 1024 * 1024
+
+logger = logging.getLogger(PlayerLoggerName.TRANSCODED_AUDIO_CACHE.value)
+
+
+class UpcomingTracksProvider(ABC):
+
+	@abstractmethod
+	def get_upcoming_tracks(self, count: int) -> List[Track]: raise NotImplementedError
+
+
+# Splits a VLC command of the form ':sout=#transcode{...}:<output chain>' into the options of the transcode module
+# and the output chain. Returns None for commands without transcoding.
+def split_transcode_command(vlc_command: str) -> Optional[Tuple[str, str]]:
+	prefix = ':sout=#transcode{'
+	if not vlc_command.startswith(prefix):
+		return None
+	depth = 1
+	for position in range(len(prefix), len(vlc_command)):
+		if vlc_command[position] == '{':
+			depth = depth + 1
+		elif vlc_command[position] == '}':
+			depth = depth - 1
+			if depth == 0:
+				output_chain = vlc_command[position + 1:]
+				if not output_chain.startswith(':'):
+					return None
+				return vlc_command[len(prefix):position], output_chain[1:]
+	return None
+
+
+def get_transcode_option(transcode_options: str, name: str) -> Optional[str]:
+	match = re.search(r'(?:^|,)' + name + r'=([^,{}]+)', transcode_options)
+	return match.group(1) if match else None
+
+
+# Disk cache of the audio of YouTube tracks transcoded with the transcode options of the VLC command, keyed by
+# video ID, codec and bitrate (and a digest of the remaining transcode options). Cached tracks are played from
+# the local file, VLC only serves the file with the output chain of the command, no download and no transcoding
+# takes place. Files are evicted in least recently used order if the cache exceeds max_size_in_bytes, the time of
+# the last use is kept as modification time of the files, such that the order survives restarts.
+#
+# The tracks are transcoded by a separate VLC instance in a background thread, one track at a time: the playing
+# track on a miss (for replays) and the next prefetch_count tracks of the playlist whenever the player starts playing.
+class TranscodedAudioCache(StoppableThread, PlayerObserver):
+
+	def __init__(self, cache_directory: str, max_size_in_megabytes: int, prefetch_count: int, vlc_command: str):
+		super().__init__(name='TranscodedAudioCacheThread')
+		self._cache_directory = cache_directory
+		self._max_size_in_bytes = max_size_in_megabytes * BYTES_PER_MEGABYTE
+		self._prefetch_count = prefetch_count
+		self._upcoming_tracks_provider: UpcomingTracksProvider = None
+		transcode_command = split_transcode_command(vlc_command)
+		self._enabled = self._max_size_in_bytes > 0 and transcode_command is not None
+		if not self._enabled:
+			if self._max_size_in_bytes > 0:
+				logger.warning('Transcoded audio cache disabled: VLC command without transcoding: %s', vlc_command)
+			return
+		self._transcode_options, self._output_chain = transcode_command
+		self._key_suffix = '.{}-{}.{}'.format(get_transcode_option(self._transcode_options, 'acodec') or 'audio',
+											  get_transcode_option(self._transcode_options, 'ab') or 'default',
+											  hashlib.sha1(self._transcode_options.encode('utf-8')).hexdigest()[:8])
+		self._lock = Lock()
+		# file sizes by key in least recently used order
+		self._files: OrderedDict[str, int] = OrderedDict()
+		self._size_in_bytes = 0
+		self._prefetch_queue: queue.Queue = queue.Queue()
+		self._queued_keys: Set[str] = set()
+		self._exit_event = Event()
+		self._statistics = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'transcoded': 0, 'transcoding_failures': 0,
+							'evictions': 0}
+		os.makedirs(cache_directory, exist_ok=True)
+		self._load_index()
+
+	def is_enabled(self) -> bool:
+		return self._enabled
+
+	def set_upcoming_tracks_provider(self, upcoming_tracks_provider: UpcomingTracksProvider) -> None:
+		self._upcoming_tracks_provider = upcoming_tracks_provider
+
+	def get_statistics(self) -> Dict[str, Any]:
+		if not self._enabled:
+			return {}
+		with self._lock:
+			lookups = self._statistics['hits'] + self._statistics['misses']
+			return dict(self._statistics, hit_rate=self._statistics['hits'] / lookups if lookups else 0.0,
+						files=len(self._files), size_in_bytes=self._size_in_bytes)
+
+	# VLC command to serve a cached file, i.e. the output chain of the command without transcoding
+	def get_playback_command(self) -> str:
+		return ':sout=#' + self._output_chain
+
+	# Returns the path of the cached audio of the video or None on a miss.
+	def get_path(self, video_id: str) -> Optional[str]:
+		if not self._enabled:
+			return None
+		key = video_id + self._key_suffix
+		with self._lock:
+			size = self._files.get(key)
+			if size is None:
+				self._statistics['misses'] = self._statistics['misses'] + 1
+				return None
+			self._files.move_to_end(key)
+			self._statistics['hits'] = self._statistics['hits'] + 1
+			self._statistics['bytes_saved'] = self._statistics['bytes_saved'] + size
+			logger.info('Transcoded audio cache hit for video %s (%d bytes). Statistics: %s', video_id, size,
+						self._get_statistics_summary())
+		path = self._get_path(key)
+		try:
+			os.utime(path)
+		except OSError:
+			logger.warning('Cached audio file %s is gone.', path)
+			self._remove(key)
+			return None
+		return path
+
+	def prefetch(self, tracks: List[Track]) -> None:
+		if not self._enabled:
+			return
+		for track in tracks:
+			video_id = track.get_video_id()
+			if not video_id:
+				continue
+			key = video_id + self._key_suffix
+			with self._lock:
+				if key in self._files or key in self._queued_keys:
+					continue
+				self._queued_keys.add(key)
+			logger.debug('Queued for transcoding into the audio cache: %s', track)
+			self._prefetch_queue.put((key, track))
+
+	def player_status_changed(self, previous_status: PlayerStatus, new_status: PlayerStatus, current_track: Track) -> None:
+		if new_status is not PlayerStatus.PLAYING or previous_status is PlayerStatus.PAUSED:
+			return
+		upcoming_tracks = []
+		if self._upcoming_tracks_provider:
+			upcoming_tracks = self._upcoming_tracks_provider.get_upcoming_tracks(self._prefetch_count)
+		# the playing track is cached for replays after the upcoming tracks
+		self.prefetch(upcoming_tracks + [current_track])
+
+	def stop(self) -> None:
+		if self._enabled:
+			self._exit_event.set()
+			self._prefetch_queue.put(None)
+
+	def run(self) -> None:
+		if not self._enabled:
+			return
+		from vlc import Instance
+		vlc_instance = Instance(['--no-video', '--quiet'])
+		while not self._exit_event.is_set():
+			queued = self._prefetch_queue.get()
+			if queued is None:
+				break
+			key, track = queued
+			try:
+				self._transcode(vlc_instance, key, track)
+			except Exception:
+				with self._lock:
+					self._statistics['transcoding_failures'] = self._statistics['transcoding_failures'] + 1
+				logger.warning('Transcoding %s into the audio cache failed.', track, exc_info=True)
+			finally:
+				with self._lock:
+					self._queued_keys.discard(key)
+		vlc_instance.release()
+
+	def _transcode(self, vlc_instance: Instance, key: str, track: Track) -> None:
+		from vlc import State
+		end_states = (State.Ended, State.Error, State.Stopped)
+		partial_path = self._get_path(key) + PARTIAL_FILE_SUFFIX
+		command = ':sout=#transcode{' + self._transcode_options + '}:standard{access=file,mux=raw,dst="' + \
+				  partial_path + '"}'
+		start_timestamp = time.monotonic()
+		media = vlc_instance.media_new(track.get_audio_stream_url(), command)
+		media_player = vlc_instance.media_player_new()
+		try:
+			media_player.set_media(media)
+			media_player.play()
+			timeout = track.get_duration() / 1000 * TRANSCODING_TIMEOUT_FACTOR + TRANSCODING_TIMEOUT_MARGIN_IN_SECONDS
+			state = media_player.get_state()
+			while state not in end_states and time.monotonic() - start_timestamp < timeout:
+				if self._exit_event.wait(TRANSCODING_POLL_INTERVAL_IN_SECONDS):
+					break
+				state = media_player.get_state()
+			media_player.stop()
+		finally:
+			media_player.release()
+			media.release()
+		if state is not State.Ended:
+			self._delete_file(partial_path)
+			raise ValueError('Transcoding ended in state {} after {:.1f} seconds.'.format(
+				state, time.monotonic() - start_timestamp))
+		os.replace(partial_path, self._get_path(key))
+		size = os.path.getsize(self._get_path(key))
+		with self._lock:
+			self._files[key] = size
+			self._size_in_bytes = self._size_in_bytes + size
+			self._statistics['transcoded'] = self._statistics['transcoded'] + 1
+		logger.info('Transcoded %s into the audio cache in %.1f seconds (%d bytes).', track,
+					time.monotonic() - start_timestamp, size)
+		self._evict()
+
+	def _evict(self) -> None:
+		while True:
+			with self._lock:
+				# the most recently added file is kept, even if it exceeds the max size on its own
+				if self._size_in_bytes <= self._max_size_in_bytes or len(self._files) <= 1:
+					return
+				key, size = self._files.popitem(last=False)
+				self._size_in_bytes = self._size_in_bytes - size
+				self._statistics['evictions'] = self._statistics['evictions'] + 1
+			logger.debug('Evicting least recently used file from the audio cache: %s (%d bytes)', key, size)
+			self._delete_file(self._get_path(key))
+
+	def _remove(self, key: str) -> None:
+		with self._lock:
+			size = self._files.pop(key, None)
+			if size is not None:
+				self._size_in_bytes = self._size_in_bytes - size
+
+	def _load_index(self) -> None:
+		files = []
+		for file_name in os.listdir(self._cache_directory):
+			path = os.path.join(self._cache_directory, file_name)
+			if file_name.endswith(PARTIAL_FILE_SUFFIX):
+				# left over by an interrupted transcoding
+				self._delete_file(path)
+			elif file_name.endswith(CACHE_FILE_SUFFIX):
+				stat = os.stat(path)
+				files.append((stat.st_mtime, file_name[:-len(CACHE_FILE_SUFFIX)], stat.st_size))
+		for _, key, size in sorted(files):
+			self._files[key] = size
+			self._size_in_bytes = self._size_in_bytes + size
+		logger.info('Transcoded audio cache in %s: %d files, %d of %d MB used.', self._cache_directory, len(self._files),
+					self._size_in_bytes // BYTES_PER_MEGABYTE, self._max_size_in_bytes // BYTES_PER_MEGABYTE)
+		self._evict()
+
+	def _get_path(self, key: str) -> str:
+		return os.path.join(self._cache_directory, key + CACHE_FILE_SUFFIX)
+
+	# must be called with the lock held
+	def _get_statistics_summary(self) -> str:
+		lookups = self._statistics['hits'] + self._statistics['misses']
+		return 'hit rate: {:.2f}, bytes saved: {}'.format(self._statistics['hits'] / lookups if lookups else 0.0,
+														  self._statistics['bytes_saved'])
+
+	@staticmethod
+	def _delete_file(path: str) -> None:
+		try:
+			os.remove(path)
+		except OSError:
+			pass
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from . import *
+
+if TYPE_CHECKING:
+	from pafy.backend_youtube_dl import YtdlPafy
+
+VIDEO_METADATA_KEY_PREFIX = General.APP_NAME + '_video_metadata:'
+VIDEO_METADATA_LRU_KEY = General.APP_NAME + '_video_metadata_lru'
+
+VIDEO_ID = 'video_id'
+TITLE = 'title'
+AUTHOR = 'author'
+LENGTH = 'length'
+WATCHV_URL = 'watchv_url'
+THUMBNAILS = 'thumbnails'
+STREAM_EXPIRATION = 'stream_expiration'
+
+logger = logging.getLogger(PlayerLoggerName.VIDEO_METADATA_CACHE.value)
+
+
+class VideoMetadata:
+
+	def __init__(self, video_id: str, title: str, author: str, length: int, watchv_url: str,
+				 thumbnails: Dict[str, str], stream_expiration: datetime):
+		self.video_id = video_id
+		self.title = title
+		self.author = author
+		self.length = length
+		self.watchv_url = watchv_url
+		self.thumbnails = thumbnails
+		self.stream_expiration = stream_expiration
+
+	@staticmethod
+	def from_pafy(pafy: YtdlPafy, stream_expiration: datetime) -> VideoMetadata:
+		thumbnails = {'bigthumbhd': pafy.bigthumbhd, 'bigthumb': pafy.bigthumb, 'thumb': pafy.thumb}
+		return VideoMetadata(pafy.videoid, pafy.title, pafy.author, pafy.length, pafy.watchv_url,
+							 thumbnails, stream_expiration)
+
+	@staticmethod
+	def from_dict(metadata_dict: Dict) -> VideoMetadata:
+		return VideoMetadata(metadata_dict[VIDEO_ID], metadata_dict[TITLE], metadata_dict[AUTHOR],
+							 metadata_dict[LENGTH], metadata_dict[WATCHV_URL], metadata_dict[THUMBNAILS],
+							 datetime.fromtimestamp(metadata_dict[STREAM_EXPIRATION]))
+
+	def to_dict(self) -> Dict:
+		return {VIDEO_ID: self.video_id,
+				TITLE: self.title,
+				AUTHOR: self.author,
+				LENGTH: self.length,
+				WATCHV_URL: self.watchv_url,
+				THUMBNAILS: self.thumbnails,
+				STREAM_EXPIRATION: self.stream_expiration.timestamp()}
+
+	def get_cover_url(self) -> str:
+		return self.thumbnails.get('bigthumbhd') or self.thumbnails.get('bigthumb') or self.thumbnails.get('thumb')
+
+	def __str__(self) -> str:
+		return '<video metadata of {}: \'{}\' of \'{}\'>'.format(self.video_id, self.title, self.author)
+
+
+# Persistent cache of YouTube video metadata keyed by video ID. Entries older than max_age_in_hours expire in redis,
+# entries exceeding max_size are evicted in least recently used order. The cache is best effort: redis errors are
+# logged and treated like misses. Entries are written on the persistence lane, they are not cached if the lane is
+# saturated.
+class VideoMetadataCache:
+
+	def __init__(self, db: redis.Redis, max_size: int, max_age_in_hours: int, persistence_executor: WorkerLaneExecutor):
+		self._db = db
+		self._persistence_executor = persistence_executor
+		self._max_size = max_size
+		self._max_age_in_seconds = max_age_in_hours * 60 * 60
+		self._statistics_lock = Lock()
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+
+	def get(self, url_or_video_id: str) -> VideoMetadata:
+		video_id = self._to_video_id(url_or_video_id)
+		if not video_id or self._max_size <= 0:
+			return None
+		try:
+			value = self._db.get(VIDEO_METADATA_KEY_PREFIX + video_id)
+			if not value:
+				# age based eviction is done by redis, the LRU index must be cleaned up by us
+				self._db.zrem(VIDEO_METADATA_LRU_KEY, video_id)
+				self._count(hit=False)
+				return None
+			self._db.zadd(VIDEO_METADATA_LRU_KEY, {video_id: time.time()})
+			metadata = VideoMetadata.from_dict(json.loads(value))
+			self._count(hit=True)
+			return metadata
+		except Exception:
+			logger.warning('Reading metadata of video \'%s\' from cache failed.', video_id, exc_info=True)
+			self._count(hit=False)
+			return None
+
+	def put(self, metadata: VideoMetadata) -> None:
+		if self._max_size <= 0:
+			return
+		if not self._persistence_executor.try_submit(self._write, metadata, json.dumps(metadata.to_dict())):
+			logger.debug('Persistence lane is saturated. %s is not cached.', metadata)
+
+	def _write(self, metadata: VideoMetadata, metadata_json: str) -> None:
+		try:
+			now = time.time()
+			pipeline = self._db.pipeline()
+			pipeline.set(VIDEO_METADATA_KEY_PREFIX + metadata.video_id, metadata_json, ex=self._max_age_in_seconds)
+			pipeline.zadd(VIDEO_METADATA_LRU_KEY, {metadata.video_id: now})
+			pipeline.zremrangebyscore(VIDEO_METADATA_LRU_KEY, 0, now - self._max_age_in_seconds)
+			pipeline.zcard(VIDEO_METADATA_LRU_KEY)
+			size = pipeline.execute()[-1]
+			if size > self._max_size:
+				self._evict(size - self._max_size)
+			logger.debug('Cached %s (cache size: %d)', metadata, min(size, self._max_size))
+		except Exception:
+			logger.warning('Writing %s to cache failed.', metadata, exc_info=True)
+
+	def get_statistics(self) -> Dict[str, int]:
+		with self._statistics_lock:
+			return {'hits': self._hits, 'misses': self._misses, 'evictions': self._evictions}
+
+	def _evict(self, count: int) -> None:
+		video_ids = self._db.zrange(VIDEO_METADATA_LRU_KEY, 0, count - 1)
+		if not video_ids:
+			return
+		pipeline = self._db.pipeline()
+		pipeline.delete(*[VIDEO_METADATA_KEY_PREFIX + self._decode(video_id) for video_id in video_ids])
+		pipeline.zrem(VIDEO_METADATA_LRU_KEY, *video_ids)
+		pipeline.execute()
+		with self._statistics_lock:
+			self._evictions = self._evictions + len(video_ids)
+		logger.debug('Evicted %d least recently used entries from video metadata cache.', len(video_ids))
+
+	def _count(self, hit: bool) -> None:
+		with self._statistics_lock:
+			if hit:
+				self._hits = self._hits + 1
+			else:
+				self._misses = self._misses + 1
+			logger.debug('Video metadata cache hits: %d, misses: %d', self._hits, self._misses)
+
+	@staticmethod
+	def _to_video_id(url_or_video_id: str) -> str:
+		from pafy.backend_shared import extract_video_id
+		try:
+			return extract_video_id(url_or_video_id)
+		except ValueError:
+			return None
+
+	@staticmethod
+	def _decode(value: Union[bytes, str]) -> str:
+		if isinstance(value, bytes):
+			return value.decode()
+		return value
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import contextvars
+import time
+from concurrent.futures import Executor, Future
+from concurrent.futures.thread import ThreadPoolExecutor
+from threading import BoundedSemaphore, Condition, Lock
+from typing import Optional
+
+from . import *
+
+logger = logging.getLogger(PlayerLoggerName.WORKER_POOL.value)
+
+
+@unique
+class WorkerLane(Enum):
+	# resolution of YouTube streams and metadata (youtube-dl and YouTube API calls)
+	RESOLUTION = 'resolution'
+	# coordination of search tasks, which wait for results of the resolution lane
+	SEARCH = 'search'
+	# writes to redis
+	PERSISTENCE = 'persistence'
+	# calls to Sonos devices
+	SONOS_IO = 'sonos_io'
+	# handling of commands received from clients
+	COMMAND = 'command'
+
+
+# Executor of one lane of the worker pool. At most max_workers tasks run concurrently and at most max_queue_size
+# tasks wait for a worker. Submitters block while the lane is saturated (backpressure), try_submit(...) returns None
+# instead of blocking.
+class WorkerLaneExecutor(Executor):
+
+	def __init__(self, lane: WorkerLane, max_workers: int, max_queue_size: int):
+		self._lane = lane
+		self._max_workers = max_workers
+		self._max_queue_size = max_queue_size
+		self._executor = ThreadPoolExecutor(max_workers=max_workers,
+											thread_name_prefix='WorkerLane-{}-Thread'.format(lane.value))
+		self._slots = BoundedSemaphore(max_workers + max_queue_size)
+		self._lock = Lock()
+		self._creation_timestamp = time.time()
+		self._pending = 0
+		self._running = 0
+		self._submitted = 0
+		self._started = 0
+		self._completed = 0
+		self._failed = 0
+		self._cancelled = 0
+		self._rejected = 0
+		self._blocked_submissions = 0
+		self._busy_time_in_seconds = 0.0
+		self._wait_time_in_seconds = 0.0
+
+	@property
+	def lane(self) -> WorkerLane:
+		return self._lane
+
+	@property
+	def max_workers(self) -> int:
+		return self._max_workers
+
+	def submit(self, fn: Callable, *args, **kwargs) -> Future:
+		if not self._slots.acquire(blocking=False):
+			with self._lock:
+				self._blocked_submissions = self._blocked_submissions + 1
+			logger.debug('Worker lane \'%s\' is saturated. Submitter waits for a free slot.', self._lane.value)
+			self._slots.acquire()
+		return self._submit(fn, args, kwargs)
+
+	def try_submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+		if not self._slots.acquire(blocking=False):
+			with self._lock:
+				self._rejected = self._rejected + 1
+			logger.debug('Worker lane \'%s\' is saturated. Task is rejected.', self._lane.value)
+			return None
+		return self._submit(fn, args, kwargs)
+
+	def shutdown(self, wait=True) -> None:
+		self._executor.shutdown(wait=wait)
+
+	def get_statistics(self) -> Dict[str, IntOrStr]:
+		with self._lock:
+			elapsed_time_in_seconds = max(time.time() - self._creation_timestamp, 1e-9)
+			return {'max_workers': self._max_workers,
+					'max_queue_size': self._max_queue_size,
+					'running': self._running,
+					'queued': self._pending - self._running,
+					'submitted': self._submitted,
+					'completed': self._completed,
+					'failed': self._failed,
+					'cancelled': self._cancelled,
+					'rejected': self._rejected,
+					'blocked_submissions': self._blocked_submissions,
+					'utilization': self._running / self._max_workers,
+					'mean_utilization': self._busy_time_in_seconds / (elapsed_time_in_seconds * self._max_workers),
+					'mean_wait_time_in_seconds': self._wait_time_in_seconds / self._started if self._started else 0.0}
+
+	def _submit(self, fn: Callable, args, kwargs) -> Future:
+		submission_timestamp = time.time()
+		# tasks run in the context of the submitter, e.g. in its trace
+		context = contextvars.copy_context()
+		def run():
+			start_timestamp = time.time()
+			with self._lock:
+				self._running = self._running + 1
+				self._started = self._started + 1
+				self._wait_time_in_seconds = self._wait_time_in_seconds + start_timestamp - submission_timestamp
+			try:
+				return context.run(fn, *args, **kwargs)
+			finally:
+				with self._lock:
+					self._running = self._running - 1
+					self._busy_time_in_seconds = self._busy_time_in_seconds + time.time() - start_timestamp
+		with self._lock:
+			self._pending = self._pending + 1
+			self._submitted = self._submitted + 1
+		try:
+			future = self._executor.submit(run)
+		except Exception:
+			self._task_done(None)
+			raise
+		# invoked on completion as well as on cancellation of queued tasks
+		future.add_done_callback(self._task_done)
+		return future
+
+	def _task_done(self, future: Optional[Future]) -> None:
+		with self._lock:
+			self._pending = self._pending - 1
+			if future is None:
+				self._submitted = self._submitted - 1
+			elif future.cancelled():
+				self._cancelled = self._cancelled + 1
+			elif future.exception():
+				self._failed = self._failed + 1
+			else:
+				self._completed = self._completed + 1
+		self._slots.release()
+
+
+# Owns all worker threads of the player process. Work is submitted to named lanes of bounded size, such that
+# e.g. loading a large playlist can not starve searches or spawn an unbounded number of youtube-dl processes.
+# The statistics of all lanes are published in redis every statistics_interval_in_seconds.
+class WorkerPoolGovernor(StoppableThread):
+
+	def __init__(self, lane_sizes: Dict[WorkerLane, int], max_queue_size: int, statistics_interval_in_seconds: int):
+		super().__init__(name='WorkerPoolGovernorThread')
+		self._lanes = {lane: WorkerLaneExecutor(lane, lane_sizes[lane], max_queue_size) for lane in WorkerLane}
+		self._statistics_interval_in_seconds = statistics_interval_in_seconds
+		self._condition = Condition()
+		self._stopped = False
+
+	def lane(self, lane: WorkerLane) -> WorkerLaneExecutor:
+		return self._lanes[lane]
+
+	def get_statistics(self) -> Dict[str, Dict[str, IntOrStr]]:
+		return {lane.value: executor.get_statistics() for lane, executor in self._lanes.items()}
+
+	def stop(self) -> None:
+		with self._condition:
+			self._stopped = True
+			self._condition.notify()
+
+	def run(self) -> None:
+		try:
+			while True:
+				with self._condition:
+					self._condition.wait_for(lambda: self._stopped, timeout=self._statistics_interval_in_seconds)
+					if self._stopped:
+						break
+				try:
+					statistics = self.get_statistics()
+					logger.debug('Worker pool statistics: %s', statistics)
+					save_in_db(DbKey.WORKER_POOL_STATISTICS, statistics)
+				except Exception:
+					logger.warning('Publishing worker pool statistics failed.', exc_info=True)
+		finally:
+			for executor in self._lanes.values():
+				executor.shutdown(wait=False)
@@ -2,20 +2,36 @@ from __future__ import annotations
 
 import json
 import logging
+import pickle
 import socket
+import time
 import redis
+import socketio
 
 from abc import ABC, abstractmethod
 from argparse import Namespace
-from flask_socketio import SocketIO
-from threading import Thread, Event
-from typing import Any, Dict, Callable, Iterable, Iterator, List, Set, ValuesView, TypeVar, Union
+from contextlib import contextmanager
+from redis.client import Pipeline
+from threading import Thread, Event, local
+from typing import Any, Deque, Dict, Callable, Iterable, Iterator, List, Optional, Set, Tuple, ValuesView, TypeVar, Union
 
+from Codec import CodecName, set_codec, encode, decode
+from CommandBus import CommandTransport, get_unique_consumer_name, publish_command
+from Metrics import Metric, MetricsReporter, increment, observe, set_gauge, timed
+from Tracing import SpanContext, SpanKind, create_span_exporter, new_trace_id, record_span, span, start_trace
+from PlaylistStorage import PlaylistStorage
 from Constants import *
 from Util import StoppableThread
 
 _db = None
 _socket = None
+_command_transport = CommandTransport.PUBSUB
+# state writes and emits of the current thread while a write batch is open, see write_batch()
+_write_batch = local()
+_round_trip_counter = local()
+
+# default channel of the message queue of Flask-SocketIO, which the server listens on
+SOCKETIO_MESSAGE_QUEUE_CHANNEL = 'flask-socketio'
 
 logger = logging.getLogger(PlayerLoggerName.UTIL.value)
 
@@ -24,34 +40,119 @@ IntOrStr = Union[int, str]
 PropDict = Dict[str, IntOrStr]
 
 
+# Redis client which counts the round trips to redis of the calling thread (a pipeline counts as one round trip)
+class RoundTripCountingRedis(redis.Redis):
+
+	def execute_command(self, *args, **options):
+		_count_round_trip()
+		return super().execute_command(*args, **options)
+
+	def pipeline(self, transaction=True, shard_hint=None) -> Pipeline:
+		return RoundTripCountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class RoundTripCountingPipeline(Pipeline):
+
+	def execute(self, raise_on_error=True):
+		_count_round_trip()
+		return super().execute(raise_on_error=raise_on_error)
+
+
+def _count_round_trip() -> None:
+	_round_trip_counter.value = get_redis_round_trips() + 1
+
+
+def get_redis_round_trips() -> int:
+	return getattr(_round_trip_counter, 'value', 0)
+
+
+# Socket.io client manager of the player, which only publishes on the message queue of the server. While a write
+# batch is open, messages are published on the pipeline of the batch instead of a separate connection.
+class WriteBatchRedisManager(socketio.RedisManager):
+
+	def _publish(self, data):
+		pipeline = getattr(_write_batch, 'pipeline', None)
+		if pipeline is None:
+			return super()._publish(data)
+		pipeline.publish(self.channel, pickle.dumps(data))
+
+
+# State writes (SET and invalidation of the server's state snapshot) and emits within a write batch are sent to
+# redis in one MULTI / EXEC transaction when the outermost batch of the thread is closed. Hence, a state change is
+# either stored and published to the clients or neither, and all changes raised by a command take one round trip.
+@contextmanager
+def write_batch() -> Iterator[Pipeline]:
+	pipeline = getattr(_write_batch, 'pipeline', None)
+	if pipeline is not None:
+		yield pipeline
+		return
+	pipeline = _db.pipeline(transaction=True)
+	_write_batch.pipeline = pipeline
+	try:
+		yield pipeline
+	finally:
+		_write_batch.pipeline = None
+		# state changes of a failed command happened nevertheless and are flushed as well
+		if len(pipeline) > 0:
+			logger.debug('Flushing write batch with %d redis commands.', len(pipeline))
+			try:
+				with span('flush write batch', commands=len(pipeline)):
+					pipeline.execute()
+			except redis.RedisError:
+				logger.exception('Flushing write batch with %d redis commands failed.', len(pipeline))
+			finally:
+				pipeline.reset()
+
+
+# Write batch which is flushed when it is closed, even within an open write batch of the thread. Changes which must
+# reach redis in the order they were made (e.g. the versions of the playlist, flushed while the lock of the playlist
+# is held) must not be deferred to the outer batch, writes of other threads could overtake them.
+@contextmanager
+def isolated_write_batch() -> Iterator[Pipeline]:
+	outer_pipeline = getattr(_write_batch, 'pipeline', None)
+	_write_batch.pipeline = None
+	try:
+		with write_batch() as pipeline:
+			yield pipeline
+	finally:
+		_write_batch.pipeline = outer_pipeline
+
+
 def save_in_db(key: DbKey, payload):
 	logger.debug("Save to db. key: '%s' | value: %s", key.value, payload)
-	_db.set(key.value, json.dumps(payload))
+	with write_batch() as pipeline:
+		pipeline.set(key.value, encode(payload))
+		invalidate_state(key)
+
+
+# the server caches values for connecting clients and is notified about the change
+def invalidate_state(key: DbKey) -> None:
+	with write_batch() as pipeline:
+		pipeline.publish(General.QUEUE_CHANNEL_NAME_STATE_INVALIDATION, key.value)
 
 
 def read_list_from_db(key: DbKey) -> Any:
 	value = _db.get(key.value)
 	if value:
-		return json.loads(value)
+		return decode(value)
 	return []
 
 
 def emit(event: SendEvent, dict, sid=None, skip_sid=None):
 	logger.debug("Emit event: '%s' | sid: '%s' | skip_sid: '%s' | payload: %s", event.value, sid, skip_sid, dict)
-	_socket.emit(event.value, dict, room=sid, skip_sid=skip_sid)
+	with write_batch(), span('emit', event=event.value):
+		_socket.emit(event.value, dict, room=sid, skip_sid=skip_sid)
 
 
 def save_and_emit(key: DbKey, event: SendEvent, payload, sid=None, skip_sid=None):
-	save_in_db(key, payload)
-	emit(event, payload, sid=sid, skip_sid=skip_sid)
+	with write_batch():
+		save_in_db(key, payload)
+		emit(event, payload, sid=sid, skip_sid=skip_sid)
 
 
 def publish_on_player_command_channel(event: ReceiveEvent, data):
 	logger.debug("Publishing internal event '%s' on redis. payload %s", event.value, data)
-	_db.publish(General.QUEUE_CHANNEL_NAME_PLAYER_COMMANDS,
-				json.dumps({General.EVENT_NAME: event.value,
-								General.EVENT_PAYLOAD: data,
-								General.SID: None}))
+	publish_command(_db, _command_transport, General.QUEUE_CHANNEL_NAME_PLAYER_COMMANDS, event.value, data, None)
 
 
 def get_own_ip(reference_ip="8.8.8.8", reference_port=80) -> str:
@@ -70,36 +171,176 @@ def get_own_ip(reference_ip="8.8.8.8", reference_port=80) -> str:
 		s.close()
 
 
+from .IndexedSequence import IndexedSequence, IndexedSequenceNode
+from .WorkerPool import WorkerPoolGovernor, WorkerLane, WorkerLaneExecutor
+from .SonosDiscovery import SonosDiscoveryMode, SsdpListener, SsdpObserver
 from .SonosEnvironment import SonosEnvironment, StreamConsumer
-from .Player import Player, PlayerObserver, PlayerStatus
-from .Track import Track, TrackStatus, NullTrack, TrackFactory, URL
+from .ContinuousStream import ContinuousStream, ContinuousStreamConsumer, OutputStreamMode
+from .PlaybackClock import PlaybackClock
+from .Player import Player, PlayerObserver, PlayerStatus, NextTrackProvider
+from .TranscodedAudioCache import TranscodedAudioCache, UpcomingTracksProvider
+from .VideoMetadataCache import VideoMetadata, VideoMetadataCache
+from .Track import Track, TrackStatus, NullTrack, TrackFactory, URL, AVAILABLE
+from .TrackRefreshScheduler import TrackRefreshScheduler, TrackRefreshObserver
+from .PlaylistEntry import PlaylistEntry, PlaylistEntryFactory, PlaylistEntryStatus, ID, STATUS, TRACK, TRACK_STATUS
 from .Playlist import Playlist
-from .PlaylistEntry import PlaylistEntry, PlaylistEntryFactory, PlaylistEntryStatus, ID, STATUS
 from .EventConsumer import EventConsumer, PlayerEventsConsumer, SearchEventConsumer
-from .SearchService import SearchService
+from .SearchResultCache import SearchResultCache, SearchResultCacheEntry
+from .SearchService import SearchService, KeywordSearchMetadataSource
 
 
 def initialize(args: Namespace) -> List[StoppableThread]:
-	global _db
-	_db = redis.from_url(args.redis_url)
-	global _socket
-	_socket = SocketIO(message_queue=args.redis_url,
-					   logger=logging.getLogger(PlayerLoggerName.SOCKETIO.value),
-					   engineio_logger=logging.getLogger(PlayerLoggerName.ENGINEIO.value),
-					   # FIXME probably meaningless arg
-					   log=logging.getLogger(PlayerLoggerName.EVENTLET.value))
-	sonos_environment = SonosEnvironment()
+	start_time = time.monotonic()
+	_initialize_connections(args)
+	span_exporter_threads = _start_span_exporter(args, 'player')
+	worker_pool = _create_worker_pool(args)
+	resolution_executor = worker_pool.lane(WorkerLane.RESOLUTION)
+	sonos_environment = SonosEnvironment(SonosDiscoveryMode(args.sonos_discovery), args.sonos_discovery_interval,
+										 worker_pool.lane(WorkerLane.SONOS_IO), args.sonos_call_timeout)
 	sonos_env_monitoring_thread = sonos_environment.start_sonos_environment_monitoring()
-	player = Player(args, sonos_environment)
-	track_factory = TrackFactory(args, player)
-	playlist_entry_factory = PlaylistEntryFactory(track_factory)
-	playlist = Playlist(playlist_entry_factory)
+	stream_consumer, continuous_stream = _create_stream_consumer(args, sonos_environment)
+	player = Player(args, stream_consumer, resolution_executor)
+	audio_cache = TranscodedAudioCache(args.audio_cache_dir, args.audio_cache_size, args.audio_cache_prefetch,
+									   args.vlc_command)
+	audio_cache.start()
+	video_metadata_cache = VideoMetadataCache(_db, args.video_metadata_cache_size, args.video_metadata_cache_max_age,
+											  worker_pool.lane(WorkerLane.PERSISTENCE))
+	track_factory = TrackFactory(args, player, video_metadata_cache, audio_cache)
+	playlist_entry_factory = PlaylistEntryFactory(track_factory, resolution_executor)
+	track_refresh_scheduler = TrackRefreshScheduler(args.track_refresh_workers, resolution_executor)
+	track_refresh_scheduler.start()
+	playlist = Playlist(playlist_entry_factory, track_refresh_scheduler, resolution_executor, PlaylistStorage(_db))
+	track_refresh_scheduler.add_observer(playlist)
 	player.add_terminal_observer(playlist)
-	player_events_consumer = PlayerEventsConsumer(args, sonos_environment, player, track_factory, playlist)
+	player.set_next_track_provider(playlist)
+	player.add_terminal_observer(audio_cache)
+	audio_cache.set_upcoming_tracks_provider(playlist)
+	player_events_consumer = PlayerEventsConsumer(args, sonos_environment, player, track_factory, playlist,
+												  worker_pool.lane(WorkerLane.COMMAND))
 	player_events_consumer.start()
-	search_service = SearchService(track_factory, args.youtube_api_key, args.max_keyword_search_results)
-	search_event_consumer = SearchEventConsumer(args, search_service)
-	search_event_consumer.start()
-	playlist.read_playlist_from_db()
-	return [sonos_env_monitoring_thread, player_events_consumer, search_event_consumer]
+	search_result_cache = _create_search_result_cache(args, worker_pool)
+	search_event_consumer = _start_search_event_consumer(args, track_factory, search_result_cache, worker_pool)
+	playlist.read_playlist_from_db(args.fast_start)
+	logger.info('Player ready after %.2f seconds (playlist entries: %d, fast start: %s).',
+				time.monotonic() - start_time, len(playlist), args.fast_start)
+	logger.info('Video metadata cache statistics after loading the playlist: %s', video_metadata_cache.get_statistics())
+	collectors = [lambda: _collect_sonos_call_metrics(sonos_environment),
+				  lambda: _collect_statistics(Metric.AUDIO_CACHE, audio_cache.get_statistics()),
+				  lambda: _collect_statistics(Metric.SEARCH_RESULT_CACHE, search_result_cache.get_statistics())]
+	stream_threads = []
+	if continuous_stream:
+		collectors.append(lambda: _collect_statistics(Metric.CONTINUOUS_STREAM, continuous_stream.get_statistics()))
+		stream_threads.append(continuous_stream)
+	metrics_reporter = _start_metrics_reporter(args, 'player', worker_pool, collectors)
+	return [sonos_env_monitoring_thread, track_refresh_scheduler, player_events_consumer, search_event_consumer,
+			worker_pool, audio_cache, metrics_reporter] + stream_threads + span_exporter_threads
+
+
+def _create_stream_consumer(args: Namespace,
+							sonos_environment: SonosEnvironment) -> Tuple[StreamConsumer, Optional[ContinuousStream]]:
+	if OutputStreamMode(args.output_stream_mode) is OutputStreamMode.PER_TRACK:
+		return sonos_environment, None
+	if args.vlc_command == General.VLC_TRANSCODE_CMD:
+		# VLC serves the stream of the current track locally, the continuous stream is served on the default port
+		args.vlc_command = General.VLC_CONTINUOUS_TRANSCODE_CMD
+	continuous_stream = ContinuousStream(General.VLC_OUT_STREAM_DEFAULT_PORT, General.OUT_STREAM_NAME,
+										 args.continuous_stream_source_url)
+	continuous_stream.start()
+	return ContinuousStreamConsumer(continuous_stream, sonos_environment), continuous_stream
+
+
+# A search worker only handles search commands. Additional search workers can be run in separate processes
+# if commands are transported over redis streams.
+def initialize_search_worker(args: Namespace) -> List[StoppableThread]:
+	_initialize_connections(args)
+	span_exporter_threads = _start_span_exporter(args, 'search_worker')
+	worker_pool = _create_worker_pool(args)
+	video_metadata_cache = VideoMetadataCache(_db, args.video_metadata_cache_size, args.video_metadata_cache_max_age,
+											  worker_pool.lane(WorkerLane.PERSISTENCE))
+	# tracks of search results are never played by a search worker
+	track_factory = TrackFactory(args, None, video_metadata_cache)
+	search_result_cache = _create_search_result_cache(args, worker_pool)
+	search_event_consumer = _start_search_event_consumer(args, track_factory, search_result_cache, worker_pool)
+	metrics_reporter = _start_metrics_reporter(args, 'search_worker', worker_pool, [
+		lambda: _collect_statistics(Metric.SEARCH_RESULT_CACHE, search_result_cache.get_statistics())])
+	return [search_event_consumer, worker_pool, metrics_reporter] + span_exporter_threads
+
+
+def _initialize_connections(args: Namespace) -> None:
+	global _db
+	_db = RoundTripCountingRedis.from_url(args.redis_url)
+	global _socket
+	# write only socket.io server, which emits to the clients of the server process via the message queue
+	_socket = socketio.Server(client_manager=WriteBatchRedisManager(args.redis_url,
+																	channel=SOCKETIO_MESSAGE_QUEUE_CHANNEL,
+																	write_only=True),
+							  logger=logging.getLogger(PlayerLoggerName.SOCKETIO.value),
+							  engineio_logger=logging.getLogger(PlayerLoggerName.ENGINEIO.value))
+	global _command_transport
+	_command_transport = CommandTransport(args.command_transport)
+	set_codec(CodecName(args.codec))
+
+
+def _create_worker_pool(args: Namespace) -> WorkerPoolGovernor:
+	worker_pool = WorkerPoolGovernor({WorkerLane.RESOLUTION: args.resolution_workers,
+									  WorkerLane.SEARCH: args.search_workers,
+									  WorkerLane.PERSISTENCE: args.persistence_workers,
+									  WorkerLane.SONOS_IO: args.sonos_io_workers,
+									  WorkerLane.COMMAND: args.command_workers},
+									 args.worker_queue_size, args.worker_pool_statistics_interval)
+	worker_pool.start()
+	return worker_pool
+
 
+# the metrics of the process are exposed by the server, the queue depths of the lanes and the statistics of the
+# components (by the given collectors) are sampled on each flush
+def _start_metrics_reporter(args: Namespace, process_type: str, worker_pool: WorkerPoolGovernor,
+							collectors: List[Callable[[], None]]) -> MetricsReporter:
+	metrics_reporter = MetricsReporter(_db, '{}-{}'.format(process_type, get_unique_consumer_name()),
+									   args.metrics_flush_interval)
+	metrics_reporter.add_collector(lambda: _collect_worker_pool_metrics(worker_pool))
+	for collector in collectors:
+		metrics_reporter.add_collector(collector)
+	metrics_reporter.start()
+	return metrics_reporter
+
+
+def _start_span_exporter(args: Namespace, process_type: str) -> List[StoppableThread]:
+	span_exporter = create_span_exporter('{}-{}'.format(General.APP_NAME, process_type), args.trace_file,
+										 args.trace_otlp_endpoint)
+	if not span_exporter:
+		return []
+	span_exporter.start()
+	return [span_exporter]
+
+
+def _collect_worker_pool_metrics(worker_pool: WorkerPoolGovernor) -> None:
+	for lane, statistics in worker_pool.get_statistics().items():
+		set_gauge(Metric.EXECUTOR_QUEUED_TASKS, statistics['queued'], lane=lane)
+		set_gauge(Metric.EXECUTOR_RUNNING_TASKS, statistics['running'], lane=lane)
+
+
+def _collect_sonos_call_metrics(sonos_environment: SonosEnvironment) -> None:
+	for device_name, statistics in sonos_environment.get_call_statistics().items():
+		_collect_statistics(Metric.SONOS_CALLS, statistics, device=device_name)
+
+
+# each statistic of a component is sampled as a gauge labeled with the name of the statistic
+def _collect_statistics(metric: Metric, statistics: Dict[str, float], **labels: str) -> None:
+	for statistic, value in statistics.items():
+		set_gauge(metric, value, statistic=statistic, **labels)
+
+
+def _create_search_result_cache(args: Namespace, worker_pool: WorkerPoolGovernor) -> SearchResultCache:
+	return SearchResultCache(_db, args.search_result_cache_size, args.search_result_cache_ttl,
+							 worker_pool.lane(WorkerLane.PERSISTENCE))
+
+
+def _start_search_event_consumer(args: Namespace, track_factory: TrackFactory, search_result_cache: SearchResultCache,
+								 worker_pool: WorkerPoolGovernor) -> SearchEventConsumer:
+	search_service = SearchService(track_factory, args.youtube_api_key, args.max_keyword_search_results,
+								   search_result_cache, KeywordSearchMetadataSource(args.keyword_search_metadata_source),
+								   worker_pool)
+	search_event_consumer = SearchEventConsumer(args, search_service, worker_pool.lane(WorkerLane.COMMAND))
+	search_event_consumer.start()
+	return search_event_consumer
@@ -1,29 +1,55 @@
+import json
 import logging
 import os
+from typing import Optional
 
 import redis
 from argparse import Namespace
-from flask import Flask, send_from_directory, render_template
+from flask import Flask, Response, send_from_directory, render_template
 from flask_socketio import SocketIO
 
-from Constants import General, ServerLoggerName
+from Codec import CodecName, set_codec
+from CommandBus import CommandTransport
+from Metrics import render_prometheus_metrics
+from Tracing import create_span_exporter
+from PlaylistStorage import PlaylistStorage
+from Constants import General, ServerLoggerName, DbKey
+from server.state_snapshot import StateSnapshotCache, PreSerializedPayloadJson
 
 REACT_APP_LOCATION = 'client/build'
 PARENT_REACT_APP_LOCATION = '../' + REACT_APP_LOCATION
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
 
 socketio = SocketIO(logger=logging.getLogger(ServerLoggerName.SOCKETIO.value),
 					engineio_logger=logging.getLogger(ServerLoggerName.ENGINEIO.value),
-					cors_allowed_origins='*')
+					cors_allowed_origins='*',
+					json=PreSerializedPayloadJson)
 
 redis_db = None
+command_transport = CommandTransport.PUBSUB
+state_snapshot_cache = None
 
 
 def create_app(args: Namespace):
 	global redis_db
-	redis_db = redis.from_url(args.redis_url, decode_responses=True)
+	# responses are not decoded, values may be encoded with a binary codec
+	redis_db = redis.from_url(args.redis_url)
+	set_codec(CodecName(args.codec))
+	global command_transport
+	command_transport = CommandTransport(args.command_transport)
+	global state_snapshot_cache
+	playlist_storage = PlaylistStorage(redis_db)
+	state_snapshot_cache = StateSnapshotCache(redis_db, [DbKey.SONOS_SETUP, DbKey.CURRENT_TRACK, DbKey.PLAYER_STATE,
+														 DbKey.PLAYLIST, DbKey.PLAYBACK_CLOCK],
+											  {DbKey.PLAYLIST: lambda: _read_playlist_snapshot(playlist_storage)})
 
 	app = Flask(__name__, static_folder=PARENT_REACT_APP_LOCATION, template_folder=PARENT_REACT_APP_LOCATION)
 
+	# metrics of the player and the search workers in the Prometheus text format
+	@app.route('/metrics')
+	def metrics():
+		return Response(render_prometheus_metrics(redis_db), content_type=PROMETHEUS_CONTENT_TYPE)
+
 	# Serve React App
 	@app.route('/', defaults={'path': ''})
 	@app.route('/<path:path>')
@@ -35,4 +61,13 @@ def create_app(args: Namespace):
 
 	from . import events
 	socketio.init_app(app, message_queue=args.redis_url)
+	socketio.start_background_task(state_snapshot_cache.listen)
+	span_exporter = create_span_exporter(General.APP_NAME + '-server', args.trace_file, args.trace_otlp_endpoint)
+	if span_exporter:
+		socketio.start_background_task(span_exporter.run)
 	return app
+
+
+def _read_playlist_snapshot(playlist_storage: PlaylistStorage) -> Optional[str]:
+	snapshot = playlist_storage.read_snapshot()
+	return json.dumps(snapshot) if snapshot is not None else None
@@ -1,27 +1,53 @@
 import json
 import logging
+import time
+from typing import Dict
 
 import flask
 from flask_socketio import emit
 
+from CommandBus import publish_command
+from Tracing import SpanKind, span, start_trace
 from Constants import ReceiveEvent, SendEvent, General, DbKey, ServerLoggerName
-from server import socketio, redis_db
+from server import socketio, redis_db, command_transport, state_snapshot_cache
 
 logger = logging.getLogger(ServerLoggerName.EVENTS.value)
 
 @socketio.on(ReceiveEvent.CONNECT.value)
 def on_connect():
-	_read_from_redis_and_emit(DbKey.SONOS_SETUP, SendEvent.SONOS_SETUP)
-	_read_from_redis_and_emit(DbKey.CURRENT_TRACK, SendEvent.CURRENT_TRACK)
-	_read_from_redis_and_emit(DbKey.PLAYER_STATE, SendEvent.PLAYER_STATE)
-	_read_from_redis_and_emit(DbKey.PLAYLIST, SendEvent.PLAYLIST_CHANGED)
+	snapshot = state_snapshot_cache.get()
+	_emit_from_snapshot(snapshot, DbKey.SONOS_SETUP, SendEvent.SONOS_SETUP)
+	_emit_from_snapshot(snapshot, DbKey.CURRENT_TRACK, SendEvent.CURRENT_TRACK)
+	_emit_from_snapshot(snapshot, DbKey.PLAYER_STATE, SendEvent.PLAYER_STATE)
+	_emit_from_snapshot(snapshot, DbKey.PLAYLIST, SendEvent.PLAYLIST_CHANGED)
+	if DbKey.PLAYBACK_CLOCK in snapshot:
+		_emit_playback_clock(snapshot[DbKey.PLAYBACK_CLOCK])
 
 
-def _read_from_redis_and_emit(db_key: DbKey, event: SendEvent):
-	redis_value = redis_db.get(db_key.value)
-	redis_value = json.loads(redis_value)
-	logger.debug("For key %s value read from redis is %s", db_key.value, redis_value)
-	emit(event.value, redis_value)
+@socketio.on(ReceiveEvent.REQUEST_PLAYLIST.value)
+def request_playlist(data) -> None:
+	# requested by clients which missed a playlist delta
+	_emit_from_snapshot(state_snapshot_cache.get(), DbKey.PLAYLIST, SendEvent.PLAYLIST_CHANGED)
+
+
+def _emit_from_snapshot(snapshot: Dict[DbKey, str], db_key: DbKey, event: SendEvent):
+	payload = snapshot.get(db_key)
+	if payload is None:
+		logger.warning("No value for key %s found in redis.", db_key.value)
+		return
+	logger.debug("For key %s value from snapshot is %s", db_key.value, payload)
+	# payloads of the snapshot are pre-serialized JSON and are sent as is
+	emit(event.value, payload)
+
+
+def _emit_playback_clock(payload: str):
+	playback_clock = json.loads(payload)
+	# server and player share the clock, clients derive the player time from the time of reception
+	now = int(time.time() * 1000)
+	playback_clock[General.PLAYBACK_CLOCK_POSITION] += int(playback_clock[General.PLAYBACK_CLOCK_RATE] *
+														   (now - playback_clock[General.PLAYBACK_CLOCK_TIMESTAMP]))
+	playback_clock[General.PLAYBACK_CLOCK_TIMESTAMP] = now
+	emit(SendEvent.PLAYBACK_CLOCK.value, playback_clock)
 
 
 @socketio.on(ReceiveEvent.SET_VOLUME.value)
@@ -95,12 +121,14 @@ def publish_on_search_channel(event: ReceiveEvent, data):
 
 
 def publish_on_redis(channel_name: str, event: ReceiveEvent, data):
+	received_at = time.time()
 	sid = flask.request.sid
-	logger.debug("Publishing event '%s' on redis channel '%s'. payload %s (sid: %s)", event.value, channel_name, data, sid)
-	redis_db.publish(channel_name,
-					 json.dumps({General.EVENT_NAME: event.value,
-								General.EVENT_PAYLOAD: json.loads(data),
-								General.SID: sid}))
+	# the trace of the command is continued by the player
+	with start_trace('receive ' + event.value, kind=SpanKind.SERVER, event=event.value, sid=sid) as span_context:
+		logger.debug("Publishing event '%s' on redis channel '%s'. payload %s (sid: %s, trace: %s)", event.value,
+					 channel_name, data, sid, span_context.trace_id)
+		with span('publish', kind=SpanKind.PRODUCER, channel=channel_name):
+			publish_command(redis_db, command_transport, channel_name, event.value, json.loads(data), sid, received_at)
 
 
 def emit_player_state_change(event_received: ReceiveEvent):
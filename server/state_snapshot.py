@@ -0,0 +1,113 @@
+import json
+import logging
+import time
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+import redis
+
+from Codec import decode_to_json_text
+from Constants import General, DbKey, ServerLoggerName
+
+LISTENER_RECONNECT_DELAY_IN_SECONDS = 1
+
+logger = logging.getLogger(ServerLoggerName.STATE_SNAPSHOT.value)
+
+
+# JSON text which is embedded as is into socket.io packets, such that cached values are not decoded and encoded again
+class PreSerializedPayload(str):
+	pass
+
+
+# json module of the socket.io server, which encodes packets containing pre-serialized payloads
+class PreSerializedPayloadJson:
+
+	@staticmethod
+	def dumps(obj, *args, **kwargs) -> str:
+		if isinstance(obj, list) and any(isinstance(item, PreSerializedPayload) for item in obj):
+			return '[' + ','.join(item if isinstance(item, PreSerializedPayload) else json.dumps(item, *args, **kwargs)
+								  for item in obj) + ']'
+		return json.dumps(obj, *args, **kwargs)
+
+	@staticmethod
+	def loads(s, *args, **kwargs):
+		return json.loads(s, *args, **kwargs)
+
+
+# Caches the values sent to connecting clients in memory. The player publishes the key of each changed value on the
+# state invalidation channel, invalidated values are read again (with a single MGET) on the next connect.
+# Each invalidation increments the generation of the key, such that a value read concurrently with an invalidation
+# is not cached. Values are read from redis on every connect while the invalidation listener is not subscribed.
+# Values which are not stored under their key (e.g. the playlist) are read by a loader, which returns JSON text.
+class StateSnapshotCache:
+
+	def __init__(self, db: redis.Redis, keys: List[DbKey], loaders: Dict[DbKey, Callable[[], Optional[str]]]):
+		self._db = db
+		self._keys = keys
+		self._loaders = loaders
+		self._payloads: Dict[DbKey, PreSerializedPayload] = {}
+		self._generations: Dict[DbKey, int] = {key: 0 for key in keys}
+		self._lock = Lock()
+		self._listening = False
+		self._hits = 0
+		self._misses = 0
+
+	def get(self) -> Dict[DbKey, PreSerializedPayload]:
+		with self._lock:
+			if self._listening:
+				stale_keys = [key for key in self._keys if key not in self._payloads]
+			else:
+				stale_keys = list(self._keys)
+			generations = dict(self._generations)
+			payloads = dict(self._payloads)
+			self._hits = self._hits + len(self._keys) - len(stale_keys)
+			self._misses = self._misses + len(stale_keys)
+		if stale_keys:
+			values = self._read(stale_keys)
+			with self._lock:
+				for key, value in zip(stale_keys, values):
+					if value is None:
+						continue
+					payloads[key] = PreSerializedPayload(value)
+					if self._listening and self._generations[key] == generations[key]:
+						self._payloads[key] = payloads[key]
+			logger.debug('State snapshot read from redis: %s (hits: %d, misses: %d)',
+						 [key.value for key in stale_keys], self._hits, self._misses)
+		return payloads
+
+	def _read(self, keys: List[DbKey]) -> List[Optional[str]]:
+		stored_keys = [key for key in keys if key not in self._loaders]
+		stored_values = self._db.mget([key.value for key in stored_keys]) if stored_keys else []
+		values = {key: self._loaders[key]() for key in keys if key in self._loaders}
+		for key, value in zip(stored_keys, stored_values):
+			values[key] = decode_to_json_text(value) if value is not None else None
+		return [values[key] for key in keys]
+
+	def invalidate(self, key_value: str) -> None:
+		with self._lock:
+			for key in self._keys:
+				if key.value == key_value:
+					self._generations[key] = self._generations[key] + 1
+					self._payloads.pop(key, None)
+
+	def listen(self) -> None:
+		while True:
+			pubsub = self._db.pubsub(ignore_subscribe_messages=True)
+			try:
+				pubsub.subscribe(General.QUEUE_CHANNEL_NAME_STATE_INVALIDATION)
+				# invalidations published while not subscribed are lost
+				self._set_listening(True)
+				for message in pubsub.listen():
+					self.invalidate(message['data'].decode('utf-8'))
+			except Exception:
+				logger.warning('State invalidation listener failed. Reconnecting ...', exc_info=True)
+			finally:
+				self._set_listening(False)
+				pubsub.close()
+			time.sleep(LISTENER_RECONNECT_DELAY_IN_SECONDS)
+
+	def _set_listening(self, listening: bool) -> None:
+		with self._lock:
+			self._listening = listening
+			self._payloads.clear()
+			self._generations = {key: generation + 1 for key, generation in self._generations.items()}
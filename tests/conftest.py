@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# the fakes of the offline benchmarks replace redis, VLC, Sonos and YouTube (requires package fakeredis)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fakes
+import offline_benchmark
+
+fakes.install_fakes(0, 0, 0, 2)
+
+
+@pytest.fixture
+def player_stack():
+	stack = offline_benchmark.PlayerStack(offline_benchmark.create_args({'youtube_api_key': 'fake'}))
+	yield stack
+	stack.stop()
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import Codec
+from Codec import CodecName, HEADER_MAGIC, decode, decode_to_json_text, encode
+
+VALUE = {'event_name': 'seek_to', 'payload': {'player_time': 1000, 'title': 'Fünf'}, 'sid': None}
+AVAILABLE_CODEC_NAMES = [codec.name for codec in Codec._codecs_by_id.values()]
+
+
+@pytest.fixture
+def codec(request, monkeypatch):
+	monkeypatch.setattr(Codec, '_codec', Codec.create_codec(request.param))
+	return Codec.get_codec()
+
+
+@pytest.mark.parametrize('codec', AVAILABLE_CODEC_NAMES, indirect=True)
+def test_encoded_payloads_start_with_the_header_of_the_codec(codec):
+	encoded = encode(VALUE)
+	assert encoded[:len(HEADER_MAGIC) + 2] == HEADER_MAGIC + bytes([Codec.HEADER_VERSION, codec.codec_id])
+	assert decode(encoded) == VALUE
+	assert json.loads(decode_to_json_text(encoded)) == VALUE
+
+
+@pytest.mark.parametrize('codec', AVAILABLE_CODEC_NAMES, indirect=True)
+def test_payloads_are_decoded_with_the_codec_of_their_header(codec):
+	for encoding_codec_name in AVAILABLE_CODEC_NAMES:
+		assert decode(Codec.create_codec(encoding_codec_name).encode(VALUE)) == VALUE
+
+
+def test_payloads_without_header_are_decoded_as_json():
+	legacy_payload = json.dumps(VALUE)
+	assert decode(legacy_payload) == VALUE
+	assert decode(legacy_payload.encode('utf-8')) == VALUE
+	assert decode_to_json_text(legacy_payload) == legacy_payload
+
+
+def test_payloads_with_unknown_header_version_or_codec_are_rejected():
+	with pytest.raises(ValueError):
+		decode(HEADER_MAGIC + bytes([Codec.HEADER_VERSION + 1, 1]) + b'{}')
+	with pytest.raises(ValueError):
+		decode(HEADER_MAGIC + bytes([Codec.HEADER_VERSION, 255]) + b'{}')
+
+
+def test_codecs_of_missing_packages_can_not_be_selected(monkeypatch):
+	monkeypatch.setattr(Codec, 'msgpack', None)
+	with pytest.raises(ValueError):
+		Codec.set_codec(CodecName.MSGPACK)
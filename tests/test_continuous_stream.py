@@ -0,0 +1,11 @@
+from player.ContinuousStream import LISTENER_QUEUE_SIZE_IN_FRAMES, StreamListener
+
+
+def test_full_listener_drops_only_its_oldest_frame():
+	listener = StreamListener('192.168.0.10', icy_metadata=False)
+	frames = [bytes([index % 256]) * 4 for index in range(LISTENER_QUEUE_SIZE_IN_FRAMES + 1)]
+	for frame in frames:
+		listener.put(frame)
+
+	assert listener.dropped_frames == 1
+	assert [listener.frames.get_nowait() for _ in range(listener.frames.qsize())] == frames[1:]
@@ -0,0 +1,78 @@
+import asyncio
+import sys
+import time
+
+import fakes
+
+from Codec import encode
+from Constants import General, ReceiveEvent, SendEvent
+from player import PlayerEventsConsumer, WorkerLane
+
+event_consumer_module = sys.modules[PlayerEventsConsumer.__module__]
+
+PLAY_DURATION_IN_SECONDS = 0.2
+
+
+class RecordingPlayer:
+
+	def __init__(self):
+		self.calls = []
+		self.player_times = []
+
+	def play(self, track) -> None:
+		# e.g. the resolution of the stream
+		time.sleep(PLAY_DURATION_IN_SECONDS)
+		self.calls.append('play')
+
+	def seek_to(self, player_time: int) -> int:
+		self.calls.append('seek')
+		self.player_times.append(player_time)
+		return player_time
+
+	def toggle_play_pause(self) -> None:
+		self.calls.append('toggle')
+
+
+def message(event: ReceiveEvent, payload: dict, sid: str = 'test-sid') -> dict:
+	return {'data': encode({General.EVENT_NAME: event.value, General.EVENT_PAYLOAD: payload, General.SID: sid})}
+
+
+def consume(player_stack, player, messages: list) -> None:
+	consumer = PlayerEventsConsumer(player_stack.args, player_stack.sonos_environment, player,
+									player_stack.track_factory, player_stack.playlist,
+									player_stack.worker_pool.lane(WorkerLane.COMMAND))
+
+	async def replay():
+		for m in messages:
+			yield m
+		# the consumer cancels pending events on stop
+		while consumer._queues_by_ordering_key:
+			await asyncio.sleep(0.001)
+		yield message(ReceiveEvent.STOP, {})
+	consumer._listen = replay
+	consumer.run()
+
+
+def test_seek_and_pause_are_applied_after_the_track_was_played(player_stack):
+	player = RecordingPlayer()
+	url = fakes.YOUTUBE_WATCH_URL + fakes.create_video_id(1)
+	consume(player_stack, player, [message(ReceiveEvent.PLAY_TRACK, {'url': url}),
+								   message(ReceiveEvent.SEEK_TO, {'player_time': 1000}),
+								   message(ReceiveEvent.TOGGLE_PLAY_PAUSE, {})])
+	assert player.calls == ['play', 'seek', 'toggle']
+
+
+def test_seeks_of_different_clients_are_not_coalesced(player_stack, monkeypatch):
+	emitted = []
+	monkeypatch.setattr(event_consumer_module, 'emit', lambda event, payload, sid=None, **kwargs:
+						emitted.append((event, payload, sid)))
+	# all seeks are queued within the window
+	player_stack.args.command_coalescing_window = 100
+	player = RecordingPlayer()
+	consume(player_stack, player, [message(ReceiveEvent.SEEK_TO, {'player_time': 1000}, 'sid-1'),
+								   message(ReceiveEvent.SEEK_TO, {'player_time': 1500}, 'sid-1'),
+								   message(ReceiveEvent.SEEK_TO, {'player_time': 2000}, 'sid-2'),
+								   message(ReceiveEvent.SEEK_TO, {'player_time': 2500}, 'sid-2')])
+	assert player.player_times == [1500, 2500]
+	assert emitted == [(SendEvent.PLAYER_TIME_UPDATE_ACTIVATION, 1500, 'sid-1'),
+					   (SendEvent.PLAYER_TIME_UPDATE_ACTIVATION, 2500, 'sid-2')]
@@ -0,0 +1,92 @@
+import asyncio
+import sys
+from typing import Tuple
+
+import redis
+
+from CommandBus import CONSUMER_GROUP_NAME, CommandTransport, get_stream_name, publish_command
+from Codec import decode
+from Constants import General, ReceiveEvent
+from player import PlayerEventsConsumer, WorkerLane
+
+event_consumer_module = sys.modules['player.EventConsumer']
+STREAM_NAME = get_stream_name(General.QUEUE_CHANNEL_NAME_PLAYER_COMMANDS)
+OTHER_CONSUMER_NAME = 'other-consumer'
+
+
+# a consumer of an empty stream, whose consumer group exists
+def create_consumer(player_stack) -> Tuple[redis.Redis, PlayerEventsConsumer]:
+	db = sys.modules['player']._db
+	db.delete(STREAM_NAME)
+	player_stack.args.command_transport = CommandTransport.STREAMS.value
+	consumer = PlayerEventsConsumer(player_stack.args, player_stack.sonos_environment, player_stack.player,
+									player_stack.track_factory, player_stack.playlist,
+									player_stack.worker_pool.lane(WorkerLane.COMMAND))
+	run(consumer, consumer._create_consumer_group)
+	return db, consumer
+
+
+def publish(db: redis.Redis, event: ReceiveEvent) -> None:
+	publish_command(db, CommandTransport.STREAMS, General.QUEUE_CHANNEL_NAME_PLAYER_COMMANDS, event.value, {}, None)
+
+
+# delivers all new entries to another consumer of the group, which does not acknowledge them
+def deliver_to_other_consumer(db: redis.Redis) -> None:
+	db.xreadgroup(CONSUMER_GROUP_NAME, OTHER_CONSUMER_NAME, {STREAM_NAME: '>'})
+
+
+def run(consumer: PlayerEventsConsumer, coroutine_function):
+	async def with_async_redis():
+		consumer._async_redis = event_consumer_module.async_redis.from_url(consumer._redis_url)
+		try:
+			return await coroutine_function()
+		finally:
+			await consumer._async_redis.aclose()
+	return asyncio.run(with_async_redis())
+
+
+def events_of(messages: list) -> list:
+	return [decode(message['data'])[General.EVENT_NAME] for message in messages]
+
+
+def pending_consumers(db: redis.Redis) -> list:
+	return [entry['consumer'].decode('utf-8') for entry in db.xpending_range(STREAM_NAME, CONSUMER_GROUP_NAME, '-', '+', 100)]
+
+
+def test_unacknowledged_entries_of_the_consumer_are_read_again_after_a_restart(player_stack):
+	db, consumer = create_consumer(player_stack)
+	publish(db, ReceiveEvent.NEXT_TRACK)
+	# delivered to the consumer before the restart
+	db.xreadgroup(CONSUMER_GROUP_NAME, consumer._consumer_name, {STREAM_NAME: '>'})
+	publish(db, ReceiveEvent.PREVIOUS_TRACK)
+
+	async def read_two_messages():
+		messages = []
+		async for message in consumer._listen_on_stream():
+			messages.append(message)
+			if len(messages) == 2:
+				return messages
+	assert events_of(run(consumer, read_two_messages)) == [ReceiveEvent.NEXT_TRACK.value,
+														   ReceiveEvent.PREVIOUS_TRACK.value]
+
+
+def test_idle_entries_of_other_consumers_are_reclaimed(player_stack, monkeypatch):
+	monkeypatch.setattr(event_consumer_module, 'PENDING_ENTRY_RECLAIM_MIN_IDLE_TIME_IN_MILLIS', 0)
+	db, consumer = create_consumer(player_stack)
+	publish(db, ReceiveEvent.NEXT_TRACK)
+	deliver_to_other_consumer(db)
+	assert events_of(run(consumer, consumer._reclaim_pending_entries)) == [ReceiveEvent.NEXT_TRACK.value]
+	assert pending_consumers(db) == [consumer._consumer_name]
+
+
+def test_entries_delivered_too_often_are_acknowledged_without_handling(player_stack, monkeypatch):
+	monkeypatch.setattr(event_consumer_module, 'PENDING_ENTRY_RECLAIM_MIN_IDLE_TIME_IN_MILLIS', 0)
+	monkeypatch.setattr(event_consumer_module, 'MAX_NUMBER_OF_DELIVERIES', 2)
+	db, consumer = create_consumer(player_stack)
+	publish(db, ReceiveEvent.NEXT_TRACK)
+	deliver_to_other_consumer(db)
+	# the second delivery, e.g. after the other consumer crashed while handling the entry
+	entry_id = db.xpending_range(STREAM_NAME, CONSUMER_GROUP_NAME, '-', '+', 1)[0]['message_id']
+	db.xclaim(STREAM_NAME, CONSUMER_GROUP_NAME, OTHER_CONSUMER_NAME, 0, [entry_id])
+	assert run(consumer, consumer._reclaim_pending_entries) == []
+	assert pending_consumers(db) == []
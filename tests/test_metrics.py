@@ -0,0 +1,70 @@
+import sys
+
+import pytest
+
+import Metrics
+from Metrics import LATENCY_BUCKETS_IN_SECONDS, Metric, MetricsRegistry, render_prometheus_metrics
+
+GAUGE_TTL_IN_SECONDS = 60
+
+
+@pytest.fixture
+def db(player_stack):
+	db = sys.modules['player']._db
+	db.flushdb()
+	return db
+
+
+def rendered_samples(db, metric: Metric) -> list:
+	return [line for line in render_prometheus_metrics(db).splitlines()
+			if line.startswith(metric.metric_name) and not line.startswith('#')]
+
+
+def test_histogram_is_rendered_with_cumulative_buckets(db):
+	registry = MetricsRegistry()
+	for value in [0.003, 0.02, 0.02, 100]:
+		registry.observe(Metric.TRACK_START_PHASE, {'phase': 'resolve'}, value)
+	registry.flush(db, 'player-1', GAUGE_TTL_IN_SECONDS)
+	samples = rendered_samples(db, Metric.TRACK_START_PHASE)
+	metric_name = Metric.TRACK_START_PHASE.metric_name
+	buckets = [str(bucket) for bucket in LATENCY_BUCKETS_IN_SECONDS] + ['+Inf']
+	expected_counts = [1 if bucket < 0.02 else 3 for bucket in LATENCY_BUCKETS_IN_SECONDS] + [4]
+	assert samples[:-2] == ['{}_bucket{{phase="resolve",le="{}"}} {}'.format(metric_name, bucket, count)
+							for bucket, count in zip(buckets, expected_counts)]
+	sum_sample, count_sample = samples[-2:]
+	assert sum_sample.startswith(metric_name + '_sum{phase="resolve"} ')
+	assert float(sum_sample.split(' ')[1]) == pytest.approx(100.043)
+	assert count_sample == metric_name + '_count{phase="resolve"} 4'
+
+
+def test_histograms_of_all_processes_are_accumulated(db):
+	for process_name in ['player-1', 'player-2']:
+		registry = MetricsRegistry()
+		registry.observe(Metric.TRACK_HANDOFF, {}, 2.2)
+		registry.flush(db, process_name, GAUGE_TTL_IN_SECONDS)
+	samples = rendered_samples(db, Metric.TRACK_HANDOFF)
+	assert Metric.TRACK_HANDOFF.metric_name + '_bucket{le="2.5"} 2' in samples
+	assert Metric.TRACK_HANDOFF.metric_name + '_count 2' in samples
+
+
+def test_gauges_are_rendered_per_process(db):
+	for process_name, value in [('player-1', 3), ('search-1', 5)]:
+		registry = MetricsRegistry()
+		registry.set_gauge(Metric.EXECUTOR_QUEUED_TASKS, {'lane': 'search'}, value)
+		registry.flush(db, process_name, GAUGE_TTL_IN_SECONDS)
+	metric_name = Metric.EXECUTOR_QUEUED_TASKS.metric_name
+	assert rendered_samples(db, Metric.EXECUTOR_QUEUED_TASKS) == [
+		metric_name + '{lane="search",process="player-1"} 3',
+		metric_name + '{lane="search",process="search-1"} 5']
+
+
+def test_statistics_of_components_are_rendered_as_gauges(db, player_stack):
+	player_module = sys.modules['player']
+	player_stack.search_result_cache.get('unknown search')
+	player_module._collect_statistics(Metric.SEARCH_RESULT_CACHE, player_stack.search_result_cache.get_statistics())
+	Metrics._registry.flush(db, 'player-1', GAUGE_TTL_IN_SECONDS)
+	metric_name = Metric.SEARCH_RESULT_CACHE.metric_name
+	assert rendered_samples(db, Metric.SEARCH_RESULT_CACHE) == [
+		metric_name + '{statistic="hits",process="player-1"} 0',
+		metric_name + '{statistic="misses",process="player-1"} 1',
+		metric_name + '{statistic="size",process="player-1"} 0']
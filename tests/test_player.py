@@ -0,0 +1,39 @@
+import sys
+import time
+from types import SimpleNamespace
+
+import offline_benchmark
+from player import PlayerStatus, ReceiveEvent
+
+player_module = sys.modules['player.Player']
+
+
+def end_track(player_stack, monkeypatch, during_network_caching=lambda: None) -> list:
+	published_events = []
+	monkeypatch.setattr(player_module, 'publish_on_player_command_channel',
+						lambda event, data: published_events.append(event))
+	monkeypatch.setattr(player_module, 'time',
+						SimpleNamespace(time=time.time, sleep=lambda seconds: during_network_caching()))
+	player_stack.player._get_track_end_callback()(None)
+	return published_events
+
+
+def create_track(player_stack, index: int):
+	return player_stack.track_factory.create_youtube_track_from_metadata(offline_benchmark.create_metadata(index))
+
+
+def test_end_of_track_plays_next_track(player_stack, monkeypatch):
+	player = player_stack.player
+	player.play(create_track(player_stack, 0))
+	assert end_track(player_stack, monkeypatch) == [ReceiveEvent.NEXT_TRACK]
+	assert player._track is player._null_track
+	assert player._player_state is PlayerStatus.STOPPED
+
+
+def test_track_started_after_end_of_track_is_not_skipped(player_stack, monkeypatch):
+	player = player_stack.player
+	player.play(create_track(player_stack, 0))
+	started_track = create_track(player_stack, 1)
+	assert end_track(player_stack, monkeypatch, lambda: player.play(started_track)) == []
+	assert player._track is started_track
+	assert player._player_state is PlayerStatus.PLAYING
@@ -0,0 +1,85 @@
+import random
+import sys
+import threading
+
+import fakes
+
+PLAYLIST_SIZE = 200
+OPERATIONS_PER_THREAD = 500
+
+
+def run_concurrently(*operations) -> list:
+	exceptions = []
+
+	def run(operation):
+		try:
+			for _ in range(OPERATIONS_PER_THREAD):
+				operation()
+		except Exception as e:
+			exceptions.append(e)
+	threads = [threading.Thread(target=run, args=(operation,)) for operation in operations]
+	# switch threads often, such that the operations interleave
+	switch_interval = sys.getswitchinterval()
+	sys.setswitchinterval(1e-5)
+	try:
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	finally:
+		sys.setswitchinterval(switch_interval)
+	return exceptions
+
+
+def test_concurrent_inserts_moves_and_index_lookups(player_stack):
+	player_stack.fill_playlist(PLAYLIST_SIZE)
+	playlist = player_stack.playlist
+	entries = list(playlist)
+	entry_ids = [str(entry.playlist_entry_id) for entry in entries]
+
+	def add():
+		playlist.add_track(fakes.YOUTUBE_WATCH_URL + fakes.create_video_id(random.randrange(PLAYLIST_SIZE)),
+						   random.randrange(PLAYLIST_SIZE))
+
+	def move():
+		playlist.change_track_position(random.choice(entry_ids), random.randrange(PLAYLIST_SIZE))
+
+	def set_current():
+		playlist.set_current_entry(random.choice(entries))
+
+	def look_up():
+		entry = random.choice(entries)
+		entry.status
+		assert 0 <= playlist._index_of(entry) < len(playlist)
+
+	assert run_concurrently(add, move, set_current, look_up, look_up) == []
+	assert len(playlist) == PLAYLIST_SIZE + OPERATIONS_PER_THREAD
+	assert [playlist._index_of(entry) for entry in playlist] == list(range(len(playlist)))
+
+
+def test_playlist_versions_are_written_within_an_open_write_batch(player_stack):
+	from player import write_batch
+	player_stack.fill_playlist(10)
+	playlist = player_stack.playlist
+	playlist._save_and_emit_snapshot()
+	with write_batch():
+		playlist.change_track_position(str(next(iter(playlist)).playlist_entry_id), 5)
+		# not deferred to the batch of the command, versions of other threads could overtake it
+		assert playlist._playlist_storage.read_version() == playlist._version
+
+
+def test_legacy_playlist_is_migrated_on_startup(player_stack):
+	from Codec import encode
+	from Constants import DbKey, General
+	from player import Playlist, PlaylistStorage, _db
+	player_stack.fill_playlist(10)
+	player_stack.playlist._save_and_emit_snapshot()
+	legacy_playlist = player_stack.playlist._create_snapshot()
+	_db.flushdb()
+	_db.set(DbKey.PLAYLIST.value, encode(legacy_playlist))
+	playlist = Playlist(player_stack.playlist_entry_factory, player_stack.track_refresh_scheduler,
+						player_stack.resolution_executor, PlaylistStorage(_db))
+	playlist.read_playlist_from_db(fast_start=True)
+	assert [entry.playlist_entry_id for entry in playlist] == [entry.playlist_entry_id for entry in player_stack.playlist]
+	# the migrated version is continued
+	assert playlist._version == legacy_playlist[General.PLAYLIST_VERSION] + 1
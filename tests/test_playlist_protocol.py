@@ -0,0 +1,106 @@
+import copy
+import sys
+
+import fakes
+
+from Constants import General, SendEvent
+from player import Playlist
+
+playlist_module = sys.modules[Playlist.__module__]
+ID = General.PLAYLIST_ENTRY_ID
+VERSION = General.PLAYLIST_VERSION
+ENTRIES = General.PLAYLIST_ENTRIES
+
+
+# applies snapshots and deltas like the web client (client/src/Playlist.tsx)
+class PlaylistClient:
+
+	def __init__(self, storage):
+		self._storage = storage
+		self.version = -1
+		self.entries = []
+		self.requested_snapshots = 0
+
+	def receive(self, event: SendEvent, payload: dict) -> None:
+		if event is SendEvent.PLAYLIST_CHANGED:
+			self._set_snapshot(payload)
+		elif event is SendEvent.PLAYLIST_DELTA:
+			self._apply_delta(payload)
+
+	def _set_snapshot(self, snapshot: dict) -> None:
+		self.version = snapshot[VERSION]
+		self.entries = snapshot[ENTRIES]
+
+	def _apply_delta(self, delta: dict) -> None:
+		if delta[VERSION] <= self.version:
+			return
+		if delta[VERSION] != self.version + 1:
+			# missed at least one delta, the server sends the stored snapshot on request
+			self.requested_snapshots = self.requested_snapshots + 1
+			self._set_snapshot(self._storage.read_snapshot())
+			return
+		for operation in delta['operations']:
+			if operation['op'] == 'insert':
+				self.entries.insert(operation['position'], operation['entry'])
+			elif operation['op'] == 'remove':
+				self.entries = [entry for entry in self.entries if entry[ID] != operation[ID]]
+			elif operation['op'] == 'move':
+				moved_entry = self.entries.pop(self._index_of(operation[ID]))
+				self.entries.insert(operation['position'], moved_entry)
+			elif operation['op'] == 'status':
+				entry = self.entries[self._index_of(operation[ID])]
+				entry['status'] = operation['status']
+				entry['track']['track_status'] = operation['track_status']
+			elif operation['op'] == 'update':
+				self.entries[self._index_of(operation['entry'][ID])] = operation['entry']
+		self.version = delta[VERSION]
+
+	def _index_of(self, entry_id: str) -> int:
+		return [entry[ID] for entry in self.entries].index(entry_id)
+
+
+def record_emits(monkeypatch) -> list:
+	emitted = []
+	# the payloads are serialized when they are emitted, later changes of the playlist must not change them
+	monkeypatch.setattr(playlist_module, 'emit', lambda event, payload, **kwargs:
+						emitted.append((event, copy.deepcopy(payload))))
+	return emitted
+
+
+def change_playlist(player_stack) -> None:
+	playlist = player_stack.playlist
+	entry_ids = [str(entry.playlist_entry_id) for entry in playlist]
+	playlist.add_track(fakes.YOUTUBE_WATCH_URL + fakes.create_video_id(100), 3)
+	playlist.change_track_position(entry_ids[1], 7)
+	playlist.delete_track(entry_ids[5])
+	playlist.set_current_entry(list(playlist)[4])
+	# the player notifies the playlist about the started track
+	playlist.player_status_changed(None, None, None)
+
+
+def test_deltas_applied_to_the_snapshot_result_in_the_playlist(player_stack, monkeypatch):
+	emitted = record_emits(monkeypatch)
+	player_stack.fill_playlist(10)
+	player_stack.playlist._save_and_emit_snapshot()
+	change_playlist(player_stack)
+	client = PlaylistClient(player_stack.playlist._playlist_storage)
+	for event, payload in emitted:
+		client.receive(event, payload)
+	versions = [payload[VERSION] for _, payload in emitted]
+	assert versions == list(range(versions[0], versions[0] + len(versions)))
+	assert client.requested_snapshots == 0
+	assert client.version == player_stack.playlist._version
+	assert client.entries == player_stack.playlist._create_snapshot()[ENTRIES]
+
+
+def test_client_which_missed_a_delta_recovers_with_the_stored_snapshot(player_stack, monkeypatch):
+	emitted = record_emits(monkeypatch)
+	player_stack.fill_playlist(10)
+	player_stack.playlist._save_and_emit_snapshot()
+	change_playlist(player_stack)
+	client = PlaylistClient(player_stack.playlist._playlist_storage)
+	for event, payload in emitted[:2] + emitted[3:]:
+		client.receive(event, payload)
+	assert client.requested_snapshots == 1
+	assert client.version == player_stack.playlist._version
+	assert client.entries == player_stack.playlist._create_snapshot()[ENTRIES]
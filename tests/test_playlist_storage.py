@@ -0,0 +1,68 @@
+import sys
+
+import pytest
+
+import PlaylistStorage as playlist_storage_module
+from Codec import encode
+from Constants import DbKey, General
+from PlaylistStorage import LEGACY_PLAYLIST_BACKUP_KEY, PlaylistStorage, get_entry_key
+
+ID = General.PLAYLIST_ENTRY_ID
+VERSION = General.PLAYLIST_VERSION
+ENTRIES = General.PLAYLIST_ENTRIES
+
+
+def create_entry(entry_id: str) -> dict:
+	return {ID: entry_id, 'status': 'waiting', 'track': {'title': 'Title ' + entry_id, 'duration': 180000}}
+
+
+@pytest.fixture
+def db(player_stack):
+	db = sys.modules['player']._db
+	db.flushdb()
+	return db
+
+
+def replace(db, version: int, entries: list) -> None:
+	pipeline = db.pipeline(transaction=True)
+	PlaylistStorage(db).replace(pipeline, version, [(entry[ID], entry) for entry in entries])
+	pipeline.execute()
+
+
+def test_snapshot_of_the_replaced_playlist(db):
+	storage = PlaylistStorage(db)
+	assert storage.read_snapshot() is None
+	entries = [create_entry(entry_id) for entry_id in 'abc']
+	replace(db, 3, entries)
+	assert storage.read_snapshot() == {VERSION: 3, ENTRIES: entries}
+	assert storage.read_version() == 3
+
+
+def test_replace_removes_the_entries_which_are_not_in_the_playlist_anymore(db):
+	replace(db, 1, [create_entry(entry_id) for entry_id in 'abc'])
+	entries = [create_entry(entry_id) for entry_id in 'cd']
+	replace(db, 2, entries)
+	assert PlaylistStorage(db).read_snapshot() == {VERSION: 2, ENTRIES: entries}
+	assert not db.exists(get_entry_key('a'), get_entry_key('b'))
+
+
+def test_entries_are_streamed_in_chunks_in_playlist_order(db, monkeypatch):
+	monkeypatch.setattr(playlist_storage_module, 'READ_CHUNK_SIZE', 2)
+	entries = [create_entry(entry_id) for entry_id in 'abcde']
+	replace(db, 1, entries)
+	assert list(PlaylistStorage(db).read_entries()) == entries
+
+
+@pytest.mark.parametrize('legacy_value, version', [
+	({VERSION: 7, ENTRIES: [create_entry('a'), create_entry('b')]}, 7),
+	# the oldest versions stored the list of entries without version
+	([create_entry('a'), create_entry('b')], 0)])
+def test_legacy_playlist_is_migrated_and_kept_as_backup(db, legacy_value, version):
+	storage = PlaylistStorage(db)
+	db.set(DbKey.PLAYLIST.value, encode(legacy_value))
+	assert storage.has_legacy_playlist()
+	assert storage.migrate_legacy_playlist() == 2
+	assert storage.read_snapshot() == {VERSION: version, ENTRIES: [create_entry('a'), create_entry('b')]}
+	assert not storage.has_legacy_playlist()
+	assert db.exists(LEGACY_PLAYLIST_BACKUP_KEY)
+	assert storage.migrate_legacy_playlist() is None
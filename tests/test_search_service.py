@@ -0,0 +1,28 @@
+import fakes
+
+from player import KeywordSearchMetadataSource, WorkerLane
+from player.SearchService import KeywordSearchResultIterator, SearchTask
+
+
+def find_search_result(player_stack, search_term: str) -> list:
+	from googleapiclient.discovery import build
+	search_task = SearchTask(search_term, 'test-sid', player_stack.track_factory,
+							 player_stack.worker_pool.lane(WorkerLane.SEARCH), player_stack.resolution_executor,
+							 build('youtube', 'v3', developerKey='fake'), player_stack.args.max_keyword_search_results,
+							 player_stack.search_result_cache, KeywordSearchMetadataSource.YOUTUBE_API)
+	return search_task._find_search_result()
+
+
+def test_cached_video_url_search_returns_the_video(player_stack):
+	video_id = fakes.create_video_id(1)
+	url = fakes.YOUTUBE_WATCH_URL + video_id
+	assert [track.get_video_id() for track in find_search_result(player_stack, url)] == [video_id]
+
+	cached_result = find_search_result(player_stack, url)
+	assert not isinstance(cached_result, KeywordSearchResultIterator)
+	assert [track.get_video_id() for track in cached_result] == [video_id]
+
+
+def test_cached_keyword_search_continues_the_keyword_search(player_stack):
+	assert isinstance(find_search_result(player_stack, 'some keywords'), KeywordSearchResultIterator)
+	assert isinstance(find_search_result(player_stack, 'some keywords'), KeywordSearchResultIterator)
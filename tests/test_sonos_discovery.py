@@ -0,0 +1,97 @@
+import queue
+import socket
+import time
+
+from player import SsdpListener, SsdpObserver
+from player.SonosDiscovery import SONOS_DEVICE_TYPE
+
+EVENT_TIMEOUT_IN_SECONDS = 5
+DEVICE_UID = 'RINCON_000E58A0B2C201400'
+
+
+class RecordingObserver(SsdpObserver):
+
+	def __init__(self, number_of_failing_calls: int):
+		self.events = queue.Queue()
+		self._number_of_failing_calls = number_of_failing_calls
+
+	def ssdp_device_alive(self, ip_address: str) -> None:
+		self.events.put(('alive', ip_address))
+		if self._number_of_failing_calls > 0:
+			self._number_of_failing_calls = self._number_of_failing_calls - 1
+			raise ConnectionError('Device at {} did not answer.'.format(ip_address))
+
+	def ssdp_device_gone(self, ip_address: str) -> None:
+		self.events.put(('gone', ip_address))
+
+	def next_event(self):
+		return self.events.get(timeout=EVENT_TIMEOUT_IN_SECONDS)
+
+
+# sends the announcements of a Sonos device to the listener
+class FakeSsdpResponder:
+
+	def __init__(self, port: int):
+		self._port = port
+		self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	def notify(self, nts: str, ip_address: str) -> None:
+		message = ('NOTIFY * HTTP/1.1\r\n'
+				   'HOST: 239.255.255.250:1900\r\n'
+				   'CACHE-CONTROL: max-age = 1800\r\n'
+				   'LOCATION: http://{}:1400/xml/device_description.xml\r\n'
+				   'NT: {}\r\n'
+				   'NTS: {}\r\n'
+				   'USN: uuid:{}::{}\r\n'
+				   '\r\n').format(ip_address, SONOS_DEVICE_TYPE, nts, DEVICE_UID, SONOS_DEVICE_TYPE)
+		self._socket.sendto(message.encode('utf-8'), ('127.0.0.1', self._port))
+
+	def close(self) -> None:
+		self._socket.close()
+
+
+def find_free_port() -> int:
+	with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+# the port can not be bound (without SO_REUSEADDR) once the listener listens on it
+def wait_until_listening(port: int) -> None:
+	deadline = time.monotonic() + EVENT_TIMEOUT_IN_SECONDS
+	while time.monotonic() < deadline:
+		with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+			try:
+				s.bind(('', port))
+			except OSError:
+				return
+		time.sleep(0.01)
+	raise TimeoutError('SSDP listener does not listen on port {}.'.format(port))
+
+
+def test_devices_are_added_again_if_the_observer_failed():
+	port = find_free_port()
+	observer = RecordingObserver(number_of_failing_calls=1)
+	# without multicast group, the searches are sent to the listen socket and ignored
+	listener = SsdpListener(observer, 3600, multicast_address='127.0.0.1', port=port)
+	listener.start()
+	wait_until_listening(port)
+	responder = FakeSsdpResponder(port)
+	try:
+		responder.notify('ssdp:alive', '192.168.0.10')
+		assert observer.next_event() == ('alive', '192.168.0.10')
+		# the first call of the observer failed
+		responder.notify('ssdp:alive', '192.168.0.10')
+		assert observer.next_event() == ('alive', '192.168.0.10')
+		# known device, ignored
+		responder.notify('ssdp:alive', '192.168.0.10')
+		responder.notify('ssdp:alive', '192.168.0.11')
+		assert observer.next_event() == ('gone', '192.168.0.10')
+		assert observer.next_event() == ('alive', '192.168.0.11')
+		responder.notify('ssdp:byebye', '192.168.0.11')
+		assert observer.next_event() == ('gone', '192.168.0.11')
+		assert observer.events.empty()
+	finally:
+		responder.close()
+		listener.stop()
+		listener.join()
@@ -0,0 +1,26 @@
+import fakes
+import offline_benchmark
+
+
+def test_coordinators_are_read_once_per_setup_change(player_stack, monkeypatch):
+	coordinator_reads = []
+
+	def is_coordinator(device) -> bool:
+		coordinator_reads.append(device.ip_address)
+		return device.group.coordinator is device
+	monkeypatch.setattr(fakes.FakeSoCo, 'is_coordinator', property(is_coordinator))
+	sonos_environment = player_stack.sonos_environment
+	track = player_stack.track_factory.create_youtube_track_from_metadata(offline_benchmark.create_metadata(1))
+	devices = fakes.discover_devices()
+
+	# e.g. play, unpause and seek
+	for _ in range(3):
+		sonos_environment.play_stream(track)
+	assert coordinator_reads == []
+	assert devices[0].played_uri
+
+	sonos_environment.ssdp_device_gone(devices[1].ip_address)
+	assert coordinator_reads == [devices[0].ip_address]
+	for _ in range(3):
+		sonos_environment.play_stream(track)
+	assert coordinator_reads == [devices[0].ip_address]
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
 import signal
+import tempfile
 import multiprocessing as mp
 import time
 from urllib import request, error
@@ -12,6 +14,7 @@ import redis
 from redis.exceptions import ConnectionError
 
 from Constants import General, ServerLoggerName, PlayerLoggerName
+from Tracing import TraceIdLogFilter
 from Util import StoppableThread
 
 
@@ -22,7 +25,10 @@ def init_logging(parsed_args: Namespace):
 		log_level = logging.INFO
 	if parsed_args.verbose > 1:
 		log_level = logging.DEBUG
-	logging.basicConfig(level=log_level, format='%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+	logging.basicConfig(level=log_level, format='%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+	# log records carry the ID of the trace of the command they belong to
+	for handler in logging.getLogger().handlers:
+		handler.addFilter(TraceIdLogFilter())
 
 	# prevent spamming of log on info level from engineio and socketio
 	if log_level == logging.INFO:
@@ -67,6 +73,143 @@ def parse_args() -> Namespace:
 																				'to fetch from YouTube for a particular search term. '
 																				'Limiting the number of fetched search '
 																				'results helps saving YouTube API quota.')
+	parser.add_argument('--video-metadata-cache-size', default=10000, type=int, help='The max number of YouTube videos '
+																				'whose metadata (title, author, duration, '
+																				'thumbnails) is cached in redis. Least '
+																				'recently used entries are evicted first. '
+																				'Set to 0 to disable the cache.')
+	parser.add_argument('--video-metadata-cache-max-age', default=7 * 24, type=int, help='The max age in hours of '
+																				'an entry in the YouTube video metadata '
+																				'cache.')
+	parser.add_argument('--audio-cache-size', default=1024, type=int, help='The max size in MB of the disk cache of '
+																		  'transcoded audio. Replayed and prefetched '
+																		  'tracks are played from the cache without '
+																		  'downloading and transcoding them again. Least '
+																		  'recently used tracks are evicted first. Set to 0 '
+																		  'to disable the cache.')
+	parser.add_argument('--audio-cache-dir', default=os.path.join(tempfile.gettempdir(), 'yousonos-audio-cache'),
+						help='Directory of the disk cache of transcoded audio.\nDefaults to:\n\t'
+							 + os.path.join(tempfile.gettempdir(), 'yousonos-audio-cache'))
+	parser.add_argument('--audio-cache-prefetch', default=2, type=int, help='The number of upcoming playlist tracks '
+																			 'that are transcoded into the audio cache in '
+																			 'the background while a track is playing.')
+	parser.add_argument('--next-track-preparation-lead-time', default=30, type=int, help='Number of seconds before '
+																				'the end of the playing track at which '
+																				'the stream of the next playlist entry '
+																				'is resolved and prepared.')
+	parser.add_argument('--playback-clock-beacon-interval', default=30, type=int, help='Interval in seconds in which '
+																					'the player time is sent to the clients '
+																					'while playing. Clients interpolate the '
+																					'player time in between.')
+	parser.add_argument('--track-refresh-workers', default=2, type=int, help='The max number of YouTube streams '
+																				'that are refreshed concurrently in the '
+																				'background before they expire.')
+	parser.add_argument('--resolution-workers', default=16, type=int, help='The max number of YouTube streams, '
+																			'tracks and search results that are '
+																			'resolved concurrently (youtube-dl and '
+																			'YouTube API calls).')
+	parser.add_argument('--search-workers', default=5, type=int, help='The max number of searches that are '
+																	   'processed concurrently.')
+	parser.add_argument('--persistence-workers', default=2, type=int, help='The max number of concurrent background '
+																			'writes to redis (video metadata and '
+																			'search result caches).')
+	parser.add_argument('--sonos-io-workers', default=16, type=int, help='The max number of concurrent calls to Sonos '
+																		  'devices. Should not be less than the number '
+																		  'of Sonos devices, such that all devices are '
+																		  'called at once.')
+	parser.add_argument('--sonos-call-timeout', default=5, type=int, help='Seconds after which a call to a Sonos device '
+																		   '(e.g. tuning to the stream, changing the volume) '
+																		   'is reported as failed. The other devices are not '
+																		   'affected.')
+	parser.add_argument('--sonos-discovery', default='periodic', choices=['periodic', 'incremental'],
+						help='Discovery of added and removed Sonos devices.\n'
+							 'periodic: discover all devices every \'--sonos-discovery-interval\' seconds.\n'
+							 'incremental: listen for announcements of Sonos devices (SSDP) and search for devices '
+							 'every \'--sonos-discovery-interval\' seconds.\n'
+							 'Defaults to:\n\tperiodic')
+	parser.add_argument('--sonos-discovery-interval', default=30, type=int, help='Interval in seconds of the Sonos '
+																				  'discovery.')
+	parser.add_argument('--command-workers', default=8, type=int, help='The max number of client commands (e.g. '
+																		'play / pause, volume changes, searches) '
+																		'that are handled concurrently.')
+	parser.add_argument('--command-coalescing-window', default=50, type=int, help='Milliseconds a volume change or a '
+																					 'seek is delayed to collect following '
+																					 'volume changes of the same device or '
+																					 'seeks. Only the newest value is applied. '
+																					 'Set to 0 to only coalesce commands '
+																					 'which queued up while a previous '
+																					 'command was handled.')
+	parser.add_argument('--worker-queue-size', default=1000, type=int, help='The max number of tasks waiting for a '
+																			 'worker per worker lane. Submitters block '
+																			 'while the queue of a lane is full.')
+	parser.add_argument('--worker-pool-statistics-interval', default=30, type=int, help='Interval in seconds in which the '
+																			 'utilization statistics of the worker '
+																			 'lanes are published in redis (key: \''
+																			 'worker_pool_statistics\').')
+	parser.add_argument('--trace-file', default=None, help='File to which the spans of the traces of the commands (from the '
+														   'reception by the server to the calls of the Sonos devices) are '
+														   'appended in the OTLP/JSON format. Tracing is disabled if neither '
+														   'a trace file nor an OTLP endpoint is given.')
+	parser.add_argument('--trace-otlp-endpoint', default=None, help='OTLP/HTTP endpoint to which the spans are exported '
+																	'(e.g. http://localhost:4318/v1/traces).')
+	parser.add_argument('--metrics-flush-interval', default=5, type=int, help='Interval in seconds in which the metrics '
+																	 'of the process (e.g. command latencies) are '
+																	 'added to the metrics in redis, which the server '
+																	 'exposes on /metrics.')
+	parser.add_argument('--search-result-cache-size', default=200, type=int, help='The max number of search terms '
+																				'whose results are cached in memory and '
+																				'shared between all clients. Set to 0 to '
+																				'disable the cache.')
+	parser.add_argument('--search-result-cache-ttl', default=12, type=int, help='The number of hours a cached search '
+																				'result is valid.')
+	parser.add_argument('--keyword-search-metadata-source', default='youtube-api', choices=['youtube-api', 'youtube-dl'],
+						help='Source of the metadata (title, author, duration, thumbnails) of keyword search results.\n'
+							 'youtube-api: fetch the metadata of all results of a page with one YouTube API call '
+							 '(costs 1 additional unit of API quota per page).\n'
+							 'youtube-dl: resolve each result with youtube-dl.\n'
+							 'Defaults to:\n\tyoutube-api')
+	parser.add_argument('--command-transport', default='pubsub', choices=['pubsub', 'streams'],
+						help='Transport of the commands from the server to the player and the search workers.\n'
+							 'pubsub: redis pub/sub, commands published while a consumer is not connected are lost.\n'
+							 'streams: redis streams with consumer groups, commands are acknowledged and redelivered '
+							 'if a consumer fails. Required for additional search worker processes.\n'
+							 'Defaults to:\n\tpubsub')
+	parser.add_argument('--codec', default='json', choices=['json', 'orjson', 'msgpack'],
+						help='Encoding of the commands and of the state stored in redis.\n'
+							 'json: stdlib json.\n'
+							 'orjson: faster JSON encoding and decoding (requires package orjson).\n'
+							 'msgpack: compact binary encoding (requires package msgpack).\n'
+							 'Payloads of all codecs (and JSON of versions without codec) are decoded by every '
+							 'process, such that the codec of a deployment can be changed process by process.\n'
+							 'Defaults to:\n\tjson')
+	parser.add_argument('--migrate-playlist', action='store_true', help='Convert the playlist stored by versions before '
+																		   'per entry playlist storage and exit. The '
+																		   'player must not be running. The player '
+																		   'converts the playlist on startup as well. '
+																		   'The converted playlist is kept in redis '
+																		   '(key: \'playlist_backup\').')
+	parser.add_argument('--fast-start', action='store_true', help='Show the stored playlist immediately after startup '
+																	'and resolve its tracks in the background (current '
+																	'track first, then the upcoming tracks) instead of '
+																	'resolving all tracks and loading the current track '
+																	'before the player accepts commands.')
+	parser.add_argument('--output-stream-mode', default='per-track', choices=['per-track', 'continuous'],
+						help='How the audio is streamed to the Sonos speakers.\n'
+							 'per-track: VLC serves the stream of each track, the Sonos speakers are tuned to the '
+							 'stream again on every track change and seek (seconds of silence each time).\n'
+							 'continuous: the player serves one long-lived stream on port '
+							 + str(General.VLC_OUT_STREAM_DEFAULT_PORT) + ', into which all tracks are spliced. '
+							 'The Sonos speakers stay connected across track changes and seeks. Unless \'' + vlc_command +
+							 '\' is given, VLC transcodes with:\n\t' + General.VLC_CONTINUOUS_TRANSCODE_CMD +
+							 '\nDefaults to:\n\tper-track')
+	parser.add_argument('--continuous-stream-source-url', default=General.CONTINUOUS_STREAM_SOURCE_URL,
+						help='URL of the stream of the current track served by VLC, which is spliced into the '
+							 'continuous output stream. Must match \'' + vlc_command + '\'.\nDefaults to:\n\t'
+							 + General.CONTINUOUS_STREAM_SOURCE_URL)
+	parser.add_argument('--search-worker', action='store_true', help='Run an additional search worker process of an '
+																	 'already running YouSonos instance instead of the '
+																	 'player and the server. Requires '
+																	 '\'--command-transport streams\'.')
 	return parser.parse_args()
 
 
@@ -108,6 +251,29 @@ def player_main(parsed_args: Namespace) -> List[StoppableThread]:
 	return threads
 
 
+def search_worker_main(parsed_args: Namespace) -> List[StoppableThread]:
+	logging = init_logging(parsed_args)
+	main_logger = logging.getLogger(PlayerLoggerName.MAIN.value)
+	main_logger.info('Starting youSonos search worker ...')
+	wait_for_redis(main_logger)
+	from player import initialize_search_worker
+	threads = initialize_search_worker(parsed_args)
+	main_logger.info('youSonos search worker successfully started.')
+	return threads
+
+
+def migrate_playlist_main(parsed_args: Namespace) -> None:
+	logging = init_logging(parsed_args)
+	main_logger = logging.getLogger(PlayerLoggerName.MAIN.value)
+	wait_for_redis(main_logger)
+	from PlaylistStorage import PlaylistStorage
+	number_of_entries = PlaylistStorage(redis.from_url(parsed_args.redis_url)).migrate_legacy_playlist()
+	if number_of_entries is None:
+		print("No playlist to migrate found")
+	else:
+		print("Playlist with {} entries migrated".format(number_of_entries))
+
+
 def server_main(parsed_args: Namespace) -> NoReturn:
 	logging = init_logging(parsed_args)
 	main_logger = logging.getLogger(ServerLoggerName.MAIN.value)
@@ -136,11 +302,21 @@ def wait_for_server(parsed_args) -> None:
 if __name__ == '__main__':
 	mp.set_start_method('spawn')
 	parsed_args = parse_args()
-	player_threads = player_main(parsed_args)
-	signal.signal(signal.SIGINT, get_exit_signal_handler(player_threads))
-	mp.Process(target=server_main, args=(parsed_args,)).start()
-	wait_for_server(parsed_args)
-	for pt in player_threads:
-		pt.join()
-	print("YouSonos terminated")
-
+	if parsed_args.migrate_playlist:
+		migrate_playlist_main(parsed_args)
+	elif parsed_args.search_worker:
+		if parsed_args.command_transport != 'streams':
+			raise SystemExit('A search worker requires \'--command-transport streams\'.')
+		search_worker_threads = search_worker_main(parsed_args)
+		signal.signal(signal.SIGINT, get_exit_signal_handler(search_worker_threads))
+		for t in search_worker_threads:
+			t.join()
+		print("YouSonos search worker terminated")
+	else:
+		player_threads = player_main(parsed_args)
+		signal.signal(signal.SIGINT, get_exit_signal_handler(player_threads))
+		mp.Process(target=server_main, args=(parsed_args,)).start()
+		wait_for_server(parsed_args)
+		for pt in player_threads:
+			pt.join()
+		print("YouSonos terminated")